@@ -0,0 +1,236 @@
+import argparse
+import csv
+import glob
+import importlib.util
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+import typing
+
+from instrumentation import Profile
+from shift_scheduling import InfeasibleError, Variables, build_cqm, call_solver, make_schedule, options, worker_ids
+
+# fork はワーカーに設定を渡すときに読み込み済みのモジュールを使い回す
+_context = multiprocessing.get_context(
+    'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def load_jobs(path: str) -> typing.List[typing.Tuple[str, dict]]:
+    """ディレクトリ（*.json を１ファイル１件）か JSONL（１行１件）から (ジョブID, 設定) のリストを読む
+
+    設定は options との差分。'id' があればジョブIDにし（なければファイル名か行番号）、設定からは除く。
+    """
+    jobs = []
+    if os.path.isdir(path):
+        for file in sorted(glob.glob(os.path.join(path, '*.json'))):
+            with open(file, encoding='utf-8') as f:
+                job = json.load(f)
+            jobs.append((str(job.pop('id', os.path.splitext(os.path.basename(file))[0])), job))
+    else:
+        with open(path, encoding='utf-8') as f:
+            for n, line in enumerate(f, 1):
+                if line.strip():
+                    job = json.loads(line)
+                    jobs.append((str(job.pop('id', n)), job))
+    ids = [job_id for job_id, _ in jobs]
+    if len(set(ids)) < len(ids):
+        raise ValueError("ジョブIDが重複しています")
+    return jobs
+
+
+def classify_error(e: Exception) -> dict:
+    """解けなかったときの例外を結果の status, conditions, error にする
+
+    InfeasibleError は 'infeasible'（矛盾する条件が conditions）、ほかの RuntimeError は 'no_solution'、
+    そのほかは 'error'。
+    """
+    if isinstance(e, InfeasibleError):
+        return dict(status='infeasible', conditions=e.conditions, error=str(e))
+    if isinstance(e, RuntimeError):
+        return dict(status='no_solution', error=str(e))
+    return dict(status='error', error=''.join(traceback.format_exception_only(type(e), e)).strip())
+
+
+def solve_job(job_id: str, overrides: dict) -> dict:
+    """１件の設定を解いて結果を辞書で返す（例外は status と error にする）"""
+    t = time.perf_counter()
+    profile = Profile()
+    result = dict(id=job_id, status='ok', objective=None, conditions=None, error=None)
+    try:
+        unknown = sorted(set(overrides) - set(options))
+        if unknown:
+            raise KeyError(f"unknown options: {', '.join(unknown)}")
+        opts = dict(options, **overrides)
+        vars = Variables(opts)
+        cqm = build_cqm(opts, vars, profile)
+        sample = call_solver(cqm, opts, profile=profile)
+        with profile.phase('make_schedule'):
+            schedule = make_schedule(sample, opts, vars)
+        result.update(objective=float(cqm.objective.energy(sample)), workers=worker_ids(opts),
+                      schedule=[''.join(map(str, row)) for row in schedule.to_array().tolist()])
+    except Exception as e:
+        result.update(classify_error(e))
+    result.update(wall_time=time.perf_counter() - t, profile=profile.to_dict())
+    return result
+
+
+def _run(job_id: str, overrides: dict, memory_mb: typing.Optional[int], results: multiprocessing.Queue):
+    if memory_mb:
+        try:
+            import resource
+            limit = memory_mb * 2 ** 20
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    results.put(solve_job(job_id, overrides))
+
+
+def run_batch(jobs: typing.List[typing.Tuple[str, dict]], num_workers: typing.Optional[int] = None,
+              time_limit: typing.Optional[float] = None, memory_mb: typing.Optional[int] = None,
+              grace_time: float = 30) -> typing.Iterator[dict]:
+    """ジョブをプロセスごとに並列に解き、終わった順に結果を返す
+
+    ジョブごとに別のプロセスで解くので、落ちたり（status='crashed'）時間を超えて止められたり（status='timeout'）
+    したジョブがあっても、ほかのジョブは続ける。
+
+    Args:
+        jobs: load_jobs の (ジョブID, 設定) のリスト。
+        num_workers: 同時に解く数（None: CPU数）。
+        time_limit: すべてのジョブの time_limit を置き換える（None: ジョブの設定のまま）。
+        memory_mb: ジョブごとのメモリの上限（MB、None: 上限なし、Unixのみ）。
+        grace_time: time_limit と explain_time_limit のほかに待つ秒数（CQMの構築など）。
+            これを過ぎたジョブは止める。
+    Yields:
+        solve_job の結果。
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    results = _context.Queue()
+    pending = list(reversed(jobs))
+    running: typing.Dict[str, tuple] = dict()
+
+    def start(job_id: str, overrides: dict):
+        if time_limit is not None:
+            overrides = dict(overrides, time_limit=time_limit)
+        opts = dict(options, **{k: v for k, v in overrides.items() if k in options})
+        deadline = time.monotonic() + opts['time_limit'] + opts['explain_time_limit'] + grace_time
+        p = _context.Process(target=_run, args=(job_id, overrides, memory_mb, results), daemon=True)
+        p.start()
+        running[job_id] = (p, deadline, time.perf_counter())
+
+    def failed(job_id: str, status: str, error: str) -> dict:
+        p, _, t = running.pop(job_id)
+        return dict(id=job_id, status=status, objective=None, conditions=None, error=error,
+                    wall_time=time.perf_counter() - t, profile=None)
+
+    try:
+        while pending or running:
+            while pending and len(running) < num_workers:
+                start(*pending.pop())
+            try:
+                result = results.get(timeout=0.2)
+            except queue.Empty:
+                result = None
+            if result is not None:
+                # 落ちたと判定した後に届いた結果は捨てる
+                if result['id'] in running:
+                    running.pop(result['id'])[0].join()
+                    yield result
+                continue
+
+            for job_id, (p, deadline, _) in list(running.items()):
+                if time.monotonic() >= deadline:
+                    p.terminate()
+                    p.join()
+                    yield failed(job_id, 'timeout', "time limit exceeded")
+                elif not p.is_alive() and p.exitcode != 0:
+                    yield failed(job_id, 'crashed', f"exit code {p.exitcode}")
+    finally:
+        for p, _, _ in running.values():
+            p.terminate()
+            p.join()
+
+
+# CSV・Parquetに出す処理時間（秒）
+_phases = ['precheck', 'add_constraints', 'presolve', 'tighten', 'cqm_to_mip', 'optimize', 'explain', 'make_schedule']
+_columns = (['id', 'status', 'objective', 'conditions', 'error', 'wall_time'] + [f'{p}_time' for p in _phases]
+            + ['nodes', 'gap', 'bound', 'schedule'])
+
+
+def _row(result: dict) -> dict:
+    """CSV・Parquetの１行（条件番号は空白区切り、勤務表は {ワーカーID: '0101...'} のJSON）"""
+    row = {k: result[k] for k in ['id', 'status', 'objective', 'error', 'wall_time']}
+    row['conditions'] = ' '.join(map(str, result['conditions'])) if result['conditions'] else None
+    profile = result['profile'] or dict(phases=dict(), solver=dict())
+    for name in _phases:
+        row[f'{name}_time'] = profile['phases'].get(name, dict()).get('wall')
+    for key in ('nodes', 'gap', 'bound'):
+        row[key] = profile['solver'].get(key)
+    row['schedule'] = (json.dumps(dict(zip(result['workers'], result['schedule'])), ensure_ascii=False)
+                       if result.get('schedule') else None)
+    return row
+
+
+class ResultWriter:
+    """結果を出力ファイルに書く（.jsonl と .csv は１件ごとに書き、.parquet は最後にまとめて書く）"""
+    def __init__(self, path: str):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lstrip('.').lower()
+        if self.format not in ('jsonl', 'csv', 'parquet'):
+            raise ValueError(f"出力ファイルの拡張子は .jsonl .csv .parquet のどれか: {path}")
+        if self.format == 'parquet' and not any(importlib.util.find_spec(m) for m in ('pyarrow', 'fastparquet')):
+            # 全部解いてから書けないと分からないように、先に調べる
+            raise ValueError(".parquet に書くには pyarrow か fastparquet が必要です")
+        self.rows = []
+        self.file = None
+        if self.format != 'parquet':
+            self.file = open(path, 'w', encoding='utf-8', newline='')
+        if self.format == 'csv':
+            self.csv = csv.DictWriter(self.file, _columns)
+            self.csv.writeheader()
+
+    def write(self, result: dict):
+        if self.format == 'jsonl':
+            self.file.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+        elif self.format == 'csv':
+            self.csv.writerow(_row(result))
+        else:
+            self.rows.append(_row(result))
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.format == 'parquet':
+            import pandas as pd
+            pd.DataFrame(self.rows, columns=_columns).to_parquet(self.path, index=False)
+        else:
+            self.file.close()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description="複数の設定の勤務表をまとめて作る")
+    parser.add_argument('jobs', help="設定のディレクトリ（*.json）か JSONL ファイル")
+    parser.add_argument('-o', '--output', default='results.jsonl', help="出力ファイル（.jsonl .csv .parquet）")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="同時に解く数（省略時: CPU数）")
+    parser.add_argument('-t', '--time-limit', type=float, default=None, help="ジョブごとの処理時間制限（秒）")
+    parser.add_argument('-m', '--memory', type=int, default=None, help="ジョブごとのメモリの上限（MB）")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.jobs)
+    writer = ResultWriter(args.output)
+    try:
+        for result in run_batch(jobs, args.workers, args.time_limit, args.memory):
+            writer.write(result)
+            print(f"{result['id']}: {result['status']} objective={result['objective']} "
+                  f"{result['wall_time']:.1f}s", file=sys.stderr)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+
+    # python batch_runner.py ジョブ.jsonl -o 結果.csv -j 4 -t 30 -m 2048
+    main()
@@ -0,0 +1,495 @@
+import collections
+import json
+import subprocess
+import sys
+import time
+
+from dimod import ConstrainedQuadraticModel
+
+from decomposition_solver import DecompositionCQMSolver
+from heuristic_solver import HeuristicCQMSolver
+from instrumentation import Profile
+from leap_client import FakeLeapSampler, LeapClient, set_leap_client
+from mip_solver import MIPCQMSolver
+from parameter_sweep import run_sweep
+from rolling_horizon import solve_rolling_horizon
+from shift_scheduling import (Schedule, Variables, build_cqm, call_solver, call_solver_pool, constraint_blocks,
+                              expand_sample, make_schedule, options, submit_solver, wd_chr, worker_ids, wrk_chr)
+
+def make_options(**kwargs) -> dict:
+    opts = dict(options)
+    opts.update(kwargs)
+    return opts
+
+def _constraint_key(constraint) -> tuple:
+    lhs = constraint.lhs
+    return (constraint.sense.value, float(constraint.rhs), float(lhs.offset),
+            tuple(sorted((v, float(b)) for v, b in lhs.iter_linear())))
+
+def same_model(cqm1: ConstrainedQuadraticModel, cqm2: ConstrainedQuadraticModel) -> bool:
+    """ラベル（乱数）と並び順を除いて同じモデルかどうか"""
+    return (set(cqm1.variables) == set(cqm2.variables)
+            and cqm1.objective.is_equal(cqm2.objective)
+            and collections.Counter(map(_constraint_key, cqm1.constraints.values()))
+                == collections.Counter(map(_constraint_key, cqm2.constraints.values())))
+
+def _build_time(opts: dict, repeat: int = 3) -> tuple:
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        cqm = build_cqm(opts, Variables(opts))
+        best = min(best, time.perf_counter() - t)
+    return best, cqm
+
+def builder_cases() -> dict:
+    return {
+        '1,5,6,7,9': make_options(num_workers=26, num_days=31, cond01_all_chk=True, cond05_chk=True,
+                                  cond06_all_chk=True, cond07_wrk_chk=True, cond07_hol_chk=True,
+                                  cond09_all_chk=True),
+        'all': make_options(num_workers=26, num_days=31, fst_dow=2,
+                            cond01_all_chk=True, cond01_sel_chk=True, cond01_sel_days=3, cond01_sel_wrks=['B', 'C'],
+                            cond02_all_chk=True, cond02_sel_chk=True, cond02_sel_cnt=3, cond02_sel_wrks=['A'],
+                            cond03_sel_chk=True, cond03_sel_wrks=['D', 'E'],
+                            cond04_all_chk=True, cond04_sel_chk=True, cond04_sel_wrks=['F'],
+                            cond05_chk=True,
+                            cond06_all_chk=True, cond06_sel_chk=True, cond06_sel_days=2, cond06_sel_wrks=['G'],
+                            cond07_wrk_chk=True, cond07_hol_chk=True, cond07_hol_cnt=10,
+                            cond08_all_chk=True, cond08_all_days=8, cond08_sel_chk=True, cond08_sel_wrks=['H'],
+                            cond09_all_chk=True, cond09_all_days=2,
+                            cond09_sel_chk=True, cond09_sel_days=4, cond09_sel_wrks=['I'],
+                            cond10_chk=True, cond10_wrks_A=['J', 'K', 'L'], cond10_wrks_B=['M', 'N'],
+                            cond11_chk=True, cond11_wrks_A=['O', 'P', 'Q'], cond11_wrks_C=['R', 'S'],
+                            cond12_chk=True, cond12_days=[1, 15, 31], cond12_wrks=['T', 'U'],
+                            cond13_chk=True, cond13_dows=['月', '金'], cond13_wrks=['V']),
+    }
+
+def bench_array_builder():
+    """配列で一括構築したCQMが従来と同じか確認し、構築時間を比べる"""
+    for name, opts in builder_cases().items():
+        t_old, cqm_old = _build_time(dict(opts, use_array_builder=False))
+        t_new, cqm_new = _build_time(dict(opts, use_array_builder=True, use_presolve=False,
+                                                    use_tightening=False))
+        assert same_model(cqm_old, cqm_new), name
+        print(f'[{name}] constraints={len(cqm_new.constraints)} '
+              f'expression={t_old * 1000:.1f}ms array={t_new * 1000:.1f}ms ({t_old / t_new:.1f}x)')
+
+def _solve(cqm: ConstrainedQuadraticModel, time_limit: float) -> tuple:
+    t = time.perf_counter()
+    sampleset = MIPCQMSolver.sample_cqm(cqm, time_limit=time_limit).filter(lambda d: d.is_feasible)
+    return time.perf_counter() - t, sampleset
+
+def bench_presolve(time_limit: float = 20):
+    """前処理あり／なしのモデルの大きさとCBCの求解時間を比べる"""
+    cases = {
+        '3,10,12,13': make_options(num_workers=26, num_days=31, cond03_sel_chk=True, cond03_sel_wrks=list('ABCDEFGHIJ'),
+                                   cond07_wrk_chk=True, cond07_wrk_cnt=12, cond01_all_chk=True, cond05_chk=True,
+                                   cond10_chk=True, cond10_wrks_A=list('KLMN'), cond10_wrks_B=list('OPQ'),
+                                   cond12_chk=True, cond12_days=list(range(10, 20)), cond12_wrks=list('RSTU'),
+                                   cond13_chk=True, cond13_dows=['水'], cond13_wrks=list('VWXYZ')),
+        '3(all),4,10': make_options(num_workers=26, num_days=31, cond03_all_chk=True, cond04_all_chk=True,
+                                    cond07_wrk_chk=True, cond10_chk=True, cond10_wrks_A=list('ABCDEF')),
+    }
+    for name, opts in cases.items():
+        full_opts = dict(opts, use_presolve=False)
+        full = build_cqm(full_opts, Variables(full_opts))
+        vars = Variables(opts)
+        reduced = build_cqm(opts, vars)
+        t_full, ss_full = _solve(full, time_limit)
+        t_reduced, ss_reduced = _solve(reduced, time_limit)
+        sample = expand_sample(ss_reduced.first.sample, vars)
+        assert full.check_feasible(sample), name
+        print(f'[{name}] variables {len(full.variables)} -> {len(reduced.variables)}, '
+              f'constraints {len(full.constraints)} -> {len(reduced.constraints)}, '
+              f'objective {ss_full.first.energy} / {full.objective.energy(sample)}, '
+              f'solve {t_full:.2f}s -> {t_reduced:.2f}s')
+
+def bench_exclusion(time_limit: float = 60):
+    """11.の制約をグループで１本にした場合と２人ずつの場合の制約数とCBCの求解時間を比べる"""
+    for sizes in [(6, 6, 6), (10, 8, 8)]:
+        names = iter(wrk_chr)
+        groups = [[next(names) for _ in range(n)] for n in sizes]
+        opts = make_options(num_workers=26, num_days=31, cond11_chk=True,
+                            cond08_all_chk=True, cond08_all_days=3, cond01_all_chk=True, cond01_all_days=3,
+                            cond11_wrks_A=groups[0], cond11_wrks_B=groups[1], cond11_wrks_C=groups[2])
+        for pairwise in (True, False):
+            opts['use_pairwise_exclusion'] = pairwise
+            cqm = build_cqm(opts, Variables(opts))
+            t, sampleset = _solve(cqm, time_limit)
+            energy = sampleset.first.energy if len(sampleset) else None
+            print(f'[groups {sizes}] {"pairwise" if pairwise else "clique  "} '
+                  f'constraints={len(cqm.constraints)} objective={energy} solve={t:.2f}s')
+
+def bench_heuristic(time_limits=(0.5, 1, 5), seeds=range(5)):
+    """同じ時間でヒューリスティックとCBCの目的関数値と実行可能解の割合を比べる"""
+    cases = {
+        '1,4,5,7': make_options(num_workers=26, num_days=31, cond01_all_chk=True, cond04_all_chk=True, cond04_all_cnt=9,
+                                cond05_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=18),
+        '2,6,7,8': make_options(num_workers=26, num_days=31, cond02_all_chk=True, cond02_all_cnt=2, cond06_all_chk=True,
+                                cond07_wrk_chk=True, cond07_wrk_cnt=16, cond07_hol_chk=True, cond07_hol_cnt=12,
+                                cond08_all_chk=True, cond08_all_days=18),
+        '1,5,11,13': make_options(num_workers=26, num_days=31, cond01_all_chk=True, cond01_all_days=4, cond05_chk=True,
+                                  cond11_chk=True, cond11_wrks_A=list('ABCD'), cond11_wrks_B=list('EFG'),
+                                  cond13_chk=True, cond13_dows=['水'], cond13_wrks=list('HIJ')),
+    }
+    for name, opts in cases.items():
+        cqm = build_cqm(opts, Variables(opts))
+        for time_limit in time_limits:
+            energies = []
+            for seed in seeds:
+                sampleset = HeuristicCQMSolver.sample_cqm(cqm, time_limit=time_limit, seed=seed)
+                if sampleset.first.is_feasible:
+                    energies.append(sampleset.first.energy)
+            _, mip = _solve(cqm, time_limit)
+            print(f'[{name}] {time_limit}s heuristic feasible={len(energies)}/{len(seeds)} '
+                  f'best={min(energies, default=None)} | CBC {mip.first.energy if len(mip) else None}')
+
+def bench_translation(time_limit: float = 5, repeat: int = 3):
+    """CQMからPython-MIPへの変換を一括（CSR）と１行ずつで比べ、同じ答えになるか確認する"""
+    for name, opts in builder_cases().items():
+        cqm = build_cqm(opts, Variables(opts))
+        times = dict()
+        for bulk in (False, True):
+            best = float('inf')
+            for _ in range(repeat):
+                t = time.perf_counter()
+                model, _ = MIPCQMSolver._build_model(cqm, bulk=bulk)
+                best = min(best, time.perf_counter() - t)
+            times[bulk] = best
+        # 同じ左辺の制約（上下限）は１つの行にまとまる
+        num_rows = len(MIPCQMSolver._csr_arrays(cqm)['row_lb'])
+        assert model.num_rows == num_rows and model.num_cols == len(cqm.variables), name
+
+        results = {bulk: MIPCQMSolver.sample_cqm(cqm, time_limit=time_limit, bulk=bulk, seed=0)
+                   for bulk in (False, True)}
+        feasible = {bulk: ss.filter(lambda d: d.is_feasible) for bulk, ss in results.items()}
+        energies = {bulk: ss.first.energy if len(ss) else None for bulk, ss in feasible.items()}
+        print(f'[{name}] variables={len(cqm.variables)} constraints={len(cqm.constraints)} '
+              f'per-row={times[False] * 1000:.1f}ms bulk={times[True] * 1000:.1f}ms '
+              f'({times[False] / times[True]:.1f}x) | objective {energies[False]} / {energies[True]}')
+
+def bench_decode(time_limit: float = 5, repeat: int = 20):
+    """解からの勤務表の取り出しを式の評価（従来）と配列と比べ、メモリと検査も確認する"""
+    for name, opts in builder_cases().items():
+        vars = Variables(opts)
+        cqm = build_cqm(opts, vars)
+        _, sampleset = _solve(cqm, time_limit)
+        if not len(sampleset):
+            continue
+        sample = sampleset.first.sample
+
+        t = time.perf_counter()
+        for _ in range(repeat):
+            full = expand_sample(sample, vars)
+            old = [[wd_chr[int(vars.wd[w, d].energy(full))] for d in range(opts['num_days'])]
+                   for w in range(opts['num_workers'])]
+        t_old = (time.perf_counter() - t) / repeat
+        t = time.perf_counter()
+        for _ in range(repeat):
+            schedule = make_schedule(sample, opts, vars)
+        t_new = (time.perf_counter() - t) / repeat
+        df = schedule.to_df()
+        assert df.values.tolist() == old, name
+
+        blocks = constraint_blocks(opts, vars)
+        assert schedule.is_valid(opts, blocks), name
+        arr = schedule.to_array()
+        arr[0] ^= 1
+        flipped = Schedule.from_array(arr, opts['fst_dow'])
+        assert flipped.distance(schedule) == opts['num_days'] == flipped.diff(schedule).sum(), name
+        print(f'[{name}] decode expression={t_old * 1000:.1f}ms array={t_new * 1000:.2f}ms '
+              f'({t_old / t_new:.0f}x) | DataFrame {df.memory_usage(deep=True).sum()} bytes, '
+              f'packed {schedule.bits.nbytes} bytes | flipped row violates {flipped.violations(opts, blocks)}')
+
+def bench_rolling(num_months=(1, 3, 6, 12), time_limit: float = 5):
+    """長期計画の月数と時間を比べ、月をまたいで 1. 5. 6. 9. を満たすか確認する"""
+    opts = make_options(num_workers=20, time_limit=time_limit,
+                        cond01_all_chk=True, cond01_all_days=5, cond05_chk=True,
+                        cond02_all_chk=True, cond02_all_cnt=1, cond04_all_chk=True, cond04_all_cnt=8,
+                        cond06_all_chk=True, cond06_all_days=2, cond07_wrk_chk=True, cond07_wrk_cnt=12,
+                        cond07_hol_chk=True, cond07_hol_cnt=8, cond09_all_chk=True, cond09_all_days=3)
+    for n in num_months:
+        t = time.perf_counter()
+        schedule = solve_rolling_horizon(opts, 2024, 11, n)
+        elapsed = time.perf_counter() - t
+
+        # 期間全体を１つの月として、境目に関係する条件だけ調べる
+        keys = ['cond01_all_chk', 'cond01_all_days', 'cond05_chk', 'cond06_all_chk', 'cond06_all_days',
+                'cond09_all_chk', 'cond09_all_days']
+        whole = make_options(num_workers=20, num_days=schedule.num_days, fst_dow=schedule.fst_dow,
+                             calendar_weeks=True, **{k: opts[k] for k in keys})
+        violations = schedule.violations(whole)
+        assert not violations, (n, violations)
+        print(f'[{n} months] days={schedule.num_days} time={elapsed:.1f}s ({elapsed / n:.2f}s/month) '
+              f'coverage min={schedule.coverage().min()}')
+
+def bench_workers(sizes=(26, 100, 500), legacy_max: int = 100):
+    """IDで指定した多人数（最大500人×31日）のCQMの構築と表示用の変換の時間を測る"""
+    for n in sizes:
+        ids = [f'E{w:04d}' for w in range(n)]
+        opts = make_options(num_workers=n, num_days=31, worker_ids=ids,
+                            cond01_all_chk=True, cond01_sel_chk=True, cond01_sel_days=3, cond01_sel_wrks=ids[::3],
+                            cond02_sel_chk=True, cond02_sel_wrks=ids[::5], cond04_sel_chk=True, cond04_sel_wrks=ids[1::4],
+                            cond05_chk=True, cond06_all_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=n // 2,
+                            cond08_sel_chk=True, cond08_sel_wrks=ids[2::3], cond09_sel_chk=True, cond09_sel_wrks=ids[::2],
+                            cond10_chk=True, cond10_wrks_A=ids[-4:], cond11_chk=True, cond11_wrks_A=ids[-10:-4],
+                            cond12_chk=True, cond12_days=[1, 15], cond12_wrks=ids[:n // 10],
+                            cond13_chk=True, cond13_dows=['水'], cond13_wrks=ids[n // 10:n // 5])
+        t = time.perf_counter()
+        vars = Variables(opts)
+        cqm = build_cqm(opts, vars)
+        t_build = time.perf_counter() - t
+
+        legacy = ''
+        if n <= legacy_max:
+            legacy_opts = dict(opts, use_array_builder=False)
+            t = time.perf_counter()
+            build_cqm(legacy_opts, Variables(legacy_opts))
+            legacy = f' expression={time.perf_counter() - t:.2f}s'
+
+        sample = {v: 1 for v in cqm.variables}
+        t = time.perf_counter()
+        df = make_schedule(sample, opts, vars).to_df(worker_ids(opts))
+        t_df = time.perf_counter() - t
+        assert df.index[-1] == ids[-1]
+        print(f'[{n} workers] variables={len(cqm.variables)} constraints={len(cqm.constraints)} '
+              f'array={t_build:.2f}s{legacy} | decode+DataFrame={t_df * 1000:.1f}ms')
+
+def bench_decomposition(sizes=(26, 100, 200, 500), time_limit: float = 30):
+    """多人数のCQMを分解（列生成）とPython-MIPで解いて時間と目的関数値を比べる
+
+    人ごとの条件（1. 2. 4. 5. 11.）が多く、人どうしをつなぐのは日ごとの人数（7.）だけのケース
+    """
+    for n in sizes:
+        opts = make_options(num_workers=n, num_days=31, cond01_all_chk=True, cond02_all_chk=True, cond02_all_cnt=1,
+                            cond04_all_chk=True, cond04_all_cnt=8, cond05_chk=True,
+                            cond07_wrk_chk=True, cond07_wrk_cnt=int(n * 0.6), cond07_hol_chk=True,
+                            cond07_hol_cnt=int(n * 0.4), cond11_chk=True, cond11_wrks_A=['A', 'B', 'C'])
+        cqm = build_cqm(opts, Variables(opts))
+
+        t = time.perf_counter()
+        sampleset = DecompositionCQMSolver().sample_cqm(cqm, time_limit=time_limit)
+        t_dec = time.perf_counter() - t
+        feasible = sampleset.filter(lambda d: d.is_feasible)
+        t_mip, mip = _solve(cqm, time_limit)
+        print(f'[{n} workers] decomposition={t_dec:.1f}s objective='
+              f'{feasible.first.energy if len(feasible) else None} (bound {sampleset.info["lp_bound"]:.0f}, '
+              f'{sampleset.info["rounds"]} rounds, {sampleset.info["columns"]} columns) | '
+              f'mip={t_mip:.1f}s objective={mip.first.energy if len(mip) else None}')
+
+def bench_symmetry(num_workers: int = 24, days=(1, 2, 7, 0), time_limit: float = 120):
+    """全員が同じ設定で最適性の証明に時間のかかるケースで、辞書順で並べる制約なし／比べる日数ごとの時間を比べる
+
+    days の0はすべての日を比べる。
+    """
+    cases = {
+        '1,2,8': dict(cond01_all_chk=True, cond01_all_days=5, cond02_all_chk=True, cond02_all_cnt=1, cond08_all_chk=True,
+                      cond08_all_days=16, cond07_wrk_chk=True, cond07_wrk_cnt=18, cond07_hol_chk=True, cond07_hol_cnt=15),
+        '1,2,5,9': dict(cond01_all_chk=True, cond01_all_days=5, cond02_all_chk=True, cond02_all_cnt=2, cond05_chk=True,
+                        cond09_all_chk=True, cond09_all_days=4, cond07_wrk_chk=True, cond07_wrk_cnt=14,
+                        cond07_hol_chk=True, cond07_hol_cnt=11),
+        '1,2,5,8,9': dict(cond01_all_chk=True, cond01_all_days=5, cond02_all_chk=True, cond02_all_cnt=1, cond05_chk=True,
+                          cond08_all_chk=True, cond08_all_days=22, cond09_all_chk=True, cond09_all_days=5,
+                          cond07_wrk_chk=True, cond07_wrk_cnt=19, cond07_hol_chk=True, cond07_hol_cnt=12),
+    }
+    for name, case in cases.items():
+        results = []
+        for sym, ordering_days in [(False, 0)] + [(True, d) for d in days]:
+            opts = make_options(num_workers=num_workers, num_days=30, use_symmetry_ordering=sym,
+                                ordering_days=ordering_days, **case)
+            cqm = build_cqm(opts, Variables(opts))
+            t = time.perf_counter()
+            sampleset = MIPCQMSolver.sample_cqm(cqm, time_limit=time_limit)
+            label = f'{ordering_days or "all"}d' if sym else 'off'
+            results.append(f'{label}={time.perf_counter() - t:.1f}s {sampleset.info["status"]} '
+                           f'{sampleset.first.energy if len(sampleset) else None}/{sampleset.info.get("bound")}')
+        print(f'[{name} {num_workers} workers] ' + ' | '.join(results))
+
+def bench_conflicts(time_limit: float = 20):
+    """矛盾する条件の組み合わせで、答えがないと分かるまでの時間とメッセージを事前チェックあり／なしで比べる"""
+    cases = {
+        '3+7': dict(cond03_all_chk=True, cond07_hol_chk=True, cond07_hol_cnt=5),
+        '6+9': dict(cond06_all_chk=True, cond06_all_days=3, cond09_all_chk=True, cond09_all_days=5),
+        '4+8': dict(cond04_all_chk=True, cond04_all_cnt=10, cond08_all_chk=True, cond08_all_days=24),
+        '4+7': dict(cond04_all_chk=True, cond04_all_cnt=10, cond07_wrk_chk=True, cond07_wrk_cnt=16,
+                    cond07_hol_chk=True, cond07_hol_cnt=16),
+        '7+11': dict(cond11_chk=True, cond11_wrks_A=list('ABCDEFGH'), cond07_wrk_chk=True, cond07_wrk_cnt=14),
+        '2+7': dict(cond02_all_chk=True, cond02_all_cnt=3, cond07_hol_chk=True, cond07_hol_cnt=10),
+        '1+7 (MIP)': dict(cond01_all_chk=True, cond01_all_days=3, cond02_all_chk=True, cond02_all_cnt=2, cond05_chk=True,
+                          cond06_all_chk=True, cond06_all_days=1, cond07_wrk_chk=True, cond07_wrk_cnt=17,
+                          cond07_hol_chk=True, cond07_hol_cnt=10),
+    }
+    for name, case in cases.items():
+        results = []
+        for precheck in (False, True):
+            opts = make_options(num_workers=20, num_days=30, time_limit=time_limit, use_precheck=precheck, **case)
+            t = time.perf_counter()
+            try:
+                call_solver(build_cqm(opts, Variables(opts)), opts)
+                message = 'solved'
+            except RuntimeError as e:
+                message = str(e)
+            results.append(f'{time.perf_counter() - t:.2f}s {message}')
+        print(f'[{name}] off={results[0]} | on={results[1]}')
+
+def bench_alternatives(distances=(10, 30, 60), num_alternatives: int = 3, time_limit: float = 20):
+    """候補を複数作るときの時間・目的関数・候補どうしの違い（セル数）"""
+    for distance in distances:
+        opts = make_options(num_workers=20, num_days=30, time_limit=time_limit, num_alternatives=num_alternatives,
+                            alternative_distance=distance, cond01_all_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=14)
+        vars = Variables(opts)
+        cqm = build_cqm(opts, vars)
+        t = time.perf_counter()
+        samples = call_solver_pool(cqm, opts, vars)
+        elapsed = time.perf_counter() - t
+        schedules = [make_schedule(sample, opts, vars) for sample in samples]
+        distance_to_first = [s.distance(schedules[0]) for s in schedules[1:]]
+        objectives = [float(cqm.objective.energy(sample)) for sample in samples]
+        print(f'[d>={distance}] {elapsed:.2f}s n={len(samples)} objectives={objectives} distances={distance_to_first}')
+
+
+def bench_sweep(values=range(10, 19), time_limit: float = 20):
+    """7.の人数を変えて解くときの、値ごとに作り直す場合と run_sweep（右辺の入れ替えと初期解の引き継ぎ）の時間"""
+    base = dict(num_workers=20, num_days=30, time_limit=time_limit, explain_time_limit=0, cond01_all_chk=True,
+                cond04_all_chk=True, cond04_all_cnt=9, cond05_chk=True, cond07_wrk_chk=True, cond07_hol_chk=True,
+                cond07_hol_cnt=8)
+    t = time.perf_counter()
+    cold = []
+    for cnt in values:
+        opts = make_options(cond07_wrk_cnt=cnt, **base)
+        try:
+            cqm = build_cqm(opts, Variables(opts))
+            cold.append(float(cqm.objective.energy(call_solver(cqm, opts))))
+        except RuntimeError:
+            cold.append(None)
+    cold_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    results = run_sweep(make_options(**base), dict(cond07_wrk_cnt=list(values)))
+    sweep_time = time.perf_counter() - t
+    print(f'[rebuild] {cold_time:.2f}s objectives={cold}')
+    print(f'[sweep] {sweep_time:.2f}s objectives={[r["objective"] for r in results]} '
+          f'rebuilt={sum(r["rebuilt"] for r in results)}')
+
+
+_startup_script = '''
+import json, sys, time
+t = time.perf_counter()
+from shift_scheduling import Variables, build_cqm, call_solver, options
+import_time = time.perf_counter() - t
+loaded = [m for m in ('pandas', 'mip', 'dwave') if m in sys.modules]
+opts = dict(options, time_limit=5, cond01_all_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=14, **json.loads(sys.argv[1]))
+cqm = build_cqm(opts, Variables(opts))
+t = time.perf_counter()
+try:
+    call_solver(cqm, opts)
+    error = None
+except Exception as e:
+    error = type(e).__name__
+print(json.dumps(dict(import_time=import_time, loaded=loaded, solve_time=time.perf_counter() - t, error=error)))
+'''
+
+def bench_startup(repeat: int = 3):
+    """新しいプロセスで shift_scheduling を読み込む時間と、ソルバーごとの最初の solve の時間（ソルバーの読み込みを含む）"""
+    backends = {
+        'mip': dict(),
+        'heuristic': dict(use_heuristic_solver=True),
+        'decomposition': dict(use_decomposition=True),
+        'portfolio': dict(portfolio_size=2),
+        'leap': dict(use_cqm_solver=True),
+    }
+    for name, opts in backends.items():
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-c', _startup_script, json.dumps(opts)],
+                                 capture_output=True, text=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        best = min(runs, key=lambda r: r['solve_time'])
+        import_time = min(r['import_time'] for r in runs)
+        print(f"[{name}] import={import_time:.3f}s loaded={best['loaded']} first_solve={best['solve_time']:.3f}s"
+              + (f" error={best['error']}" if best['error'] else ''))
+
+
+def bench_leap(num_jobs: int = 4, latency: float = 3, time_limit: float = 2):
+    """遅延のある偽の Leap（FakeLeapSampler）で、量子コンピュータの問題を同時に投げたときと、
+    待つ間にPython-MIPで解いたときの時間、時間切れの扱い"""
+    sampler = FakeLeapSampler(latency=latency)
+    set_leap_client(LeapClient(lambda: sampler))
+    opts = make_options(num_workers=20, num_days=30, time_limit=time_limit, use_cqm_solver=True,
+                        cond01_all_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=12)
+    cqm = build_cqm(opts, Variables(opts))
+
+    t = time.perf_counter()
+    for _ in range(num_jobs):
+        call_solver(cqm, opts)
+    print(f'[sequential] {num_jobs} jobs {time.perf_counter() - t:.2f}s')
+
+    t = time.perf_counter()
+    futures = [submit_solver(cqm, opts) for _ in range(num_jobs)]
+    local = dict(opts, use_cqm_solver=False)
+    local_objective = float(cqm.objective.energy(call_solver(cqm, local)))
+    local_time = time.perf_counter() - t
+    objectives = [float(cqm.objective.energy(f.result())) for f in futures]
+    print(f'[concurrent] {num_jobs} jobs {time.perf_counter() - t:.2f}s peak={sampler.peak_running} '
+          f'objectives={objectives} | CBC meanwhile {local_time:.2f}s objective={local_objective}')
+
+    sampler = FakeLeapSampler(latency=latency)
+    set_leap_client(LeapClient(lambda: sampler, timeout_margin=0.5))
+    t = time.perf_counter()
+    try:
+        call_solver(cqm, opts)
+        message = 'solved'
+    except RuntimeError as e:
+        message = str(e)
+    print(f'[timeout] {time.perf_counter() - t:.2f}s cancelled={sampler.cancelled} {message}')
+    set_leap_client(None)
+
+
+def bench_tightening(sizes=(20, 100, 500), time_limit: float = 60):
+    """重複した制約と導ける制約を除く（use_tightening）ときの制約数・構築時間・求解時間"""
+    case = dict(cond01_all_chk=True, cond04_all_chk=True, cond05_chk=True, cond06_all_chk=True, cond08_all_chk=True,
+                cond08_all_days=16, cond09_all_chk=True, cond09_all_days=4)
+    for n in sizes:
+        results = []
+        for tightening in (False, True):
+            opts = make_options(num_workers=n, num_days=30, time_limit=time_limit, use_tightening=tightening,
+                                cond07_wrk_chk=True, cond07_wrk_cnt=int(n * 0.65), cond07_hol_chk=True,
+                                cond07_hol_cnt=int(n * 0.4), **case)
+            vars = Variables(opts)
+            profile = Profile()
+            t = time.perf_counter()
+            cqm = build_cqm(opts, vars, profile)
+            build_time = time.perf_counter() - t
+            t = time.perf_counter()
+            sample = call_solver(cqm, opts, profile=profile)
+            solve_time = time.perf_counter() - t
+            assert make_schedule(sample, opts, vars).is_valid(opts)
+            removed = {c: v['removed_by_tightening'] for c, v in profile.conditions.items()
+                       if v.get('removed_by_tightening')}
+            results.append(f'{len(cqm.constraints)} rows build={build_time:.2f}s solve={solve_time:.2f}s '
+                           f'objective={cqm.objective.energy(sample):g}' + (f' removed={removed}' if tightening else ''))
+        print(f'[{n} workers] off: {results[0]} | on: {results[1]}')
+
+
+benchmarks = {
+    'array_builder': bench_array_builder,
+    'presolve': bench_presolve,
+    'exclusion': bench_exclusion,
+    'heuristic': bench_heuristic,
+    'translation': bench_translation,
+    'decode': bench_decode,
+    'rolling': bench_rolling,
+    'workers': bench_workers,
+    'decomposition': bench_decomposition,
+    'symmetry': bench_symmetry,
+    'conflicts': bench_conflicts,
+    'alternatives': bench_alternatives,
+    'sweep': bench_sweep,
+    'startup': bench_startup,
+    'leap': bench_leap,
+    'tightening': bench_tightening,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        print(f'== {name} ==')
+        benchmarks[name]()
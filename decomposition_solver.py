@@ -0,0 +1,317 @@
+import collections
+import concurrent.futures
+import os
+import re
+import time
+import typing
+
+import dimod
+import mip
+import numpy as np
+
+from mip_solver import MIPCQMSolver
+
+
+def worker_block(v: dimod.typing.Variable) -> typing.Hashable:
+    """Group ``worker_{w}_...`` labels by ``w``. Other labels share one block."""
+    m = re.match(r'worker_(\d+)_', str(v))
+    return int(m.group(1)) if m else None
+
+
+class _Pricing:
+    """The local constraints of one block, shared by every block with the
+    same structure. Only the objective changes between solves.
+    """
+    def __init__(self, arrays: dict):
+        self.model = MIPCQMSolver._model_from_arrays(arrays, verbose=0)
+        self.vars = list(self.model.vars)
+
+    def solve(self, cost: np.ndarray) -> typing.Optional[np.ndarray]:
+        self.model.objective = mip.LinExpr(self.vars, cost.tolist())
+        status = self.model.optimize()
+        if status not in (mip.OptimizationStatus.OPTIMAL, mip.OptimizationStatus.FEASIBLE):
+            return None
+        return np.rint(MIPCQMSolver._solutions(self.model, self.vars)[0]).astype(np.int8)
+
+
+class DecompositionCQMSolver:
+    """Dantzig-Wolfe decomposition (column generation) for linear CQMs with
+    binary variables whose variables fall into blocks (e.g. workers) that
+    are linked by only a few constraints (e.g. daily headcount).
+
+    Constraints over the variables of a single block are kept in that
+    block's pricing problem; the others (coupling constraints) form a
+    master problem that picks one pattern (column) per block. Columns are
+    generated from the duals of the master's linear relaxation; blocks with
+    identical local constraints share one pricing model, and pricing
+    problems with the same costs are solved once. When no improving
+    column is left, or ``pricing_share`` of the time limit is used, the
+    columns the relaxation picks are fixed one round at a time with new
+    columns generated in between (diving). If that does not end in a
+    complete solution, the master is solved as an integer problem over
+    the generated columns (price-and-branch).
+
+    Args:
+        block_key: Maps a variable label to its block.
+        num_threads: Number of pricing problems solved at once (CBC runs
+            outside the GIL).
+        pricing_share: Fraction of ``time_limit`` spent generating columns.
+        max_rounds: Maximum number of column generation rounds.
+    """
+    def __init__(self, block_key: typing.Callable[[dimod.typing.Variable], typing.Hashable] = worker_block,
+                 num_threads: typing.Optional[int] = None, pricing_share: float = 0.5, max_rounds: int = 100):
+        self.block_key = block_key
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.pricing_share = pricing_share
+        self.max_rounds = max_rounds
+
+    def sample_cqm(self, cqm: dimod.ConstrainedQuadraticModel,
+                   time_limit: float = float('inf'),
+                   initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                   ) -> dimod.SampleSet:
+        """Solve a constrained quadratic model block by block.
+        Args:
+            cqm: A constrained quadratic model with binary variables and
+                linear objective and constraints.
+            time_limit: The maximum time in seconds to search.
+            initial_state: A solution whose patterns are added as initial
+                columns where they satisfy their block's constraints.
+        Returns:
+            A sample set with one solution. ``info`` has ``status`` (of
+            the integer master problem), ``objective``, ``lp_bound`` (the
+            last master relaxation, a lower bound once no improving column
+            is left), ``rounds``, ``columns``, ``blocks``,
+            ``pricing_models`` and ``dived`` (whether diving found the
+            solution).
+        Raises:
+            ValueError: If the given constrained quadratic model has
+                non-binary variables or quadratic terms.
+        """
+        t = time.perf_counter()
+        for v in cqm.variables:
+            if cqm.vartype(v) is not dimod.BINARY:
+                raise ValueError("DecompositionCQMSolver can only handle BINARY variables")
+        arr = MIPCQMSolver._csr_arrays(cqm)
+
+        ids: typing.Dict[typing.Hashable, int] = dict()
+        col_block = np.array([ids.setdefault(self.block_key(v), len(ids)) for v in cqm.variables], dtype=int)
+        num_blocks = len(ids)
+        if num_blocks < 2:
+            return MIPCQMSolver.sample_cqm(cqm, time_limit=time_limit, initial_state=initial_state)
+
+        indptr, indices, data = arr['indptr'], arr['indices'], arr['data']
+        num_rows = len(arr['row_lb'])
+        nz_row = np.repeat(np.arange(num_rows), np.diff(indptr))
+        nz_block = col_block[indices]
+        lo = np.full(num_rows, num_blocks)
+        hi = np.full(num_rows, -1)
+        np.minimum.at(lo, nz_row, nz_block)
+        np.maximum.at(hi, nz_row, nz_block)
+        local = lo == hi
+        coupling = np.flatnonzero(lo < hi)
+
+        # block -> columns (positions in cqm.variables), local rows
+        cols = np.argsort(col_block, kind='stable')
+        col_start = np.searchsorted(col_block[cols], np.arange(num_blocks + 1))
+        block_cols = [cols[col_start[b]:col_start[b + 1]] for b in range(num_blocks)]
+        local_rows = np.flatnonzero(local)
+        local_rows = local_rows[np.argsort(lo[local_rows], kind='stable')]
+        row_start = np.searchsorted(lo[local_rows], np.arange(num_blocks + 1))
+        pos = np.empty(len(col_block), dtype=np.intc)
+        for c in block_cols:
+            pos[c] = np.arange(len(c))
+
+        # coupling nonzeros grouped by block
+        is_coupling = np.zeros(num_rows, dtype=bool)
+        is_coupling[coupling] = True
+        coupling_index = np.full(num_rows, -1)
+        coupling_index[coupling] = np.arange(len(coupling))
+        cnz = np.flatnonzero(is_coupling[nz_row])
+        cnz = cnz[np.argsort(nz_block[cnz], kind='stable')]
+        cnz_start = np.searchsorted(nz_block[cnz], np.arange(num_blocks + 1))
+
+        # pricing models, one per distinct block structure
+        classes: typing.Dict[bytes, int] = dict()
+        pricing: typing.List[_Pricing] = []
+        block_class = np.empty(num_blocks, dtype=int)
+        block_local = []
+        for b in range(num_blocks):
+            rows = local_rows[row_start[b]:row_start[b + 1]]
+            nz = np.concatenate([np.arange(indptr[r], indptr[r + 1]) for r in rows]) if len(rows) else np.zeros(0, int)
+            sub = dict(indptr=np.r_[0, np.cumsum(np.diff(indptr)[rows])].astype(np.intc),
+                       indices=pos[indices[nz]], data=data[nz],
+                       row_lb=arr['row_lb'][rows], row_ub=arr['row_ub'][rows], obj=np.zeros(len(block_cols[b])),
+                       offset=0.0, col_lb=arr['col_lb'][block_cols[b]], col_ub=arr['col_ub'][block_cols[b]],
+                       integer=arr['integer'][block_cols[b]])
+            block_local.append(sub)
+            key = b''.join(np.ascontiguousarray(sub[k]).tobytes()
+                           for k in ('indptr', 'indices', 'data', 'row_lb', 'row_ub', 'col_lb', 'col_ub'))
+            if key not in classes:
+                classes[key] = len(pricing)
+                pricing.append(_Pricing(sub))
+            block_class[b] = classes[key]
+
+        c = arr['obj']
+        big = 1 + 2 * np.abs(c).sum()
+
+        # master problem: coupling rows and one convexity row per block, with
+        # penalized artificial variables so that it is always feasible
+        master = mip.Model()
+        master.verbose = 0
+        artificial = []
+
+        def add_artificial() -> mip.Var:
+            artificial.append(master.add_var(obj=big))
+            return artificial[-1]
+
+        coupling_constrs = []
+        for r in coupling:
+            lb, ub = arr['row_lb'][r], arr['row_ub'][r]
+            constrs = []
+            if lb == ub:
+                constrs.append(master.add_constr(add_artificial() - add_artificial() == lb))
+            else:
+                if lb > -np.inf:
+                    constrs.append(master.add_constr(add_artificial() >= lb))
+                if ub < np.inf:
+                    constrs.append(master.add_constr(-add_artificial() <= ub))
+            coupling_constrs.append(constrs)
+        convexity = [master.add_constr(add_artificial() == 1) for _ in range(num_blocks)]
+
+        columns: typing.List[typing.Tuple[int, np.ndarray, mip.Var]] = []
+        seen = [set() for _ in range(num_blocks)]
+
+        def add_column(b: int, x: np.ndarray) -> bool:
+            key = x.tobytes()
+            if key in seen[b]:
+                return False
+            seen[b].add(key)
+            nz = cnz[cnz_start[b]:cnz_start[b + 1]]
+            coef = np.bincount(coupling_index[nz_row[nz]], weights=data[nz] * x[pos[indices[nz]]],
+                               minlength=len(coupling))
+            constrs, coeffs = [convexity[b]], [1.0]
+            for i in np.flatnonzero(coef):
+                constrs += coupling_constrs[i]
+                coeffs += [float(coef[i])] * len(coupling_constrs[i])
+            var = master.add_var(obj=float(c[block_cols[b]] @ x), lb=0, ub=1,
+                                 column=mip.Column(constrs, coeffs))
+            columns.append((b, x, var))
+            return True
+
+        memo: typing.Dict[tuple, typing.Optional[np.ndarray]] = dict()
+
+        def price(costs: typing.Dict[int, np.ndarray]) -> typing.Dict[int, typing.Optional[np.ndarray]]:
+            # blocks with the same structure and costs share one solve; each
+            # pricing model is used by one thread at a time
+            todo = collections.defaultdict(dict)
+            for b, cost in costs.items():
+                key = (block_class[b], np.round(cost, 9).tobytes())
+                if key not in memo:
+                    todo[block_class[b]][key] = cost
+
+            def run(k):
+                return {key: pricing[k].solve(cost) for key, cost in todo[k].items()}
+
+            with concurrent.futures.ThreadPoolExecutor(self.num_threads) as pool:
+                for result in pool.map(run, list(todo)):
+                    memo.update(result)
+            return {b: memo[(block_class[b], np.round(cost, 9).tobytes())] for b, cost in costs.items()}
+
+        # initial columns: the best pattern of each block on its own, and the initial state
+        for b, x in price({b: c[block_cols[b]] for b in range(num_blocks)}).items():
+            if x is None:
+                return dimod.SampleSet.from_samples_cqm(([], cqm.variables), cqm, info=dict(
+                    status='INFEASIBLE', run_time=time.perf_counter() - t))
+            add_column(b, x)
+        if initial_state:
+            x0 = np.array([initial_state.get(v, 0) for v in cqm.variables], dtype=np.int8)
+            for b in range(num_blocks):
+                sub, x = block_local[b], x0[block_cols[b]]
+                lhs = np.bincount(np.repeat(np.arange(len(sub['row_lb'])), np.diff(sub['indptr'])),
+                                  weights=sub['data'] * x[sub['indices']], minlength=len(sub['row_lb']))
+                if ((lhs >= sub['row_lb'] - 1e-9) & (lhs <= sub['row_ub'] + 1e-9)).all():
+                    add_column(b, x)
+
+        fixed = np.zeros(num_blocks, dtype=bool)
+        rounds = 0
+
+        def generate(max_rounds: int, deadline: float) -> float:
+            """Solve the master relaxation and add improving columns until
+            none is left; returns the relaxation's objective value."""
+            nonlocal rounds
+            for _ in range(max_rounds):
+                master.optimize(relax=True)
+                if time.perf_counter() >= deadline:
+                    break
+                rounds += 1
+                pi = np.array([sum(con.pi for con in constrs) for constrs in coupling_constrs])
+                mu = np.array([con.pi for con in convexity])
+
+                weights = data * np.where(is_coupling[nz_row], pi[np.maximum(coupling_index[nz_row], 0)], 0)
+                costs = dict()
+                for b in np.flatnonzero(~fixed):
+                    nz = cnz[cnz_start[b]:cnz_start[b + 1]]
+                    costs[b] = c[block_cols[b]] - np.bincount(pos[indices[nz]], weights=weights[nz],
+                                                              minlength=len(block_cols[b]))
+                added = 0
+                for b, x in price(costs).items():
+                    if x is not None and costs[b] @ x - mu[b] < -1e-6:
+                        added += add_column(b, x)
+                if not added:
+                    break
+            return master.objective_value
+
+        lp_bound = generate(self.max_rounds, t + self.pricing_share * time_limit)
+
+        # diving: fix the columns the relaxation picks, or else the largest
+        # fractional one, and generate columns again; a fixing that makes
+        # the relaxation use artificial variables is undone and ends the dive
+        deadline = t + time_limit
+        while time.perf_counter() < deadline and not fixed.all():
+            values = np.array([var.x for _, _, var in columns])
+            blocks = np.array([b for b, _, _ in columns])
+            free = ~fixed[blocks]
+            pick = np.flatnonzero(free & (values >= 1 - 1e-6))
+            if not len(pick):
+                frac = np.flatnonzero(free & (values > 1e-6))
+                pick = frac[np.argmax(values[frac])][None]
+            step = []
+            for i in pick:
+                b, _, var = columns[i]
+                if not fixed[b]:
+                    var.lb = 1
+                    fixed[b] = True
+                    step.append((b, var))
+            generate(self.max_rounds, deadline)
+            if master.objective_value is None or sum(var.x for var in artificial) > 1e-6:
+                for b, var in step:
+                    var.lb = 0
+                    fixed[b] = False
+                break
+        dived = bool(fixed.all())
+
+        if not dived:
+            # integer master over all generated columns, first with the
+            # columns fixed so far and then without them
+            for _, _, var in columns:
+                var.var_type = mip.BINARY
+            for release in (False, True):
+                if release:
+                    for _, _, var in columns:
+                        var.lb = 0
+                master.optimize(max_seconds=max(deadline - time.perf_counter(), 1))
+                if master.num_solutions and sum(var.x for var in artificial) <= 1e-6:
+                    break
+
+        x = np.zeros(len(col_block), dtype=np.int8)
+        if master.num_solutions:
+            for b, pattern, var in columns:
+                if var.x >= 0.5:
+                    x[block_cols[b]] = pattern
+        feasible = master.num_solutions and sum(var.x for var in artificial) <= 1e-6
+
+        return dimod.SampleSet.from_samples_cqm(([x], cqm.variables), cqm, info=dict(
+            status='FEASIBLE' if feasible else 'NO_SOLUTION_FOUND',
+            objective=master.objective_value if feasible else None, lp_bound=lp_bound,
+            rounds=rounds, columns=len(columns), blocks=num_blocks, pricing_models=len(pricing),
+            dived=dived, run_time=time.perf_counter() - t))
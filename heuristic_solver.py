@@ -0,0 +1,139 @@
+import time
+import typing
+
+import dimod
+import numpy as np
+
+
+class HeuristicCQMSolver:
+    """A fast local-search solver for linear constrained quadratic models
+    with binary variables.
+
+    Starts from the assignment that minimizes the objective and runs a tabu
+    search over single-variable flips. Each move is scored as the change in
+    objective plus the weighted change in constraint violation, evaluated for
+    all variables at once with NumPy. Weights of constraints that stay
+    violated at a local minimum are increased (breakout).
+    """
+    @staticmethod
+    def _linear_arrays(cqm: dimod.ConstrainedQuadraticModel) -> dict:
+        variables = cqm.variables
+        for v in variables:
+            if cqm.vartype(v) is not dimod.BINARY:
+                raise ValueError("HeuristicCQMSolver can only handle BINARY variables")
+        if not cqm.objective.is_linear():
+            raise ValueError("HeuristicCQMSolver cannot support quadratic interactions")
+
+        rows, cols, vals = [], [], []
+        lo = np.full(len(cqm.constraints), -np.inf)
+        hi = np.full(len(cqm.constraints), np.inf)
+        offset = np.zeros(len(cqm.constraints))
+        for r, constraint in enumerate(cqm.constraints.values()):
+            lhs = constraint.lhs
+            if not lhs.is_linear():
+                raise ValueError("HeuristicCQMSolver cannot support quadratic interactions")
+            for v, bias in lhs.iter_linear():
+                rows.append(r)
+                cols.append(variables.index(v))
+                vals.append(bias)
+            offset[r] = lhs.offset
+            if constraint.sense is dimod.sym.Sense.Le:
+                hi[r] = constraint.rhs
+            elif constraint.sense is dimod.sym.Sense.Ge:
+                lo[r] = constraint.rhs
+            elif constraint.sense is dimod.sym.Sense.Eq:
+                lo[r] = hi[r] = constraint.rhs
+            else:
+                raise RuntimeError(f"unexpected sense: {constraint.sense!r}")
+
+        c = np.zeros(len(variables))
+        for v, bias in cqm.objective.iter_linear():
+            c[variables.index(v)] = bias
+
+        return dict(rows=np.asarray(rows, dtype=int), cols=np.asarray(cols, dtype=int),
+                    vals=np.asarray(vals, dtype=float), lo=lo - offset, hi=hi - offset, c=c)
+
+    @staticmethod
+    def _violation(a: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        return np.maximum(lo - a, 0) + np.maximum(a - hi, 0)
+
+    @classmethod
+    def sample_cqm(cls, cqm: dimod.ConstrainedQuadraticModel,
+                   time_limit: float = 1,
+                   initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                   seed: typing.Optional[int] = None,
+                   ) -> dimod.SampleSet:
+        """Search for a good feasible solution within ``time_limit`` seconds.
+        Args:
+            cqm: A constrained quadratic model with binary variables and
+                linear objective and constraints.
+            time_limit: The time in seconds to search.
+            initial_state: Starting values for some or all of the variables.
+                Others start at the value that minimizes the objective.
+            seed: Seed for the random tie-breaking and tabu tenure.
+        Returns:
+            A sample set with the best feasible solution found, or the final
+            state of the search if none was feasible.
+        Raises:
+            ValueError: If the given constrained quadratic model has
+                non-binary variables or quadratic terms.
+        """
+        t = time.perf_counter()
+        arr = cls._linear_arrays(cqm)
+        rows, cols, vals, lo, hi, c = (arr[k] for k in ('rows', 'cols', 'vals', 'lo', 'hi', 'c'))
+        num_vars, num_rows = len(c), len(lo)
+        rng = np.random.default_rng(seed)
+
+        x = (c < 0).astype(np.int8)
+        if initial_state:
+            for v, val in initial_state.items():
+                if v in cqm.variables:
+                    x[cqm.variables.index(v)] = val
+
+        a = np.bincount(rows, weights=vals * x[cols], minlength=num_rows)
+        viol = cls._violation(a, lo, hi)
+        weight = np.full(num_rows, 1 + np.abs(c).max(initial=0))
+        tabu = np.zeros(num_vars, dtype=int)
+        tenure = 7 + num_vars // 100
+
+        # 変数ごとの制約の位置（列順）
+        order = np.argsort(cols, kind='stable')
+        starts = np.searchsorted(cols[order], np.arange(num_vars + 1))
+
+        best_x, best_obj = None, np.inf
+        if not viol.any():
+            best_x, best_obj = x.copy(), c @ x
+
+        it = 0
+        while time.perf_counter() - t < time_limit and num_vars:
+            it += 1
+            d = 1 - 2 * x.astype(float)
+            change = cls._violation(a[rows] + d[cols] * vals, lo[rows], hi[rows]) - viol[rows]
+            delta = c * d + np.bincount(cols, weights=weight[rows] * change, minlength=num_vars)
+            delta += rng.random(num_vars) * 1e-6
+
+            # タブーでも実行可能解の最良値を更新するなら許す（aspiration）
+            feasible = viol.sum() + np.bincount(cols, weights=change, minlength=num_vars) <= 1e-9
+            allowed = (tabu <= it) | (feasible & (c @ x + c * d < best_obj))
+            if not allowed.any():
+                allowed[:] = True
+            j = np.flatnonzero(allowed)[np.argmin(delta[allowed])]
+
+            if delta[j] >= 0 and viol.any():
+                weight[viol > 0] += 1
+
+            idx = order[starts[j]:starts[j + 1]]
+            a[rows[idx]] += d[j] * vals[idx]
+            viol[rows[idx]] = cls._violation(a[rows[idx]], lo[rows[idx]], hi[rows[idx]])
+            x[j] ^= 1
+            tabu[j] = it + tenure + rng.integers(tenure)
+
+            if not (viol > 1e-9).any():
+                obj = c @ x
+                if obj < best_obj:
+                    best_x, best_obj = x.copy(), obj
+
+        run_time = time.perf_counter() - t
+        sample = best_x if best_x is not None else x
+        return dimod.SampleSet.from_samples_cqm(
+            ([sample], cqm.variables), cqm, info=dict(run_time=run_time, iterations=it))
@@ -0,0 +1,57 @@
+import contextlib
+import json
+import time
+import typing
+
+
+class Profile:
+    """Timing and model-size record of one solve.
+
+    ``phases`` holds wall and CPU seconds per phase, ``conditions`` the
+    constraint and variable counts per condition number (or tag), ``model`` the
+    totals of the CQM handed to the solver and ``solver`` the statistics
+    the solver reported (translation time, nodes, gap, incumbents, ...).
+    """
+    def __init__(self):
+        self.phases: typing.Dict[str, dict] = dict()
+        self.conditions: typing.Dict[typing.Union[int, str], dict] = dict()
+        self.model: dict = dict()
+        self.solver: dict = dict()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add_phase(self, name: str, wall: float, cpu: typing.Optional[float] = None):
+        phase = self.phases.setdefault(name, dict(wall=0.0, cpu=0.0))
+        phase['wall'] += wall
+        if cpu is not None:
+            phase['cpu'] += cpu
+
+    def add_solver_info(self, info: dict):
+        """Take the solver statistics out of a SampleSet's ``info``."""
+        if 'build_time' in info:
+            self.add_phase('cqm_to_mip', info['build_time'], info.get('build_cpu_time'))
+        if 'run_time' in info:
+            self.add_phase('optimize', info['run_time'], info.get('run_cpu_time'))
+        for key in ('status', 'objective', 'bound', 'gap', 'nodes', 'incumbents', 'iterations', 'config',
+                    'lp_bound', 'rounds', 'columns'):
+            if key in info:
+                self.solver[key] = info[key]
+
+    def to_dict(self) -> dict:
+        return dict(phases=self.phases, conditions={str(k): v for k, v in sorted(self.conditions.items(), key=lambda kv: (isinstance(kv[0], str), kv[0]))},
+                    model=self.model, solver=self.solver)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+
+    def emit(self, path: typing.Optional[str]):
+        """Append this record as one JSON line to ``path`` (if given)."""
+        if path:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(self.to_json() + '\n')
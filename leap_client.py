@@ -0,0 +1,249 @@
+import concurrent.futures
+import copy
+import threading
+import time
+import typing
+
+import dimod
+
+
+def _leap_sampler():
+    from dwave.system import LeapHybridCQMSampler
+    return LeapHybridCQMSampler()
+
+
+class LeapClient:
+    """Submit CQMs to Leap and return futures of their sample sets.
+
+    One sampler (and so one connection to Leap) is shared by every
+    submission. Problems are uploaded from a small pool of threads and then
+    watched by a single thread that completes their futures, so any number
+    of problems can be in flight without holding a thread each, and callers
+    can solve others locally (with CBC) while they wait.
+
+    Args:
+        sampler_factory: Creates the sampler on first use. Defaults to
+            ``dwave.system.LeapHybridCQMSampler``; pass a factory of
+            :class:`FakeLeapSampler` to work offline.
+        max_workers: Number of problems uploaded at once. Further
+            submissions wait in the queue.
+        timeout_margin: Seconds to wait for a result beyond the problem's
+            time limit (upload, queueing in Leap and download) before the
+            problem is cancelled in Leap and its future fails with
+            :class:`TimeoutError`.
+        poll_interval: Seconds between checks of the pending results.
+    """
+    def __init__(self, sampler_factory: typing.Optional[typing.Callable[[], typing.Any]] = None,
+                 max_workers: int = 8, timeout_margin: float = 300, poll_interval: float = 0.1):
+        self._factory = sampler_factory or _leap_sampler
+        self._sampler = None
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='leap')
+        # (sample set, deadline, time limit, future) of the problems in Leap
+        self._pending: typing.List[tuple] = []
+        self._changed = threading.Condition()
+        self._watcher: typing.Optional[threading.Thread] = None
+        self.timeout_margin = timeout_margin
+        self.poll_interval = poll_interval
+
+    @property
+    def sampler(self):
+        """The shared sampler, created on first use."""
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = self._factory()
+            return self._sampler
+
+    def submit(self, cqm: dimod.ConstrainedQuadraticModel, time_limit: float,
+               label: str = 'Shift Scheduling') -> 'concurrent.futures.Future[dimod.SampleSet]':
+        """Submit ``cqm`` and return a future of its resolved sample set.
+
+        The future fails with :class:`TimeoutError`, and the problem is
+        cancelled in Leap, if the result has not arrived ``timeout_margin``
+        seconds after ``time_limit``. Cancelling the future (it stays
+        cancellable until the result arrives) also cancels the problem in
+        Leap, or keeps it from being uploaded.
+        """
+        future = concurrent.futures.Future()
+        self._pool.submit(self._upload, cqm, time_limit, label, future)
+        return future
+
+    def solve(self, cqm: dimod.ConstrainedQuadraticModel, time_limit: float,
+              label: str = 'Shift Scheduling') -> dimod.SampleSet:
+        """Submit ``cqm`` and wait for its sample set."""
+        return self.submit(cqm, time_limit, label).result()
+
+    def _upload(self, cqm: dimod.ConstrainedQuadraticModel, time_limit: float, label: str,
+                future: concurrent.futures.Future):
+        # the future is left pending, not running, so that callers can still cancel it
+        if future.cancelled():
+            return
+        deadline = time.monotonic() + time_limit + self.timeout_margin
+        try:
+            res = self.sampler.sample_cqm(cqm, time_limit=time_limit, label=label)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        with self._changed:
+            self._pending.append((res, deadline, time_limit, future))
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='leap-watch', daemon=True)
+                self._watcher.start()
+            self._changed.notify_all()
+
+    def _watch(self):
+        """Complete the futures of the pending problems as their results arrive."""
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._pending)
+                pending = list(self._pending)
+
+            finished = set()
+            for res, deadline, time_limit, future in pending:
+                try:
+                    if future.cancelled():
+                        _cancel(res)
+                    elif res.done():
+                        try:
+                            res.resolve()
+                        except Exception as e:
+                            future.set_exception(e)
+                        else:
+                            future.set_result(res)
+                    elif time.monotonic() >= deadline:
+                        _cancel(res)
+                        future.set_exception(TimeoutError(
+                            f"no result from Leap within {time_limit + self.timeout_margin:g} seconds"))
+                    else:
+                        continue
+                except concurrent.futures.InvalidStateError:
+                    # cancelled just now; the problem has finished anyway
+                    pass
+                finished.add(id(future))
+
+            with self._changed:
+                self._pending = [p for p in self._pending if id(p[3]) not in finished]
+                self._changed.notify_all()
+                if self._pending:
+                    self._changed.wait(self.poll_interval)
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting problems; with ``wait``, also wait for the results
+        of the problems in flight."""
+        self._pool.shutdown(wait=wait)
+        if wait:
+            with self._changed:
+                self._changed.wait_for(lambda: not self._pending)
+
+
+def _cancel(res: dimod.SampleSet):
+    """Cancel the problem of an unresolved sample set in Leap."""
+    # the sample set keeps the sampler's future until it is resolved
+    future = getattr(res, '_future', None)
+    if future is not None:
+        try:
+            future.cancel()
+        except Exception:
+            # the problem finished or failed meanwhile
+            pass
+
+
+class _FakeProblem:
+    """The future of a :class:`FakeLeapSampler` problem. Like a Leap
+    problem, it can be cancelled while it waits for the solver."""
+    def __init__(self, future: concurrent.futures.Future, cancelled: threading.Event):
+        self._future = future
+        self._cancelled = cancelled
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def result(self) -> dimod.SampleSet:
+        return self._future.result()
+
+    def cancel(self) -> bool:
+        self._cancelled.set()
+        return self._future.cancel()
+
+
+class FakeLeapSampler:
+    """A local stand-in for ``LeapHybridCQMSampler``.
+
+    :meth:`sample_cqm` returns at once, like the real sampler, with a
+    sample set that resolves ``latency`` seconds plus the solve time
+    later. Problems are solved concurrently on their own threads, and a
+    problem cancelled during its latency is not solved. Use it to exercise
+    concurrency and timeouts without a Leap account::
+
+        set_leap_client(LeapClient(lambda: FakeLeapSampler(latency=2)))
+
+    Args:
+        latency: Seconds added to every problem (the network round trip
+            and the queueing in Leap).
+        solver: Solves a CQM locally, called as ``solver(cqm, time_limit)``.
+            Defaults to :class:`~heuristic_solver.HeuristicCQMSolver`.
+        max_concurrent: Problems solved at once (further ones queue, as in
+            Leap).
+    """
+    def __init__(self, latency: float = 1.0,
+                 solver: typing.Optional[typing.Callable[[dimod.ConstrainedQuadraticModel, float], dimod.SampleSet]] = None,
+                 max_concurrent: int = 8):
+        self.latency = latency
+        self.solver = solver or _heuristic_solve
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_concurrent, thread_name_prefix='fake-leap')
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.cancelled = 0
+        self.running = 0
+        self.peak_running = 0
+
+    def sample_cqm(self, cqm: dimod.ConstrainedQuadraticModel, time_limit: typing.Optional[float] = None,
+                   label: typing.Optional[str] = None) -> dimod.SampleSet:
+        with self._lock:
+            self.submitted += 1
+        cancelled = threading.Event()
+        # the real sampler uploads a snapshot, so later changes to cqm do not matter
+        future = self._pool.submit(self._solve, copy.deepcopy(cqm), 5 if time_limit is None else time_limit,
+                                   cancelled)
+        return dimod.SampleSet.from_future(_FakeProblem(future, cancelled))
+
+    def _solve(self, cqm: dimod.ConstrainedQuadraticModel, time_limit: float,
+               cancelled: threading.Event) -> dimod.SampleSet:
+        with self._lock:
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        try:
+            if cancelled.wait(self.latency):
+                with self._lock:
+                    self.cancelled += 1
+                raise concurrent.futures.CancelledError()
+            return self.solver(cqm, time_limit)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _heuristic_solve(cqm: dimod.ConstrainedQuadraticModel, time_limit: float) -> dimod.SampleSet:
+    from heuristic_solver import HeuristicCQMSolver
+    return HeuristicCQMSolver().sample_cqm(cqm, time_limit=time_limit)
+
+
+_client: typing.Optional[LeapClient] = None
+_client_lock = threading.Lock()
+
+
+def get_leap_client() -> LeapClient:
+    """The client shared by the process (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LeapClient()
+        return _client
+
+
+def set_leap_client(client: typing.Optional[LeapClient]):
+    """Replace the shared client, e.g. with one using :class:`FakeLeapSampler`
+    (None: a default client is created on next use)."""
+    global _client
+    with _client_lock:
+        _client = client
@@ -13,11 +13,51 @@
 #    limitations under the License.
 
 import itertools
+import logging
+import threading
 import time
 import typing
 
+import cffi
 import mip
 import dimod
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# CBC C functions that Python-MIP does not declare itself, by name; None if
+# they could not be declared. cffi's ``cdef`` changes the shared FFI object,
+# so it runs under a lock and only once per function.
+_cbc_functions: typing.Dict[str, typing.Any] = dict()
+_cbc_lock = threading.Lock()
+
+
+def _cbc_function(name: str, declaration: str) -> typing.Optional[typing.Callable]:
+    """The CBC C function ``name``, declared with ``declaration`` if the
+    installed Python-MIP (see requirements.txt for the targeted version)
+    does not declare it. Returns None, logging a warning the first time,
+    if it is not available.
+    """
+    with _cbc_lock:
+        if name not in _cbc_functions:
+            try:
+                from mip import cbc
+                if not hasattr(cbc.cbclib, name):
+                    cbc.ffi.cdef(declaration)
+                _cbc_functions[name] = getattr(cbc.cbclib, name)
+            except (ImportError, AttributeError, cffi.FFIError, cffi.CDefError) as e:
+                logger.warning("CBC function %s is not available (%s: %s); using the slower Python-MIP API",
+                               name, type(e).__name__, e)
+                _cbc_functions[name] = None
+        return _cbc_functions[name]
+
+
+def _is_cbc(model: mip.Model) -> bool:
+    try:
+        from mip import cbc
+    except ImportError:
+        return False
+    return isinstance(model.solver, cbc.SolverCbc)
 
 
 class MIPCQMSolver:
@@ -49,9 +89,223 @@ class MIPCQMSolver:
             (qm.offset,)
             ))
 
+    @staticmethod
+    def _search_stats(model: mip.Model) -> dict:
+        stats = dict()
+        if model.num_solutions:
+            stats.update(objective=float(model.objective_value), bound=float(model.objective_bound),
+                         gap=float(model.gap))
+        # Python-MIP does not expose CBC's node count
+        node_count = _cbc_function('Cbc_getNodeCount', "int Cbc_getNodeCount(Cbc_Model *model);") \
+            if _is_cbc(model) else None
+        if node_count is not None:
+            stats['nodes'] = int(node_count(model.solver._model))
+        if model.store_search_progress_log:
+            upper = [ub for _, (_, ub) in model.search_progress_log.log]
+            stats['incumbents'] = sum(1 for a, b in zip([float('inf')] + upper, upper) if b < a)
+        return stats
+
+    @classmethod
+    def _csr_arrays(cls, cqm: dimod.ConstrainedQuadraticModel) -> dict:
+        """The constraint matrix of ``cqm`` in CSR form with row bounds
+        ``row_lb <= A x <= row_ub``, and the column bounds, types and
+        objective as arrays in ``cqm.variables`` order.
+
+        Constraints with the same left-hand side (such as a lower and an
+        upper bound of one sum) become a single ranged row.
+        """
+        variables = cqm.variables
+        index = variables.index
+
+        rows: typing.Dict[tuple, int] = dict()
+        indices: typing.List[np.ndarray] = []
+        data: typing.List[np.ndarray] = []
+        row_lb: typing.List[float] = []
+        row_ub: typing.List[float] = []
+        for constraint in cqm.constraints.values():
+            lhs = constraint.lhs
+            if not lhs.is_linear():
+                raise ValueError("MIP cannot support quadratic interactions")
+            try:
+                # constraint views of dimod>=0.12 index the CQM's variables directly
+                cols, biases = lhs._iindices(), lhs._ilinear()
+            except AttributeError:
+                cols = np.fromiter((index(v) for v in lhs.variables), dtype=np.intc, count=lhs.num_variables)
+                biases = np.fromiter((lhs.get_linear(v) for v in lhs.variables), dtype=float,
+                                     count=lhs.num_variables)
+            order = np.argsort(cols, kind='stable')
+            cols, biases = np.asarray(cols)[order], np.asarray(biases, dtype=float)[order]
+            key = (cols.tobytes(), biases.tobytes())
+            r = rows.get(key)
+            if r is None:
+                r = rows[key] = len(indices)
+                indices.append(cols)
+                data.append(biases)
+                row_lb.append(-np.inf)
+                row_ub.append(np.inf)
+            rhs = constraint.rhs - lhs.offset
+            if constraint.sense is dimod.sym.Sense.Le:
+                row_ub[r] = min(row_ub[r], rhs)
+            elif constraint.sense is dimod.sym.Sense.Ge:
+                row_lb[r] = max(row_lb[r], rhs)
+            elif constraint.sense is dimod.sym.Sense.Eq:
+                row_lb[r] = max(row_lb[r], rhs)
+                row_ub[r] = min(row_ub[r], rhs)
+            else:
+                raise RuntimeError(f"unexpected sense: {constraint.sense!r}")
+
+        if not cqm.objective.is_linear():
+            raise ValueError("MIP cannot support quadratic interactions")
+        obj = np.zeros(len(variables))
+        for v, bias in cqm.objective.iter_linear():
+            obj[index(v)] = bias
+
+        indptr = np.zeros(len(indices) + 1, dtype=np.intc)
+        np.cumsum([len(cols) for cols in indices], out=indptr[1:])
+        return dict(
+            indptr=indptr,
+            indices=np.concatenate(indices).astype(np.intc) if indices else np.zeros(0, dtype=np.intc),
+            data=np.concatenate(data).astype(float) if data else np.zeros(0),
+            row_lb=np.array(row_lb, dtype=float), row_ub=np.array(row_ub, dtype=float), obj=obj,
+            offset=float(cqm.objective.offset),
+            col_lb=np.array([cqm.lower_bound(v) for v in variables], dtype=float),
+            col_ub=np.array([cqm.upper_bound(v) for v in variables], dtype=float),
+            integer=np.array([cqm.vartype(v) is not dimod.REAL for v in variables]),
+            )
+
+    @staticmethod
+    def _load_arrays(model: mip.Model, arrays: dict) -> bool:
+        """Load the whole problem into CBC with one ``Cbc_loadProblem`` call.
+        Returns False, leaving the model untouched, if the solver is not CBC
+        or the call is not available.
+        """
+        # Python-MIP only adds rows one at a time
+        if not _is_cbc(model):
+            return False
+        load = _cbc_function('Cbc_loadProblem', """void Cbc_loadProblem(Cbc_Model *model, const int numcols, const int numrows,
+            const int *start, const int *index, const double *value,
+            const double *collb, const double *colub, const double *obj,
+            const double *rowlb, const double *rowub);""")
+        if load is None:
+            return False
+        from mip import cbc
+
+        num_cols, num_rows = len(arrays['obj']), len(arrays['row_lb'])
+        indices = arrays['indices']
+
+        # CBC takes the matrix column by column
+        order = np.argsort(indices, kind='stable')
+        start = np.searchsorted(indices[order], np.arange(num_cols + 1)).astype(np.intc)
+        rows = np.repeat(np.arange(num_rows, dtype=np.intc), np.diff(arrays['indptr']))[order]
+        values = np.ascontiguousarray(arrays['data'][order])
+
+        def buf(ctype, a):
+            return cbc.ffi.from_buffer(ctype, a)
+
+        load(model.solver._model, num_cols, num_rows,
+             buf('int[]', start), buf('int[]', rows), buf('double[]', values),
+             buf('double[]', arrays['col_lb']), buf('double[]', arrays['col_ub']),
+             buf('double[]', np.zeros(num_cols)),
+             buf('double[]', arrays['row_lb']), buf('double[]', arrays['row_ub']))
+        for j in np.flatnonzero(arrays['integer']):
+            cbc.cbclib.Cbc_setInteger(model.solver._model, int(j))
+        model.vars.update_vars(num_cols)
+        model.constrs.update_constrs(num_rows)
+        return True
+
+    @classmethod
+    def _model_from_arrays(cls, arrays: dict, **params) -> mip.Model:
+        """A model of the problem in ``arrays`` (see :meth:`_csr_arrays`),
+        loaded with :meth:`_load_arrays` if possible and otherwise added
+        row by row. Its variables are in column order."""
+        model = mip.Model()
+        for name, value in params.items():
+            setattr(model, name, value)
+        if not cls._load_arrays(model, arrays):
+            x = [model.add_var(lb=lb, ub=ub, var_type='B' if integer and lb == 0 and ub == 1 else 'I' if integer else 'C')
+                 for lb, ub, integer in zip(arrays['col_lb'], arrays['col_ub'], arrays['integer'])]
+            indptr, indices, data = arrays['indptr'], arrays['indices'], arrays['data']
+            for r, (lb, ub) in enumerate(zip(arrays['row_lb'], arrays['row_ub'])):
+                lhs = mip.xsum(data[k] * x[indices[k]] for k in range(indptr[r], indptr[r + 1]))
+                if lb == ub:
+                    model.add_constr(lhs == lb)
+                    continue
+                if lb > -np.inf:
+                    model.add_constr(lhs >= lb)
+                if ub < np.inf:
+                    model.add_constr(lhs <= ub)
+        nonzero = np.flatnonzero(arrays['obj'])
+        model.objective = mip.LinExpr([model.vars[j] for j in nonzero], arrays['obj'][nonzero].tolist(),
+                                      const=arrays['offset'])
+        return model
+
+    @classmethod
+    def _build_model(cls, cqm: dimod.ConstrainedQuadraticModel,
+                     initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                     bulk: bool = True,
+                     **params,
+                     ) -> typing.Tuple[mip.Model, typing.Dict[dimod.typing.Variable, mip.Var]]:
+        model = mip.Model()
+        for name, value in params.items():
+            setattr(model, name, value)
+
+        arrays = cls._csr_arrays(cqm) if bulk and len(cqm.variables) else None
+        if arrays is not None and cls._load_arrays(model, arrays):
+            variable_map = dict(zip(cqm.variables, model.vars))
+            nonzero = np.flatnonzero(arrays['obj'])
+            model.objective = mip.LinExpr([model.vars[j] for j in nonzero], arrays['obj'][nonzero].tolist(),
+                                          const=arrays['offset'])
+        else:
+            variable_map = dict()
+            for v in cqm.variables:
+                variable_map[v] = model.add_var(
+                    name=v,
+                    lb=cqm.lower_bound(v),
+                    ub=cqm.upper_bound(v),
+                    var_type=cls._mip_vartype(cqm.vartype(v))
+                    )
+
+            model.objective = cls._qm_to_expression(cqm.objective, variable_map)
+
+            for label, constraint in cqm.constraints.items():
+                lhs = cls._qm_to_expression(constraint.lhs, variable_map)
+                rhs = constraint.rhs
+                if constraint.sense is dimod.sym.Sense.Le:
+                    model.add_constr(lhs <= rhs, name=label)
+                elif constraint.sense is dimod.sym.Sense.Ge:
+                    model.add_constr(lhs >= rhs, name=label)
+                elif constraint.sense is dimod.sym.Sense.Eq:
+                    model.add_constr(lhs == rhs, name=label)
+                else:
+                    raise RuntimeError(f"unexpected sense: {lhs.sense!r}")
+
+        if initial_state:
+            model.start = [(variable_map[v], val) for v, val in initial_state.items()]
+
+        return model, variable_map
+
+    @staticmethod
+    def _solutions(model: mip.Model, variables: typing.Sequence[mip.Var]) -> np.ndarray:
+        """All solutions of ``model`` as a ``(num_solutions, len(variables))`` array."""
+        num = model.num_solutions
+        saved = _cbc_function('Cbc_savedSolution', "const double *Cbc_savedSolution(Cbc_Model *model, int whichSol);") \
+            if _is_cbc(model) else None
+        if saved is None:
+            return np.array([[var.xi(k) for var in variables] for k in range(num)]).reshape(num, len(variables))
+        from mip import cbc
+        idx = np.fromiter((var.idx for var in variables), dtype=int, count=len(variables))
+        samples = np.empty((num, len(variables)))
+        for k in range(num):
+            ptr = saved(model.solver._model, k)
+            samples[k] = np.frombuffer(cbc.ffi.buffer(ptr, model.num_cols * 8), dtype=float)[idx]
+        return samples
+
     @classmethod
     def sample_cqm(cls, cqm: dimod.ConstrainedQuadraticModel,
                    time_limit: float = float('inf'),
+                   initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                   bulk: bool = True,
+                   **params,
                    ) -> dimod.SampleSet:
         """Use Python-MIP to solve a constrained quadratic model.
         Note that Python-MIP requires the objective and constraints to be
@@ -59,45 +313,204 @@ class MIPCQMSolver:
         Args:
             cqm: A constrained quadratic model.
             time_limit: The maximum time in seconds to search.
+            initial_state: Values for some or all of the variables, passed
+                to Python-MIP as a start solution.
+            bulk: Load the constraint matrix into CBC in one call and read
+                the solutions back as arrays. Falls back to adding the
+                constraints one at a time for other solvers.
+            **params: Python-MIP model parameters to set before solving,
+                e.g. ``seed``, ``emphasis``, ``cuts`` or ``preprocess``.
         Returns:
             A sample set with any solutions returned by Python-MIP.
         Raises:
             ValueError: If the given constrained quadratic model contains
                 any quadratic terms.
         """
-        model = mip.Model()
+        t, c = time.perf_counter(), time.process_time()
+        model, variable_map = cls._build_model(cqm, initial_state, bulk, **params)
+        # CBC collects the log from its output and aborts when it is silenced
+        model.store_search_progress_log = bool(model.verbose)
+        build_time, build_cpu_time = time.perf_counter() - t, time.process_time() - c
 
-        variable_map: typing.Dict[dimod.typing.Variable, mip.Var] = dict()
-        for v in cqm.variables:
-            variable_map[v] = model.add_var(
-                name=v,
-                lb=cqm.lower_bound(v),
-                ub=cqm.upper_bound(v),
-                var_type=cls._mip_vartype(cqm.vartype(v))
-                )
+        t, c = time.perf_counter(), time.process_time()
+        model.optimize(max_seconds=time_limit)
+        run_time, run_cpu_time = time.perf_counter() - t, time.process_time() - c
 
-        model.objective = cls._qm_to_expression(cqm.objective, variable_map)
+        if bulk:
+            samples = cls._solutions(model, [variable_map[v] for v in cqm.variables])
+        else:
+            samples = [
+                [variable_map[v].xi(k) for v in cqm.variables]
+                for k in range(model.num_solutions)
+                ]
 
-        for label, constraint in cqm.constraints.items():
-            lhs = cls._qm_to_expression(constraint.lhs, variable_map)
-            rhs = constraint.rhs
-            if constraint.sense is dimod.sym.Sense.Le:
-                model.add_constr(lhs <= rhs, name=label)
-            elif constraint.sense is dimod.sym.Sense.Ge:
-                model.add_constr(lhs >= rhs, name=label)
-            elif constraint.sense is dimod.sym.Sense.Eq:
-                model.add_constr(lhs == rhs, name=label)
-            else:
-                raise RuntimeError(f"unexpected sense: {lhs.sense!r}")
+        return dimod.SampleSet.from_samples_cqm(
+            (samples, cqm.variables), cqm,
+            info=dict(run_time=run_time, run_cpu_time=run_cpu_time, build_time=build_time,
+                      build_cpu_time=build_cpu_time, status=model.status.name, **cls._search_stats(model)))
 
+    @classmethod
+    def iter_sample_cqm(cls, cqm: dimod.ConstrainedQuadraticModel,
+                        time_limit: float = float('inf'),
+                        initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                        bulk: bool = True,
+                        **params,
+                        ) -> typing.Iterator[dimod.SampleSet]:
+        """Like :meth:`sample_cqm`, but yield each improved solution as soon
+        as Python-MIP finds it.
+        After each solution the search is resumed with an objective cutoff
+        just below it, so every yielded solution is strictly better than the
+        previous one. The consumer can stop iterating at any time and keep
+        the last solution.
+        Args:
+            cqm: A constrained quadratic model.
+            time_limit: The maximum time in seconds to search, in total.
+            initial_state: Values for some or all of the variables, passed
+                to Python-MIP as a start solution.
+            bulk: See :meth:`sample_cqm`.
+            **params: Python-MIP model parameters to set before solving.
+        Yields:
+            Sample sets with one solution each. ``info`` has ``objective``,
+            ``bound`` (the best bound of the search that found it), ``gap``,
+            ``status`` and the elapsed ``run_time``. The final sample set
+            has status ``OPTIMAL`` if the last solution was proven optimal.
+            If the search ends without any solution, a single empty sample
+            set is yielded whose ``status`` tells whether infeasibility was
+            proven (``INFEASIBLE``) or the time ran out.
+        """
         t = time.perf_counter()
-        model.optimize(max_seconds=time_limit)
-        run_time = time.perf_counter() - t
+        model, variable_map = cls._build_model(cqm, initial_state, bulk, **params)
+        build_time = time.perf_counter() - t
+        x = [variable_map[v] for v in cqm.variables]
+        for sample, info in cls._iter_search(model, x, cls._integral_objective(cqm), time_limit):
+            yield dimod.SampleSet.from_samples_cqm(([] if sample is None else [sample], cqm.variables), cqm,
+                                                   info=dict(info, build_time=build_time))
+
+    @staticmethod
+    def _integral_objective(cqm: dimod.ConstrainedQuadraticModel) -> bool:
+        """Whether every solution of ``cqm`` has an integral objective."""
+        return all(cqm.vartype(v) is not dimod.REAL and float(b).is_integer()
+                   for v, b in cqm.objective.iter_linear())
+
+    @staticmethod
+    def _iter_search(model: mip.Model, x: typing.Sequence[mip.Var], integral: bool, time_limit: float,
+                     ) -> typing.Iterator[typing.Tuple[typing.Optional[typing.List[float]], dict]]:
+        """The search of :meth:`iter_sample_cqm` on a built model: yield
+        ``(values of x, info)`` for each solution, or ``(None, info)`` once
+        if there is none. ``time_limit`` counts from here."""
+        # CBC applies the cutoff with a tolerance; with an integral objective
+        # the next solution is at least 1 better
+        step = 0.5 if integral else 1e-4
+
+        t = time.perf_counter()
+        sample, info = None, None
+        incumbents = 0
+        status = mip.OptimizationStatus.NO_SOLUTION_FOUND
+        while True:
+            remaining = time_limit - (time.perf_counter() - t)
+            if remaining <= 0:
+                break
+            status = model.optimize(max_seconds=remaining, max_solutions=1)
+            improved = model.num_solutions > 0 and (info is None or model.objective_value < info['objective'])
+            if not improved:
+                # nothing better than the cutoff: the last solution is optimal
+                if info is not None and status in (mip.OptimizationStatus.OPTIMAL,
+                                                   mip.OptimizationStatus.INFEASIBLE):
+                    info = dict(info, run_time=time.perf_counter() - t, status='OPTIMAL',
+                                bound=info['objective'], gap=0.0)
+                    yield sample, info
+                break
+
+            objective = float(model.objective_value)
+            bound = float(model.objective_bound)
+            incumbents += 1
+            sample = [var.x for var in x]
+            info = dict(run_time=time.perf_counter() - t, status=status.name, objective=objective, bound=bound,
+                        incumbents=incumbents, gap=abs(objective - bound) / max(abs(objective), 1e-10))
+            yield sample, info
+            if status is mip.OptimizationStatus.OPTIMAL:
+                return
+
+            model.cutoff = objective - step
+
+        if info is None:
+            yield None, dict(run_time=time.perf_counter() - t, status=status.name)
+
+    @classmethod
+    def sample_cqm_pool(cls, cqm: dimod.ConstrainedQuadraticModel,
+                        num_solutions: int = 3, min_distance: float = 1,
+                        time_limit: float = float('inf'),
+                        initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                        weights: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                        bulk: bool = True,
+                        **params,
+                        ) -> dimod.SampleSet:
+        """Find up to ``num_solutions`` good solutions that differ pairwise
+        by at least ``min_distance``.
+        Each round solves the model with one distance cut per solution
+        found so far, ``sum(w_i * |x_i - x*_i|) >= min_distance``, and keeps
+        its best solution, so with enough time the result is the best
+        solution, the best one far enough from it, and so on. Every round
+        gets an equal share of the remaining time. If time runs out first,
+        the other solutions CBC found along the way fill the remaining
+        places, best first, where they are far enough from the others.
+        Args:
+            cqm: A constrained quadratic model.
+            num_solutions: The number of solutions wanted.
+            min_distance: The minimum weighted Hamming distance between
+                any two solutions.
+            time_limit: The maximum time in seconds to search, in total.
+            initial_state: Start solution of the first round.
+            weights: The weight of each variable in the distance (missing
+                variables count 0). Defaults to 1 for every binary variable.
+            bulk: See :meth:`sample_cqm`.
+            **params: Python-MIP model parameters to set before solving.
+        Returns:
+            A sample set with the solutions, best first. ``info`` has
+            ``status`` (``OPTIMAL`` if every round was solved to optimality
+            or proven infeasible), ``rounds`` and ``run_time``.
+        """
+        t = time.perf_counter()
+        model, variable_map = cls._build_model(cqm, initial_state, bulk, **params)
+        x = [variable_map[v] for v in cqm.variables]
+        if weights is None:
+            w = np.array([float(cqm.vartype(v) is dimod.BINARY) for v in cqm.variables])
+        else:
+            w = np.array([float(weights.get(v, 0)) for v in cqm.variables])
+        linear = np.array([cqm.objective.get_linear(v) for v in cqm.variables])
+
+        def distance(a: np.ndarray, b: np.ndarray) -> float:
+            return float(w @ np.abs(a - b))
+
+        chosen, seen = [], []
+        rounds, optimal = 0, True
+        while len(chosen) < num_solutions:
+            remaining = time_limit - (time.perf_counter() - t)
+            if remaining <= 0:
+                optimal = False
+                break
+            status = model.optimize(max_seconds=remaining / (num_solutions - len(chosen)))
+            rounds += 1
+            if status not in (mip.OptimizationStatus.OPTIMAL, mip.OptimizationStatus.INFEASIBLE):
+                optimal = False
+            if not model.num_solutions:
+                break
+            samples = np.rint(cls._solutions(model, x))
+            seen.extend(samples)
+            best = samples[0]
+            chosen.append(best)
+            nz = np.flatnonzero(w)
+            model.add_constr(mip.xsum(float(w[i] * (1 - 2 * best[i])) * x[i] for i in nz)
+                             >= min_distance - float(w[nz] @ best[nz]))
 
-        samples = [
-            [variable_map[v].xi(k) for v in cqm.variables]
-            for k in range(model.num_solutions)
-            ]
+        # fill up from the other solutions found
+        for sample in sorted(seen, key=lambda s: linear @ s):
+            if len(chosen) >= num_solutions:
+                break
+            if all(distance(sample, c) >= min_distance for c in chosen):
+                chosen.append(sample)
 
         return dimod.SampleSet.from_samples_cqm(
-            (samples, cqm.variables), cqm, info=dict(run_time=run_time))
+            (np.array(chosen).reshape(len(chosen), len(x)), cqm.variables), cqm,
+            info=dict(status='OPTIMAL' if optimal else 'FEASIBLE', rounds=rounds,
+                      run_time=time.perf_counter() - t))
@@ -0,0 +1,209 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+
+import dimod
+import numpy as np
+
+
+# suffix of files that are still being written
+_TEMP_SUFFIX = '.tmp'
+
+
+class ModelCache:
+    """Content-addressed cache of compiled models and solved samples.
+
+    Entries are keyed by a hash of the options that produced them and the
+    version of the code that builds the models. A bounded in-memory LRU sits
+    in front of an on-disk store: CQMs are written with ``to_file``, extra
+    arrays as ``.npz`` and samples as JSON. Files are written under a
+    temporary name and renamed into place, so readers never see a partly
+    written file; entries that fail to load anyway are removed and count as
+    misses.
+
+    Models returned from the cache are shared; callers must not modify them.
+    The cache can be used from several threads at once.
+
+    Args:
+        directory: Directory of the on-disk store, or None for memory only.
+            It is created on the first write.
+        ignore: Option keys that do not affect the model (solver settings).
+            They are left out of model keys but included in sample keys.
+        max_entries: Number of entries kept in memory.
+        max_bytes: Size of the on-disk store above which the oldest files
+            are removed.
+        max_age: Age in seconds after which files are removed.
+        version: Version of the model builder (e.g. a hash of its code),
+            part of every key so that models and samples stored by another
+            version are not returned.
+    """
+    def __init__(self, directory: typing.Optional[str] = None, ignore: typing.Iterable[str] = (),
+                 max_entries: int = 16, max_bytes: int = 256 * 2**20, max_age: float = 7 * 24 * 3600,
+                 version: str = ''):
+        self.directory = directory
+        self.ignore = frozenset(ignore)
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = dict(memory=0, disk=0)
+        self.misses = 0
+        self.discarded = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def _hash(self, prefix: str, opts: dict) -> str:
+        data = json.dumps([self.version, opts], sort_keys=True, ensure_ascii=False, default=str)
+        return prefix + hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+    def model_key(self, opts: dict) -> str:
+        return self._hash('model-', {k: v for k, v in opts.items() if k not in self.ignore})
+
+    def sample_key(self, opts: dict) -> str:
+        return self._hash('sample-', opts)
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, key + ext)
+
+    def _write(self, key: str, ext: str, write: typing.Callable[[typing.BinaryIO], None]):
+        """Write a file with ``write`` and rename it to its place in one step."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f'.{key}', suffix=_TEMP_SUFFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, self._path(key, ext))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _discard(self, key: str, exts: typing.Iterable[str]):
+        for ext in exts:
+            try:
+                os.remove(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key: str, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key: str, exts: typing.Tuple[str, ...], load: typing.Callable[[], typing.Any]):
+        with self._lock:
+            return self._lookup_locked(key, exts, load)
+
+    def _lookup_locked(self, key: str, exts: typing.Tuple[str, ...], load: typing.Callable[[], typing.Any]):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits['memory'] += 1
+            return self._memory[key]
+        if self.directory:
+            try:
+                value = load()
+            except FileNotFoundError:
+                pass
+            except Exception:
+                # truncated or otherwise unreadable (e.g. written by an older
+                # version without atomic writes): drop it so it is rebuilt
+                self.discarded += 1
+                self._discard(key, exts)
+            else:
+                self.hits['disk'] += 1
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def get_model(self, opts: dict) -> typing.Optional[typing.Tuple[dimod.ConstrainedQuadraticModel, dict]]:
+        """Return ``(cqm, arrays)`` stored for ``opts``, or None."""
+        key = self.model_key(opts)
+
+        def load():
+            with open(self._path(key, '.cqm'), 'rb') as f:
+                cqm = dimod.ConstrainedQuadraticModel.from_file(f)
+            with np.load(self._path(key, '.npz')) as npz:
+                arrays = dict(npz)
+            return cqm, arrays
+
+        return self._lookup(key, ('.cqm', '.npz'), load)
+
+    def put_model(self, opts: dict, cqm: dimod.ConstrainedQuadraticModel, **arrays: np.ndarray):
+        """Store ``cqm`` and any arrays needed to decode its samples."""
+        key = self.model_key(opts)
+        with self._lock:
+            self._remember(key, (cqm, arrays))
+            if self.directory:
+                self._write(key, '.cqm', lambda f: f.write(cqm.to_file().read()))
+                self._write(key, '.npz', lambda f: np.savez(f, **arrays))
+                self.evict()
+
+    def get_sample(self, opts: dict) -> typing.Optional[dict]:
+        """Return the sample stored for exactly these options, or None."""
+        key = self.sample_key(opts)
+
+        def load():
+            with open(self._path(key, '.json'), encoding='utf-8') as f:
+                return json.load(f)
+
+        return self._lookup(key, ('.json',), load)
+
+    def put_sample(self, opts: dict, sample: typing.Mapping[str, float]):
+        key = self.sample_key(opts)
+        sample = {str(v): int(val) for v, val in sample.items()}
+        with self._lock:
+            self._remember(key, sample)
+            if self.directory:
+                self._write(key, '.json', lambda f: f.write(json.dumps(sample).encode('utf-8')))
+                self.evict()
+
+    def evict(self, max_bytes: typing.Optional[int] = None, max_age: typing.Optional[float] = None):
+        """Remove on-disk files older than ``max_age`` seconds, then the
+        oldest files until the store is no larger than ``max_bytes``.
+        """
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+
+        # other processes sharing the directory may remove the same files
+        with self._lock:
+            now = time.time()
+            files = []
+            for entry in os.scandir(self.directory):
+                try:
+                    stat = entry.stat()
+                    if now - stat.st_mtime > max_age:
+                        os.remove(entry.path)
+                    elif entry.name.endswith(_TEMP_SUFFIX):
+                        # still being written, maybe by another process
+                        continue
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError:
+                    pass
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.evict(max_bytes=0)
+
+    def stats(self) -> dict:
+        return dict(memory_hits=self.hits['memory'], disk_hits=self.hits['disk'], misses=self.misses,
+                    discarded=self.discarded, entries=len(self._memory))
@@ -0,0 +1,203 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import re
+import sys
+import time
+import typing
+
+import numpy as np
+from dimod import ConstrainedQuadraticModel
+
+from batch_runner import classify_error
+from instrumentation import Profile
+from shift_scheduling import (RowBlock, Variables, _precheck, add_constraints, add_constraints_array, call_solver,
+                              constraint_blocks, define_objective, define_objective_array, options, reduce_blocks,
+                              solver_option_keys)
+
+
+class SweepModel:
+    """設定を変えながら使い回すCQM
+
+    keys（変える設定）の条件の行だけを作り直し、制約の形（変数と係数）が同じなら右辺だけを入れ替える。
+    7. の人数、4. 8. の回数・日数、2. の回数、6. 9. の日数などは右辺だけが変わる。
+    keys の条件の行は presolve と tighten で除かない（除く行が右辺で変わらないように）。
+    行が変わるとき、presolve で代入・統合する条件（3. 10. 12. 13.）が変わるとき、
+    そのほかの設定（ソルバーの設定を除く）が変わるときは作り直す。
+    """
+    def __init__(self, opts: dict, profile: Profile, keys: typing.Iterable[str] = ()):
+        self.opts = opts
+        self.conds = {_condition(k) for k in keys} - {None}
+        self.vars = Variables(opts)
+        self.cqm = ConstrainedQuadraticModel()
+        if opts['use_array_builder']:
+            self.blocks, self.labels = add_constraints_array(self.cqm, opts, self.vars, profile, swept=self.conds)
+            with profile.phase('define_objective'):
+                define_objective_array(self.cqm, opts, self.vars)
+        else:
+            with profile.phase('add_constraints'):
+                add_constraints(self.cqm, opts, self.vars)
+            with profile.phase('define_objective'):
+                define_objective(self.cqm, opts, self.vars)
+
+    def update(self, opts: dict, profile: Profile) -> bool:
+        """opts の右辺に入れ替える（制約の形が違って入れ替えられないときは False）"""
+        changed = [k for k in opts if k not in solver_option_keys and opts[k] != self.opts[k]]
+        conds = {_condition(k) for k in changed}
+        if not conds:
+            self.opts = opts
+            return True
+        if not opts['use_array_builder'] or not conds <= self.conds:
+            return False
+        with profile.phase('update_rhs'):
+            vars = Variables(opts)
+            if vars.labels != self.vars.labels:
+                return False
+            before = constraint_blocks(self.opts, vars, conds)
+            blocks = constraint_blocks(opts, vars, conds)
+            if any(_substituted(blk) for blk in before + blocks):
+                return False
+            if opts['use_presolve']:
+                blocks = reduce_blocks(self.vars, blocks, conds)
+            pos = [i for i, blk in enumerate(self.blocks) if blk.cond in conds]
+            if len(blocks) != len(pos) or not all(_same_rows(blk, self.blocks[i]) for blk, i in zip(blocks, pos)):
+                return False
+
+            # 作ったときの右辺は変えずに、差を左辺の定数項に入れる
+            for blk, i in zip(blocks, pos):
+                old, labels = self.blocks[i], self.labels[i]
+                for r in np.flatnonzero(blk.rhs != old.rhs):
+                    self.cqm.constraints[labels[r]].lhs.offset += old.rhs[r] - blk.rhs[r]
+                self.blocks[i] = blk
+        self.opts = opts
+        return True
+
+
+def _condition(key: str) -> typing.Optional[int]:
+    """設定のキーの条件番号（condNN_ で始まらないキーは None）"""
+    m = re.match(r'cond(\d\d)_', key)
+    return int(m.group(1)) if m else None
+
+
+def _substituted(blk: RowBlock) -> bool:
+    """presolve で代入・統合に使う行のまとまりか"""
+    return blk.sense == '==' and blk.idx.shape[1] <= 2
+
+
+def _same_rows(a: RowBlock, b: RowBlock) -> bool:
+    """右辺のほかは同じ制約のまとまりか"""
+    return (a.cond == b.cond and a.sense == b.sense and a.offset == b.offset
+            and np.array_equal(a.idx, b.idx) and np.array_equal(a.coef, b.coef))
+
+
+def sweep_points(values: typing.Dict[str, list]) -> typing.List[dict]:
+    """設定の値のすべての組み合わせ（隣どうしが１つの値だけ違うように、行ごとに折り返して並べる）"""
+    points = [dict()]
+    for key, vals in values.items():
+        points = [dict(p, **{key: v}) for i, p in enumerate(points)
+                  for v in (vals if i % 2 == 0 else list(reversed(vals)))]
+    return points
+
+
+def _chain(opts: dict, points: typing.List[dict]) -> typing.List[dict]:
+    """points を順に解く（前の点の答えを次の点の初期解にする）"""
+    model = None
+    warm = None
+    results = []
+    for point in points:
+        t = time.perf_counter()
+        profile = Profile()
+        point_opts = dict(opts, **point)
+        result = dict(point, status='ok', objective=None, conditions=None, error=None, rebuilt=False)
+        try:
+            _precheck(point_opts, profile)
+            if model is None or not model.update(point_opts, profile):
+                model = SweepModel(point_opts, profile, point.keys())
+                result['rebuilt'] = True
+            initial_state = {v: x for v, x in warm.items() if v in model.cqm.variables} if warm else None
+            sample = call_solver(model.cqm, point_opts, initial_state, profile)
+            warm = sample
+            result['objective'] = float(model.cqm.objective.energy(sample))
+        except Exception as e:
+            result.update(classify_error(e))
+        result.update(wall_time=time.perf_counter() - t, profile=profile.to_dict())
+        results.append(result)
+    return results
+
+
+def run_sweep(opts: dict, values: typing.Dict[str, list], num_workers: int = 1) -> typing.List[dict]:
+    """１つか２つの設定の値を変えて解き、値ごとの目的関数と答えの有無を返す
+
+    値を並べて num_workers 本の列に分け、列ごとに並列に解く。
+    列の中では CQM を使い回して右辺だけを入れ替え（SweepModel）、隣の値の答えを初期解にする。
+
+    Args:
+        opts: 元の設定。
+        values: {設定のキー: 値のリスト}（１つか２つ）。
+        num_workers: 同時に解く数。
+    Returns:
+        値の組み合わせごとの結果（sweep_points の順）。status は 'ok' 'infeasible'（矛盾する条件が conditions）
+        'no_solution'（制限時間内に答えが得られない）'error'（そのほかのエラー、内容が error）のどれか、
+        rebuilt は CQM を作り直したか。
+    """
+    unknown = sorted(set(values) - set(opts))
+    if unknown:
+        raise KeyError(f"unknown options: {', '.join(unknown)}")
+    if not 1 <= len(values) <= 2:
+        raise ValueError("変える設定は１つか２つにしてください")
+
+    points = sweep_points(values)
+    num_workers = max(min(num_workers, len(points)), 1)
+    chains = [chunk.tolist() for chunk in np.array_split(np.array(points, dtype=object), num_workers)]
+    with concurrent.futures.ThreadPoolExecutor(num_workers, thread_name_prefix='sweep') as pool:
+        return list(itertools.chain.from_iterable(pool.map(lambda points: _chain(opts, points), chains)))
+
+
+def feasible_range(results: typing.List[dict], key: str) -> typing.Optional[tuple]:
+    """答えの得られた key の値の最小と最大（なければ None）"""
+    vals = [r[key] for r in results if r['status'] == 'ok']
+    return (min(vals), max(vals)) if vals else None
+
+
+def parse_values(text: str) -> typing.Tuple[str, list]:
+    """'キー=最小:最大[:刻み]'（最大を含む）か 'キー=値,値,...'（JSONの値）"""
+    key, _, spec = text.partition('=')
+    if ':' in spec:
+        start, stop, *step = map(int, spec.split(':'))
+        return key, list(range(start, stop + 1, step[0] if step else 1))
+    return key, [json.loads(v) for v in spec.split(',')]
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description="設定の値を変えて、目的関数と答えの有無を調べる")
+    parser.add_argument('values', nargs='+', help="変える設定（キー=最小:最大[:刻み] か キー=値,値,...、２つまで）")
+    parser.add_argument('-s', '--options', default=None, help="元の設定（options との差分のJSONファイル）")
+    parser.add_argument('-o', '--output', default=None, help="結果のCSVファイル")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="同時に解く数（省略時: CPU数）")
+    parser.add_argument('-t', '--time-limit', type=float, default=None, help="値ごとの処理時間制限（秒）")
+    args = parser.parse_args(argv)
+
+    opts = dict(options)
+    if args.options:
+        with open(args.options, encoding='utf-8') as f:
+            opts.update(json.load(f))
+    if args.time_limit is not None:
+        opts['time_limit'] = args.time_limit
+    values = dict(map(parse_values, args.values))
+
+    import pandas as pd
+    results = run_sweep(opts, values, args.workers or os.cpu_count() or 1)
+    df = pd.DataFrame(results).drop(columns='profile')
+    print(df.to_string(index=False))
+    for key in values:
+        print(f"答えのある {key}: {feasible_range(results, key)}", file=sys.stderr)
+    if args.output:
+        df.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+
+    # python parameter_sweep.py cond07_wrk_cnt=10:18 cond04_all_cnt=6:10 -s 設定.json -t 10 -j 2
+    main()
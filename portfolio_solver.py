@@ -0,0 +1,216 @@
+import itertools
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+import typing
+
+import dimod
+
+from mip_solver import MIPCQMSolver
+
+# Python-MIP parameter sets tried in order; later entries reuse them with new seeds.
+CONFIGS = [
+    dict(),
+    dict(emphasis=1),               # feasibility
+    dict(emphasis=2),               # optimality
+    dict(cuts=3),                   # aggressive cuts
+    dict(preprocess=0),             # no presolve
+    dict(cuts=0),                   # no cuts
+    dict(emphasis=1, cuts=3),
+    dict(emphasis=2, preprocess=0),
+]
+
+
+def portfolio_configs(num_configs: int) -> typing.List[dict]:
+    """The first ``num_configs`` parameter sets, each with its own seed."""
+    return [dict(config, seed=seed)
+            for seed, config in zip(range(num_configs), itertools.cycle(CONFIGS))]
+
+
+def _worker():
+    """Run one configuration in a process started by :class:`MIPPortfolioCQMSolver`.
+
+    Reads ``(arrays, integral, start, time_limit, params)`` from stdin and
+    writes a ``('ready',)`` message once the model is built, then a
+    ``('solution', values, info)`` message for every improved solution to
+    stdout. CBC's own output goes to stderr.
+    """
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def send(*message):
+        pickle.dump(message, out)
+        out.flush()
+
+    # the constraint matrix is much faster to pass and load than the CQM itself
+    arrays, integral, start, time_limit, params = pickle.load(sys.stdin.buffer)
+    t = time.perf_counter()
+    model = MIPCQMSolver._model_from_arrays(arrays, **params)
+    x = list(model.vars)
+    if start:
+        model.start = [(x[j], val) for j, val in start]
+    build_time = time.perf_counter() - t
+    send('ready')
+    for sample, info in MIPCQMSolver._iter_search(model, x, integral, time_limit):
+        send('solution', sample, dict(info, build_time=build_time))
+
+
+def _talk(index: int, proc: subprocess.Popen, job: bytes, messages: queue.Queue):
+    """Send ``job`` to a worker and pass its messages on until it exits."""
+    try:
+        with proc.stdin:
+            proc.stdin.write(job)
+        while True:
+            messages.put((index,) + pickle.load(proc.stdout))
+    except (EOFError, OSError, pickle.UnpicklingError):
+        # the worker finished or was stopped
+        messages.put((index, 'exit'))
+
+
+class MIPPortfolioCQMSolver:
+    """Run several Python-MIP configurations in parallel processes and
+    keep the best result.
+
+    The workers are fresh interpreters running this module, so neither the
+    caller's threads (fork) nor its main module (spawn and forkserver
+    re-import it, which re-runs scripts without a main guard) matter to
+    them. Every worker reports each improved solution as soon as it finds
+    it, so nothing is lost when the others are stopped.
+
+    Args:
+        num_configs: Number of configurations (and processes) to run.
+        grace_time: Extra seconds to wait past ``time_limit`` for the last
+            results before the workers are stopped. The time limit counts
+            from when the first worker has built its model, so process
+            start-up and model building do not use it up.
+        poll_interval: Seconds between checks of ``stop``.
+    """
+    def __init__(self, num_configs: int = 4, grace_time: float = 5, poll_interval: float = 0.1):
+        self.configs = portfolio_configs(num_configs)
+        self.grace_time = grace_time
+        self.poll_interval = poll_interval
+
+    def _run(self, cqm: dimod.ConstrainedQuadraticModel, time_limit: float,
+             initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]],
+             stop: typing.Optional[threading.Event]) -> typing.Iterator[dimod.SampleSet]:
+        """Start every configuration and yield the sample sets they report
+        (``info['config']`` is the parameter set) until all have finished,
+        the deadline has passed or ``stop`` is set. The workers still
+        running are killed when the caller stops iterating."""
+        arrays = MIPCQMSolver._csr_arrays(cqm)
+        integral = MIPCQMSolver._integral_objective(cqm)
+        start = [(cqm.variables.index(v), val) for v, val in initial_state.items()] if initial_state else None
+        messages = queue.Queue()
+        procs = []
+        try:
+            for i, params in enumerate(self.configs):
+                proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                procs.append(proc)
+                job = pickle.dumps((arrays, integral, start, time_limit, params))
+                threading.Thread(target=_talk, args=(i, proc, job, messages), daemon=True).start()
+
+            deadline = float('inf')
+            running = len(procs)
+            while running:
+                if stop is not None and stop.is_set():
+                    return
+                try:
+                    index, kind, *payload = messages.get(
+                        timeout=max(0, min(deadline - time.monotonic(), self.poll_interval)))
+                except queue.Empty:
+                    if time.monotonic() >= deadline:
+                        return
+                    continue
+                if kind == 'ready':
+                    # every worker builds the same model, so the first one sets the deadline
+                    deadline = min(deadline, time.monotonic() + time_limit + self.grace_time)
+                elif kind == 'solution':
+                    sample, info = payload
+                    yield dimod.SampleSet.from_samples_cqm(
+                        ([] if sample is None else [sample], cqm.variables), cqm,
+                        info=dict(info, config=self.configs[index]))
+                else:
+                    running -= 1
+        finally:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+            for proc in procs:
+                proc.wait()
+
+    def iter_sample_cqm(self, cqm: dimod.ConstrainedQuadraticModel,
+                        time_limit: float = float('inf'),
+                        initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                        stop: typing.Optional[threading.Event] = None,
+                        ) -> typing.Iterator[dimod.SampleSet]:
+        """Like :meth:`MIPCQMSolver.iter_sample_cqm`, with every configuration
+        at once: yield each solution better than all found so far, by any
+        configuration, as soon as it is found.
+        Returns as soon as one configuration proves optimality or
+        infeasibility, when all have finished, the deadline has passed or
+        ``stop`` is set. The remaining processes are killed.
+        Args:
+            cqm: A constrained quadratic model.
+            time_limit: The maximum time in seconds to search.
+            initial_state: Start solution passed to every configuration.
+            stop: Once set, the search ends within ``poll_interval``
+                seconds, also while CBC is running.
+        Yields:
+            Sample sets with one solution each, with the ``info`` of
+            :meth:`MIPCQMSolver.iter_sample_cqm` and ``config``, the
+            parameter set that found it. The final sample set has status
+            ``OPTIMAL`` if its solution was proven optimal. If no solution
+            is found, a single empty sample set is yielded whose
+            ``status`` is ``INFEASIBLE`` if a configuration proved it.
+        """
+        best = None
+        status = 'NO_SOLUTION_FOUND'
+        for sampleset in self._run(cqm, time_limit, initial_state, stop):
+            if not len(sampleset):
+                if sampleset.info['status'] in ('INFEASIBLE', 'INT_INFEASIBLE'):
+                    status = sampleset.info['status']
+                    break
+                continue
+            optimal = sampleset.info['status'] == 'OPTIMAL'
+            if optimal or best is None or sampleset.info['objective'] < best.info['objective']:
+                best = sampleset
+                yield sampleset
+            if optimal:
+                return
+        if best is None:
+            yield dimod.SampleSet.from_samples_cqm(([], cqm.variables), cqm, info=dict(status=status))
+
+    def sample_cqm(self, cqm: dimod.ConstrainedQuadraticModel,
+                   time_limit: float = float('inf'),
+                   initial_state: typing.Optional[typing.Mapping[dimod.typing.Variable, float]] = None,
+                   stop: typing.Optional[threading.Event] = None,
+                   ) -> dimod.SampleSet:
+        """Solve a constrained quadratic model with every configuration at once.
+        Args:
+            cqm: A constrained quadratic model.
+            time_limit: The maximum time in seconds to search.
+            initial_state: Start solution passed to every configuration.
+            stop: See :meth:`iter_sample_cqm`.
+        Returns:
+            A sample set with every solution :meth:`iter_sample_cqm`
+            yielded. ``info`` is that of the best one: ``config`` is the
+            parameter set that found it and ``status`` its Python-MIP
+            status.
+        """
+        found = list(self.iter_sample_cqm(cqm, time_limit, initial_state, stop))
+        if not found:
+            return dimod.SampleSet.from_samples_cqm(([], cqm.variables), cqm,
+                                                    info=dict(status='NO_SOLUTION_FOUND'))
+        sampleset = dimod.concatenate(found).aggregate()
+        sampleset.info.clear()
+        sampleset.info.update(found[-1].info)
+        return sampleset
+
+
+if __name__ == '__main__':
+    _worker()
@@ -0,0 +1,76 @@
+import calendar
+import datetime
+import sys
+import typing
+
+import numpy as np
+
+from instrumentation import Profile
+from shift_scheduling import Schedule, Variables, build_cqm, call_solver, options, sample_to_array, worker_ids
+
+
+def months(year: int, month: int, num_months: int) -> typing.List[datetime.date]:
+    """year年month月から num_months か月分の各月の１日"""
+    firsts = []
+    for i in range(num_months):
+        y, m = divmod(month - 1 + i, 12)
+        firsts.append(datetime.date(year + y, m + 1, 1))
+    return firsts
+
+
+def solve_rolling_horizon(opts: dict, year: int, month: int, num_months: int,
+                          carry_days: int = 6, lookahead_days: int = 7,
+                          profile: typing.Optional[Profile] = None) -> Schedule:
+    """複数の月の勤務表を１か月ずつ順に解いてつなげる
+
+    各月は前の月の最後の carry_days 日を固定して引き継ぎ（1. 5. と月をまたぐ週の 6. 9.）、
+    次の月の最初の lookahead_days 日も一緒に解いて（確定はしない）月末に無理が出ないようにする。
+    週と土日は暦どおりに数え、月の回数・日数の条件（2. 4. 8.）と 12. の日は月ごとに使う。
+    １回に解く大きさは月の長さで決まるので、時間とメモリは月数に比例する。
+
+    Args:
+        opts: 設定（num_days, fst_dow は月ごとに暦から決める）。
+        year, month: 最初の月。
+        num_months: 月数（3:四半期 12:１年）。
+        carry_days: 前の月から引き継ぐ日数（1. の日数と6日のうち大きい方以上にする）。
+        lookahead_days: 先読みする日数（月をまたぐ週を数えるには6日以上にする）。
+        profile: 月ごとの計測を足していく Profile。
+    Returns:
+        すべての月をつなげた勤務表（start は最初の月の１日）。
+    Raises:
+        RuntimeError: ある月の答えが得られないとき（メッセージの先頭に月）。
+    """
+    if profile is None:
+        profile = Profile()
+
+    firsts = months(year, month, num_months)
+    history = np.zeros((opts['num_workers'], 0), dtype=np.uint8)
+    for i, first in enumerate(firsts):
+        num_days = calendar.monthrange(first.year, first.month)[1]
+        carry = history[:, history.shape[1] - min(carry_days, history.shape[1]):]
+        window_opts = dict(opts, num_days=num_days, fst_dow=first.weekday(), calendar_weeks=True,
+                           use_array_builder=True, carry_in=carry.tolist() if carry.size else [],
+                           lookahead_days=lookahead_days if i + 1 < len(firsts) else 0)
+
+        try:
+            vars = Variables(window_opts)
+            cqm = build_cqm(window_opts, vars, profile)
+            best_feasible = call_solver(cqm, window_opts, profile=profile)
+        except RuntimeError as e:
+            raise RuntimeError(f"{first.year}年{first.month}月: {e}") from e
+
+        # 引き継いだ日と先読みの日を除いて確定する
+        arr = sample_to_array(best_feasible, vars)
+        history = np.hstack([history, arr[:, carry.shape[1]:carry.shape[1] + num_days]])
+
+    return Schedule.from_array(history, firsts[0].weekday(), start=firsts[0])
+
+
+if __name__ == '__main__':
+
+    # python rolling_horizon.py 年 月 月数
+    year, month, num_months = map(int, sys.argv[1:4])
+    profile = Profile()
+    schedule = solve_rolling_horizon(options, year, month, num_months, profile=profile)
+    print(schedule.to_df(worker_ids(options)))
+    print(profile.to_json())
@@ -1,15 +1,37 @@
-from dwave.system import LeapHybridCQMSampler
-from dimod import quicksum, ConstrainedQuadraticModel, Binary, SampleSet
+from dimod import quicksum, ConstrainedQuadraticModel, Binary, SampleSet, BinaryQuadraticModel
 
 import numpy as np
-import pandas as pd
+import collections
+import concurrent.futures
+import datetime
+import hashlib
 import itertools
+import os
+import tempfile
+import threading
+import time
+import typing
 
-from mip_solver import MIPCQMSolver
+from model_cache import ModelCache
+from instrumentation import Profile
+from leap_client import get_leap_client
+
+# ソルバー（dwave, mip）と pandas は読み込みに時間がかかるので、最初に使うときに読み込む
+if typing.TYPE_CHECKING:
+    import pandas as pd
 
 # ワーカー文字リスト（A～Z）
 wrk_chr = [chr(ord('A')+w) for w in range(26)]
 
+def worker_label(w: int) -> str:
+    """w番目のワーカーの既定のID（A～Z, AA, AB, ・・・）"""
+    label = ''
+    w += 1
+    while w:
+        w, r = divmod(w - 1, 26)
+        label = chr(ord('A') + r) + label
+    return label
+
 # 曜日文字リスト（月～日）
 dow_chr = ['月','火','水','木','金','土','日']
 
@@ -19,10 +41,32 @@ wd_chr = ['－', '〇']
 options = {
     'use_cqm_solver': False,    # 量子コンピュータ (LeapHybridCQMSampler)を True:使う False:使わない
     'time_limit': 20,           # 処理時間制限（秒）
+    'use_heuristic_solver': False,  # 高速なヒューリスティック (HeuristicCQMSolver)を True:使う False:使わない
+    'use_decomposition': False,  # ワーカーごとに分けて解く（列生成、多人数向け）を True:使う False:使わない
+    'num_alternatives': 1,      # 作る勤務表の候補の数（2以上: 互いに違う勤務表を良い順に作る）
+    'alternative_distance': 10, # 候補どうしで違うセルの数の下限
+    'heuristic_warm_start': 0,  # Python-MIPの前にヒューリスティックで初期解を作る時間（秒、0:作らない）
+    'portfolio_size': 1,        # Python-MIPを設定を変えて並列に実行する数（1:並列にしない）
     'num_workers': 20,          # ワーカーの人数
+    'worker_ids': None,         # ワーカーのIDのリスト（None: A～Z, AA, AB, ・・・）
     'num_days': 30,             # ひと月の日数
     'fst_dow': 0,               # 月の最初の曜日（0:月 1:火 ・・・）
     'obj_sign': -1,             # 目的関数 -1:出勤をできるだけ多くする +1:休日をできるだけ多くする
+    'use_array_builder': True,  # CQMの構築を True:配列で一括 False:制約ごとに式を組み立てる
+    'use_presolve': True,       # 前処理（固定変数の代入・一緒に勤務する変数の統合）を True:する False:しない（配列で構築するときのみ）
+    'use_tightening': True,     # 前処理の後に、重複した制約とほかの制約から導ける制約を除く True:する False:しない（配列で構築するときのみ）
+    'use_pairwise_exclusion': False,  # 11.の制約を True:２人ずつ組にする False:グループで１本にする
+    'use_symmetry_ordering': False,  # 設定がすべて同じワーカーを True:勤務の辞書順で並べる（入れ替えただけの答えを除く） False:並べない
+    'ordering_days': 2,         # 辞書順で比べる日数（0:すべての日 1:最初の日だけ ・・・、増やすと除く答えは増えるがCBCが遅くなりやすい）
+    'use_precheck': True,       # 解く前に数を数えて条件の矛盾を調べ、答えがないときは矛盾する条件を探す True:する False:しない
+    'explain_time_limit': 10,   # 答えがないときに矛盾する条件をPython-MIPで探す処理時間制限（秒、0:探さない）
+    'repair_time_limit': 5,     # 勤務表の修正の処理時間制限（秒）
+    'repair_penalty': 2,        # 勤務表の修正で１セル変更するごとに目的関数に足す値
+    'fixed_off_cells': [],      # 休みにするセル [(ワーカー文字, 日), ...]（勤務表の修正で使用）
+    'profile_log': None,        # 計測結果をJSONで１行ずつ追記するファイル（None:書かない）
+    'calendar_weeks': False,    # 2.の土日と6.9.の週を True:暦どおり（月の中のすべての土日、月曜始まりの週） False:１日目から７日ずつ４回
+    'carry_in': [],             # 前の期間の最後の数日の勤務（ワーカーごとの0/1のリスト、長期計画で使用、配列で構築するときのみ）
+    'lookahead_days': 0,        # 月の後ろに足して一緒に解く日数（月の回数・日数には数えない、長期計画で使用、配列で構築するときのみ）
 
     # 1. ３～６日連続勤務で１日休み（全員／個別）
     'cond01_all_chk': False,
@@ -103,21 +147,136 @@ options = {
     'cond13_wrks': [],
 }
 
+# モデルに影響しない（ソルバーの）設定
+solver_option_keys = ['use_cqm_solver', 'time_limit', 'use_heuristic_solver', 'use_decomposition', 'heuristic_warm_start',
+                      'num_alternatives', 'alternative_distance',
+                      'portfolio_size', 'use_precheck', 'explain_time_limit', 'repair_time_limit', 'repair_penalty', 'profile_log']
+
+def _code_version() -> str:
+    """CQMを作るコード（このファイル）のハッシュ"""
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+# 設定ごとのCQMと解のキャッシュ（コードを変えると前に作ったものは使わない）
+model_cache = ModelCache(os.path.join(tempfile.gettempdir(), 'shift_scheduling_cache'), ignore=solver_option_keys,
+                         version=_code_version())
+
+def worker_ids(opts: dict) -> typing.List[str]:
+    """ワーカーのIDのリスト（w番目がワーカーw、数が違うときや同じIDがあるときはエラー）"""
+    if opts['worker_ids'] is None:
+        return [worker_label(w) for w in range(opts['num_workers'])]
+    if len(opts['worker_ids']) != opts['num_workers']:
+        raise ValueError("worker_ids の数が num_workers と違います")
+    ids = list(map(str, opts['worker_ids']))
+    dup = [x for x, n in collections.Counter(ids).items() if n > 1]
+    if dup:
+        raise ValueError(f"worker_ids に同じID {', '.join(dup)} があります")
+    return ids
+
+def worker_index(opts: dict) -> typing.Dict[str, int]:
+    """ワーカーのIDから番号を引く辞書"""
+    return {x: w for w, x in enumerate(worker_ids(opts))}
+
+def worker_mask(index: typing.Dict[str, int], ids: typing.Iterable[str]) -> np.ndarray:
+    """ids のワーカーを True にした配列（知らないIDは無視する）"""
+    mask = np.zeros(len(index), dtype=bool)
+    mask[[index[x] for x in ids if x in index]] = True
+    return mask
+
+def worker_numbers(index: typing.Dict[str, int], ids: typing.Iterable[str]) -> typing.List[int]:
+    """ids のワーカーの番号（知らないIDは無視する）"""
+    return [index[x] for x in ids if x in index]
+
+def off_cell_numbers(opts: dict) -> typing.List[typing.Tuple[int, int]]:
+    """fixed_off_cells の (ワーカーの番号, 月の日のインデックス) のリスト（知らないIDや月にない日はエラー）"""
+    index = worker_index(opts)
+    cells = []
+    for x, d in opts['fixed_off_cells']:
+        if x not in index:
+            raise ValueError(f"fixed_off_cells のワーカー {x} がいません")
+        if not 1 <= d <= opts['num_days']:
+            raise ValueError(f"fixed_off_cells の日 {d} が月にありません")
+        cells.append((index[x], d - 1))
+    return cells
+
+def window_days(opts: dict) -> typing.Tuple[int, int]:
+    """(前の期間から引き継ぐ日数, 引き継ぐ日と先読みの日を含めた日数)
+
+    変数の日 d は引き継ぐ日から数える（月の１日目は d = 引き継ぐ日数）。
+    """
+    carry = len(opts['carry_in'][0]) if opts['carry_in'] else 0
+    return carry, carry + opts['num_days'] + opts['lookahead_days']
+
+def day_of_week(opts: dict) -> np.ndarray:
+    """変数の日ごとの曜日（0:月 ・・・ 6:日）"""
+    carry, total = window_days(opts)
+    return (opts['fst_dow'] + np.arange(-carry, total - carry)) % 7
+
+def weekend_days(opts: dict) -> np.ndarray:
+    """2. で数える土日の土曜日"""
+    carry, total = window_days(opts)
+    if not opts['calendar_weeks']:
+        return carry + (12 - opts['fst_dow']) % 7 + 7 * np.arange(4)
+    # 土曜日が月の中にあり、日曜日まで解く土日
+    sat = np.flatnonzero(day_of_week(opts) == 5)
+    return sat[(sat >= carry) & (sat < carry + opts['num_days']) & (sat + 1 < total)]
+
+def week_days(opts: dict) -> np.ndarray:
+    """6. 9. で数える週の日 (週の数, 7)"""
+    carry, total = window_days(opts)
+    if not opts['calendar_weeks']:
+        return carry + np.arange(28).reshape(4, 7)
+    # 月の日を含み、月曜から日曜まで解く週（月をまたぐ週は引き継ぎ・先読みの日で数える）
+    mon = np.flatnonzero(day_of_week(opts) == 0)
+    mon = mon[(mon + 7 <= total) & (mon + 7 > carry) & (mon < carry + opts['num_days'])]
+    return mon[:, None] + np.arange(7)
+
 class Variables:
     def __init__(self, opts: dict):
         num_workers = opts['num_workers']
-        num_days = opts['num_days']
+        _, num_days = window_days(opts)
+        num_weekends = len(weekend_days(opts))
 
         # バイナリ変数
         # wd=1のとき、ワーカーwが日dに出勤 
         # wd=0のとき、ワーカーwが日dに休み 
-        self.wd = {(w, d): Binary(f'worker_{w}_day_{d}') for w in range(num_workers) for d in range(num_days)}
+        # （wd, wwe の式は制約ごとに式を組み立てるときだけ使うので、最初に使うときに作る）
+        self._wd = None
+        self._wwe = None
+
+        # 配列で一括構築するときに使う変数ラベルとインデックス
+        # labels[wd_idx[w,d]] が wd[w,d] のラベル
+        self.labels = [f'worker_{w}_day_{d}' for w in range(num_workers) for d in range(num_days)]
+        self.wd_idx = np.arange(num_workers * num_days).reshape(num_workers, num_days)
+
+        # 休みにするセル (ワーカー, 月の日)（ここで確かめるので、どちらの構築でも同じエラーになる）
+        self.off_cells = off_cell_numbers(opts)
 
         # 2. 土日連休を月１～４回以上割り当てる で使用するバイナリ変数
         # wwe=1のとき、ワーカーwのwe回目の土日が連休
         # wwe=0のとき、ワーカーwのwe回目の土日が連休ではない（土または日が休みの場合も含む）
         if opts['cond02_all_chk'] or opts['cond02_sel_chk']:
-            self.wwe = {(w, we): Binary(f'worker_{w}_weekend_{we}') for w in range(num_workers) for we in range(4)}
+            self.labels += [f'worker_{w}_weekend_{we}' for w in range(num_workers) for we in range(num_weekends)]
+            self.wwe_idx = np.arange(num_workers * num_weekends).reshape(num_workers, num_weekends) + num_workers * num_days
+
+        # 設定が同じワーカーを辞書順で並べる（use_symmetry_ordering）ときに使用するバイナリ変数
+        # order_pairs[p] の２人を order_days の日の勤務で比べる
+        # weq[p,k]=1 でないといけないのは、２人の勤務が order_days[k] の日まで同じとき（違う日があれば0にできる）
+        if opts['use_symmetry_ordering']:
+            carry, total = window_days(opts)
+            days = total - carry if opts['ordering_days'] <= 0 else min(opts['ordering_days'], total - carry)
+            self.order_pairs = np.array([(a, b) for c in worker_classes(opts) for a, b in zip(c, c[1:])],
+                                        dtype=int).reshape(-1, 2)
+            self.order_days = np.arange(carry, carry + days)
+            first = len(self.labels)
+            self.labels += [f'order_{a}_{b}_day_{d}' for a, b in self.order_pairs.tolist()
+                            for d in self.order_days[:-1].tolist()]
+            self.weq_idx = np.arange(len(self.order_pairs) * (days - 1)).reshape(len(self.order_pairs), days - 1) + first
+
+        # 前処理の結果（presolve で設定）
+        # rep[i]: 変数iの代表変数のインデックス、fix[i]: 代表変数iの固定値（固定しないときはnan）
+        self.rep = None
+        self.fix = None
         
         # 11. 一緒に勤務させない で使用するバイナリ変数 
         # dww=1のとき、ワーカー1は出、かつ、ワーカー2は休
@@ -126,14 +285,29 @@ class Variables:
         #    self.dww = {(d, w1, w2): Binary(f'day_{d}_worker1_{w1}_worker2_{w2}')
         #        for d in range(num_days) for w1 in range(num_workers) for w2 in range(num_workers)}
 
+    @property
+    def wd(self) -> typing.Dict[tuple, BinaryQuadraticModel]:
+        if self._wd is None:
+            self._wd = {(w, d): Binary(self.labels[i]) for (w, d), i in np.ndenumerate(self.wd_idx)}
+        return self._wd
+
+    @property
+    def wwe(self) -> typing.Dict[tuple, BinaryQuadraticModel]:
+        if self._wwe is None:
+            self._wwe = {(w, we): Binary(self.labels[i]) for (w, we), i in np.ndenumerate(self.wwe_idx)}
+        return self._wwe
+
 def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables):
     num_workers = opts['num_workers']
     num_days = opts['num_days']
     fst_dow = opts['fst_dow']
+    index = worker_index(opts)
+    # 個別の対象者（ワーカーごとの True/False）
+    sel = {c: worker_mask(index, opts[f'{c}_sel_wrks']) for c in ['cond01', 'cond02', 'cond03', 'cond04', 'cond06', 'cond08', 'cond09']}
 
     # 1. ３～６日連続勤務で１日休み
     for w in range(num_workers):
-        if opts['cond01_sel_chk'] and chr(ord('A')+w) in opts['cond01_sel_wrks']:
+        if opts['cond01_sel_chk'] and sel['cond01'][w]:
             days = opts['cond01_sel_days']
         elif opts['cond01_all_chk']:
             days = opts['cond01_all_days']
@@ -144,9 +318,9 @@ def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables)
             cqm.add_constraint(quicksum(vars.wd[w,d + i] for i in range(days + 1)) <= days)
 
     # 2. 土日連休を月１～４回以上割り当てる
-    fst_sat = (12 - fst_dow) % 7
+    sats = weekend_days(opts).tolist()
     for w in range(num_workers):
-        if opts['cond02_sel_chk'] and chr(ord('A')+w) in opts['cond02_sel_wrks']:
+        if opts['cond02_sel_chk'] and sel['cond02'][w]:
             we_cnt = opts['cond02_sel_cnt']
         elif opts['cond02_all_chk']:
             we_cnt = opts['cond02_all_cnt']
@@ -155,23 +329,23 @@ def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables)
 
         # wwe=1のとき、ワーカーwのwe回目の土日が連休
         # wwe=0のとき、ワーカーwのwe回目の土日が連休ではない（土または日が休みの場合も含む）
-        for we in range(4):
-            cqm.add_constraint(2 * vars.wwe[w, we]  - (1 - vars.wd[w, we * 7 + fst_sat]) - (1 - vars.wd[w, we * 7 + fst_sat + 1]) <= 0)
-            cqm.add_constraint((1 - vars.wwe[w, we]) - vars.wd[w, we * 7 + fst_sat] - vars.wd[w, we * 7 + fst_sat + 1] <= 0)
-        cqm.add_constraint(quicksum(vars.wwe[w, we] for we in range(4)) >= we_cnt)
+        for we, sat in enumerate(sats):
+            cqm.add_constraint(2 * vars.wwe[w, we]  - (1 - vars.wd[w, sat]) - (1 - vars.wd[w, sat + 1]) <= 0)
+            cqm.add_constraint((1 - vars.wwe[w, we]) - vars.wd[w, sat] - vars.wd[w, sat + 1] <= 0)
+        cqm.add_constraint(quicksum(vars.wwe[w, we] for we in range(len(sats))) >= we_cnt)
 
     # 3. 土日を休みにする
     for w in range(num_workers):
         for d in range(num_days):
             if (fst_dow + d) % 7 >= 5:
-                if opts['cond03_sel_chk'] and chr(ord('A')+w) in opts['cond03_sel_wrks']:
+                if opts['cond03_sel_chk'] and sel['cond03'][w]:
                     cqm.add_constraint(vars.wd[w,d] == 0)
                 elif opts['cond03_all_chk']:
                     cqm.add_constraint(vars.wd[w,d] == 0)
 
     # 4. 休みを月４～１０回割り当てる
     for w in range(num_workers):
-        if opts['cond04_sel_chk'] and chr(ord('A')+w) in opts['cond04_sel_wrks']:
+        if opts['cond04_sel_chk'] and sel['cond04'][w]:
             cqm.add_constraint(quicksum(vars.wd[w,d] for d in range(num_days)) <= num_days - opts['cond04_sel_cnt'])
         elif opts['cond04_all_chk']:
             cqm.add_constraint(quicksum(vars.wd[w,d] for d in range(num_days)) <= num_days - opts['cond04_all_cnt'])
@@ -183,12 +357,13 @@ def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables)
                 cqm.add_constraint(vars.wd[w,d] - vars.wd[w,d+1] + vars.wd[w,d+2] >= 0)  
     
     # 6. 休みを週に１～６回以上割当（全員／個別）
+    weeks = week_days(opts).tolist()
     for w in range(num_workers):
-        for wk in range(4):
-            if opts['cond06_sel_chk'] and chr(ord('A')+w) in opts['cond06_sel_wrks']:
-                cqm.add_constraint(quicksum(vars.wd[w,d + wk * 7] for d in range(7)) <= 7 - opts['cond06_sel_days'])
+        for week in weeks:
+            if opts['cond06_sel_chk'] and sel['cond06'][w]:
+                cqm.add_constraint(quicksum(vars.wd[w,d] for d in week) <= 7 - opts['cond06_sel_days'])
             elif opts['cond06_all_chk']:
-                cqm.add_constraint(quicksum(vars.wd[w,d + wk * 7] for d in range(7)) <= 7 - opts['cond06_all_days'])
+                cqm.add_constraint(quicksum(vars.wd[w,d] for d in week) <= 7 - opts['cond06_all_days'])
 
     # 7. １日の出勤人数はＸ人以上（平日／土日）
     for d in range(num_days):
@@ -199,24 +374,24 @@ def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables)
 
     # 8. 月の出勤日数を４～２４日以上（全員／個別）
     for w in range(num_workers):
-        if opts['cond08_sel_chk'] and chr(ord('A')+w) in opts['cond08_sel_wrks']:
+        if opts['cond08_sel_chk'] and sel['cond08'][w]:
             cqm.add_constraint(quicksum(vars.wd[w,d] for d in range(num_days)) >= opts['cond08_sel_days'])
         elif opts['cond08_all_chk']:
             cqm.add_constraint(quicksum(vars.wd[w,d] for d in range(num_days)) >= opts['cond08_all_days'])
     
     # 9. 週の出勤日数は１～６日以上（全員／個別）
     for w in range(num_workers):
-        for wk in range(4):
-            if opts['cond09_sel_chk'] and chr(ord('A')+w) in opts['cond09_sel_wrks']:
-                cqm.add_constraint(quicksum(vars.wd[w,d + wk * 7] for d in range(7)) >= opts['cond09_sel_days'])
+        for week in weeks:
+            if opts['cond09_sel_chk'] and sel['cond09'][w]:
+                cqm.add_constraint(quicksum(vars.wd[w,d] for d in week) >= opts['cond09_sel_days'])
             elif opts['cond09_all_chk']:
-                cqm.add_constraint(quicksum(vars.wd[w,d + wk * 7] for d in range(7)) >= opts['cond09_all_days'])
+                cqm.add_constraint(quicksum(vars.wd[w,d] for d in week) >= opts['cond09_all_days'])
 
     # 10. 一緒に勤務させる
     if opts['cond10_chk']:
         for d in range(num_days):
             for grp_chr in [opts['cond10_wrks_A'], opts['cond10_wrks_B'], opts['cond10_wrks_C']]:
-                grp_num = list(map(lambda x: wrk_chr.index(x), grp_chr))
+                grp_num = worker_numbers(index, grp_chr)
                 for cmb in itertools.combinations(grp_num, 2):
                     cqm.add_constraint(vars.wd[cmb[0],d] - vars.wd[cmb[1],d] == 0)  
     
@@ -224,7 +399,12 @@ def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables)
     if opts['cond11_chk']:
         for d in range(num_days):
             for grp_chr in [opts['cond11_wrks_A'], opts['cond11_wrks_B'], opts['cond11_wrks_C']]:
-                grp_num = list(map(lambda x: wrk_chr.index(x), grp_chr))
+                grp_num = worker_numbers(index, grp_chr)
+                if not opts['use_pairwise_exclusion']:
+                    # グループの中で出勤するのは１人まで
+                    if len(grp_num) >= 2:
+                        cqm.add_constraint(quicksum(vars.wd[w,d] for w in grp_num) <= 1)
+                    continue
                 for cmb in itertools.combinations(grp_num, 2):
                     # dww=1のとき、ワーカー1は出、かつ、ワーカー2は休
                     # dww=0のとき、ワーカー1は休、かつ、ワーカー2は出
@@ -236,67 +416,1185 @@ def add_constraints(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables)
 
     # 12. 特定の日を休みにする（個別）
     if opts['cond12_chk']:
-        for w in list(map(lambda x: wrk_chr.index(x), opts['cond12_wrks'])):
+        for w in worker_numbers(index, opts['cond12_wrks']):
             for d in opts['cond12_days']:
                 cqm.add_constraint(vars.wd[w,d-1] == 0) 
 
     # 13. 特定の曜日を休みにする（個別）
     if opts['cond13_chk']:
-        for w in list(map(lambda x: wrk_chr.index(x), opts['cond13_wrks'])):
+        for w in worker_numbers(index, opts['cond13_wrks']):
             for dow in list(map(lambda x: dow_chr.index(x), opts['cond13_dows'])):
                 for d in [x for x in range(num_days) if ((x + fst_dow) % 7) == dow]:
                     cqm.add_constraint(vars.wd[w,d] == 0) 
 
+    # 休みにするセル（勤務表の修正で使用）
+    for w, d in vars.off_cells:
+        cqm.add_constraint(vars.wd[w,d] == 0)
+
+    # 設定が同じワーカーを勤務の辞書順で並べる
+    if opts['use_symmetry_ordering']:
+        cqm.add_variables('BINARY', [vars.labels[i] for i in vars.weq_idx.reshape(-1).tolist()])
+        for blk in symmetry_blocks(opts, vars):
+            for idx, coef, rhs in zip(blk.idx.tolist(), blk.coef.tolist(), blk.rhs.tolist()):
+                cqm.add_constraint_from_iterable([(vars.labels[i], c) for i, c in zip(idx, coef)], blk.sense, rhs)
+
 def define_objective(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables):
     num_workers = opts['num_workers']
     num_days = opts['num_days']
     obj_sign = opts['obj_sign']
     cqm.set_objective(quicksum(obj_sign * vars.wd[w, d] for w in range(num_workers) for d in range(num_days)))
 
-def build_cqm(opts: dict, vars: Variables) -> ConstrainedQuadraticModel:
+# 休みにするセル（fixed_off_cells）の制約の条件（条件番号ではないので文字列にする）
+FIXED_CELLS = 'fixed'
+
+def sorted_conditions(conditions: typing.Iterable) -> list:
+    """条件番号を小さい順に並べ、休みにするセル（FIXED_CELLS）は最後にする"""
+    conds = {c if isinstance(c, str) else int(c) for c in conditions}
+    return sorted(conds, key=lambda c: (isinstance(c, str), c))
+
+class InfeasibleError(RuntimeError):
+    """同時に満たせない条件があるときのエラー
+
+    conditions は条件番号（0は前の期間から引き継いだ勤務）と、休みにするセルの FIXED_CELLS。
+    """
+    def __init__(self, conditions: typing.Iterable):
+        self.conditions = sorted_conditions(conditions)
+        nums = [c for c in self.conditions if c != FIXED_CELLS]
+        names = ([f"条件{', '.join(map(str, nums))}"] if nums else []) + (['休みにするセル'] if FIXED_CELLS in self.conditions else [])
+        both = '同時に' if len(self.conditions) > 1 else ''
+        super().__init__(f"{'と'.join(names)}を{both}満たす答えがありません。条件を調整してください。")
+
+class RowBlock(typing.NamedTuple):
+    """同じ形の線形制約をまとめたもの
+
+    i行目の制約は sum(coef[i,k] * x[idx[i,k]]) + offset <sense> rhs[i]
+    """
+    cond: typing.Union[int, str]  # 条件番号（0～13）または FIXED_CELLS
+    idx: np.ndarray     # 変数インデックス (行数, 項数)
+    coef: np.ndarray    # 係数 (行数, 項数)
+    offset: float       # 左辺の定数項
+    sense: str          # '<=', '>=', '=='
+    rhs: np.ndarray     # 右辺 (行数,)
+
+def _block(cond: typing.Union[int, str], idx: np.ndarray, coef, sense: str, rhs, offset: float = 0) -> RowBlock:
+    idx = np.asarray(idx, dtype=int)
+    idx = idx[:, None] if idx.ndim == 1 else idx
+    coef = np.broadcast_to(np.asarray(coef, dtype=float), idx.shape)
+    rhs = np.broadcast_to(np.asarray(rhs, dtype=float), idx.shape[:1])
+    return RowBlock(cond, idx, coef, offset, sense, rhs)
+
+def _worker_values(opts: dict, index: typing.Dict[str, int], cond: str, key: typing.Optional[str]) -> np.ndarray:
+    """全員／個別の設定をワーカーごとの値にする（対象外は-1、keyがNoneのときは対象を1）"""
+    num_workers = opts['num_workers']
+    vals = np.full(num_workers, -1)
+    if opts[f'{cond}_all_chk']:
+        vals[:] = opts[f'{cond}_all_{key}'] if key else 1
+    if opts[f'{cond}_sel_chk']:
+        vals[worker_mask(index, opts[f'{cond}_sel_wrks'])] = opts[f'{cond}_sel_{key}'] if key else 1
+    return vals
+
+def _groups(index: typing.Dict[str, int], opts: dict, keys: typing.List[str]) -> typing.List[typing.List[int]]:
+    return [worker_numbers(index, opts[k]) for k in keys]
+
+def worker_classes(opts: dict) -> typing.List[typing.List[int]]:
+    """設定がすべて同じで、入れ替えても制約と目的関数が変わらないワーカーの組（２人以上の組だけ）
+
+    全員／個別の条件（1. 2. 3. 4. 6. 8. 9.）の値、10.～13.の対象、休みにするセル、引き継いだ勤務がすべて同じワーカーを組にする。
+    """
+    num_workers = opts['num_workers']
+    index = worker_index(opts)
+    keys = [_worker_values(opts, index, c, k)[:, None] for c, k in
+            [('cond01', 'days'), ('cond02', 'cnt'), ('cond03', None), ('cond04', 'cnt'),
+             ('cond06', 'days'), ('cond08', 'days'), ('cond09', 'days')]]
+    lists = [k for c in ['cond10', 'cond11'] if opts[f'{c}_chk'] for k in [f'{c}_wrks_A', f'{c}_wrks_B', f'{c}_wrks_C']]
+    lists += [f'{c}_wrks' for c in ['cond12', 'cond13'] if opts[f'{c}_chk']]
+    keys += [worker_mask(index, opts[k])[:, None] for k in lists]
+    cells = np.zeros((num_workers, opts['num_days']), dtype=bool)
+    for w, d in off_cell_numbers(opts):
+        cells[w, d] = True
+    keys.append(cells)
+    if opts['carry_in']:
+        keys.append(np.asarray(opts['carry_in']))
+
+    _, inverse = np.unique(np.hstack(keys).astype(int), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    classes = [np.flatnonzero(inverse == c).tolist() for c in range(inverse.max() + 1)]
+    return [c for c in classes if len(c) >= 2]
+
+def symmetry_blocks(opts: dict, vars: Variables) -> typing.List[RowBlock]:
+    """worker_classes の組の中で、前のワーカーの勤務を次のワーカーの勤務より辞書順で前にする制約（条件0）
+
+    引き継いだ日の後の日を順に（ordering_days の日数まで）比べ、出勤を1として前のワーカーの勤務を辞書順で大きいか同じにする。
+    どの勤務表もワーカーを並べ替えればこの制約を満たすので、最適値は変わらない。
+    辞書順を１本の制約にすると係数が 2**日数 まで大きくなり緩和問題が弱くなるので、隣り合う２人ごとに
+    d日目まで同じかを表す変数 weq を使い、係数が２以下の制約を日ごとに作る（x は前の人 a と次の人 b の勤務）。
+        x[a,d] - x[b,d] >= weq[d-1] - 1                  d-1日目まで同じなら d日目は x[a,d] >= x[b,d]
+        weq[d] >= 2 * weq[d-1] - 1 - (x[a,d] - x[b,d])    d日目まで同じなら weq[d] = 1
+    （最初の日の weq[d-1] は1）
+    比べる日を増やすと入れ替えただけの答えを多く除けるが、CBCが実行可能解を見つけにくくなり、
+    bench_symmetry のケースでは３日以上で遅くなった（既定の ordering_days は２日）。
+    """
+    pairs, weq = vars.order_pairs, vars.weq_idx
+    if not len(pairs):
+        return []
+    xa = vars.wd_idx[pairs[:, 0]][:, vars.order_days]
+    xb = vars.wd_idx[pairs[:, 1]][:, vars.order_days]
+    blocks = [_block(0, np.stack([xa[:, 0], xb[:, 0]], axis=1), [1, -1], '>=', 0)]
+    if weq.shape[1]:
+        blocks.append(_block(0, np.stack([xa[:, 1:], xb[:, 1:], weq], axis=-1).reshape(-1, 3), [1, -1, -1], '>=', -1))
+        blocks.append(_block(0, np.stack([weq[:, 0], xa[:, 0], xb[:, 0]], axis=1), [1, 1, -1], '>=', 1))
+        blocks.append(_block(0, np.stack([weq[:, 1:], weq[:, :-1], xa[:, 1:-1], xb[:, 1:-1]], axis=-1).reshape(-1, 4),
+                             [1, -2, 1, -1], '>=', -1))
+    return [b for b in blocks if len(b.idx)]
+
+def _headcount(opts: dict) -> np.ndarray:
+    """7. の日ごとの出勤人数（条件のない日と引き継いだ日は-1）"""
+    carry, total = window_days(opts)
+    dow = day_of_week(opts)
+    cnt = np.full(total, -1)
+    if opts['cond07_wrk_chk']:
+        cnt[dow <= 4] = opts['cond07_wrk_cnt']
+    if opts['cond07_hol_chk']:
+        cnt[dow >= 5] = opts['cond07_hol_cnt']
+    cnt[:carry] = -1
+    return cnt
+
+def constraint_blocks(opts: dict, vars: Variables,
+                      conds: typing.Optional[typing.Collection] = None) -> typing.List[RowBlock]:
+    """add_constraints と同じ制約を条件ごとの配列のまとまりとして作る
+
+    carry_in の日は固定し、月の回数・日数（2. 4. 8.）は月の日だけで数える。
+    conds があれば、その条件（番号か FIXED_CELLS）のまとまりだけを作る（右辺を入れ替えるときに使用）。
+    """
+    num_days = opts['num_days']
+    carry, total = window_days(opts)
+    wd = vars.wd_idx
+    dow = day_of_week(opts)
+    index = worker_index(opts)
+    month = wd[:, carry:carry + num_days]
+    weeks = week_days(opts)
+    # 引き継いだ日は決まっているので、日ごとの条件は引き継いだ日の後だけ
+    new = np.arange(total) >= carry
+    blocks = []
+
+    def want(cond: typing.Union[int, str]) -> bool:
+        return conds is None or cond in conds
+
+    # 前の期間から引き継いだ勤務（条件0）
+    if carry and want(0):
+        fixed = np.asarray(opts['carry_in'], dtype=float)
+        blocks.append(_block(0, wd[:, :carry].reshape(-1), 1, '==', fixed.reshape(-1)))
+
+    # 1. ３～６日連続勤務で１日休み
+    if want(1):
+        vals = _worker_values(opts, index, 'cond01', 'days')
+        for days in np.unique(vals[vals >= 0]):
+            # 引き継いだ日だけの並びは除く
+            win = np.lib.stride_tricks.sliding_window_view(wd[vals == days][:, max(carry - days, 0):], days + 1, axis=1)
+            blocks.append(_block(1, win.reshape(-1, days + 1), 1, '<=', days))
+
+    # 2. 土日連休を月１～４回以上割り当てる
+    if want(2):
+        vals = _worker_values(opts, index, 'cond02', 'cnt')
+        sel = vals >= 0
+        if sel.any():
+            sat = weekend_days(opts)
+            we_idx = np.stack([vars.wwe_idx[sel], wd[sel][:, sat], wd[sel][:, sat + 1]], axis=-1).reshape(-1, 3)
+            # wwe=1のとき、ワーカーwのwe回目の土日が連休
+            # wwe=0のとき、ワーカーwのwe回目の土日が連休ではない（土または日が休みの場合も含む）
+            blocks.append(_block(2, we_idx, [2, 1, 1], '<=', 0, offset=-2))
+            blocks.append(_block(2, we_idx, [-1, -1, -1], '<=', 0, offset=1))
+            blocks.append(_block(2, vars.wwe_idx[sel], 1, '>=', vals[sel]))
+
+    # 3. 土日を休みにする
+    if want(3):
+        vals = _worker_values(opts, index, 'cond03', None)
+        blocks.append(_block(3, wd[vals >= 0][:, (dow >= 5) & new].reshape(-1), 1, '==', 0))
+
+    # 4. 休みを月４～１０回割り当てる
+    if want(4):
+        vals = _worker_values(opts, index, 'cond04', 'cnt')
+        blocks.append(_block(4, month[vals >= 0], 1, '<=', num_days - vals[vals >= 0]))
+
+    # 5. 休→出→休の飛び石連休はなし
+    if want(5) and opts['cond05_chk']:
+        win = np.lib.stride_tricks.sliding_window_view(wd[:, max(carry - 2, 0):], 3, axis=1)
+        blocks.append(_block(5, win.reshape(-1, 3), [1, -1, 1], '>=', 0))
+
+    # 6. 休みを週に１～６回以上割当（全員／個別）
+    if want(6):
+        vals = _worker_values(opts, index, 'cond06', 'days')
+        blocks.append(_block(6, wd[vals >= 0][:, weeks].reshape(-1, 7), 1, '<=', 7 - np.repeat(vals[vals >= 0], len(weeks))))
+
+    # 7. １日の出勤人数はＸ人以上（平日／土日）
+    if want(7):
+        cnt = _headcount(opts)
+        blocks.append(_block(7, wd[:, cnt >= 0].T, 1, '>=', cnt[cnt >= 0]))
+
+    # 8. 月の出勤日数を４～２４日以上（全員／個別）
+    if want(8):
+        vals = _worker_values(opts, index, 'cond08', 'days')
+        blocks.append(_block(8, month[vals >= 0], 1, '>=', vals[vals >= 0]))
+
+    # 9. 週の出勤日数は１～６日以上（全員／個別）
+    if want(9):
+        vals = _worker_values(opts, index, 'cond09', 'days')
+        blocks.append(_block(9, wd[vals >= 0][:, weeks].reshape(-1, 7), 1, '>=', np.repeat(vals[vals >= 0], len(weeks))))
+
+    # 10. 一緒に勤務させる
+    if want(10) and opts['cond10_chk']:
+        for grp_num in _groups(index, opts, ['cond10_wrks_A', 'cond10_wrks_B', 'cond10_wrks_C']):
+            for cmb in itertools.combinations(grp_num, 2):
+                blocks.append(_block(10, wd[list(cmb)][:, new].T, [1, -1], '==', 0))
+
+    # 11. 一緒に勤務させない
+    if want(11) and opts['cond11_chk']:
+        for grp_num in _groups(index, opts, ['cond11_wrks_A', 'cond11_wrks_B', 'cond11_wrks_C']):
+            if not opts['use_pairwise_exclusion']:
+                # グループの中で出勤するのは１人まで
+                if len(grp_num) >= 2:
+                    blocks.append(_block(11, wd[grp_num][:, new].T, 1, '<=', 1))
+                continue
+            for cmb in itertools.combinations(grp_num, 2):
+                blocks.append(_block(11, wd[list(cmb)][:, new].T, 1, '<=', 0, offset=-1))
+
+    # 12. 特定の日を休みにする（個別、日は月の日）
+    if want(12) and opts['cond12_chk']:
+        w = _groups(index, opts, ['cond12_wrks'])[0]
+        d = [x - 1 for x in opts['cond12_days'] if x <= num_days]
+        blocks.append(_block(12, month[np.ix_(w, d)].reshape(-1) if w and d else [], 1, '==', 0))
+
+    # 13. 特定の曜日を休みにする（個別）
+    if want(13) and opts['cond13_chk']:
+        w = _groups(index, opts, ['cond13_wrks'])[0]
+        dows = np.isin(dow, list(map(lambda x: dow_chr.index(x), opts['cond13_dows']))) & new
+        blocks.append(_block(13, wd[w][:, dows].reshape(-1), 1, '==', 0))
+
+    # 休みにするセル（勤務表の修正で使用）
+    if want(FIXED_CELLS):
+        cells = [month[w, d] for w, d in vars.off_cells]
+        blocks.append(_block(FIXED_CELLS, cells, 1, '==', 0))
+
+    return [b for b in blocks if len(b.idx) and b.idx.shape[1]]
+
+def _union_find(parent: np.ndarray, pairs: np.ndarray):
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs.tolist():
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    for i in range(len(parent)):
+        parent[i] = find(i)
+
+def presolve(vars: Variables, blocks: typing.List[RowBlock], swept: typing.Collection = ()) -> typing.List[RowBlock]:
+    """固定変数の代入、a == b の変数の統合、自明に満たされる制約の削除
+
+    結果の代表変数は vars.rep と vars.fix に設定する。
+    3, 12, 13 の「休みにする」は固定変数、10 の「一緒に勤務させる」は統合になる。
+    swept の条件の行は自明に満たされても除かない（reduce_blocks）。
+    """
+    num_vars = len(vars.labels)
+    rep = np.arange(num_vars)
+    fix = np.full(num_vars, np.nan)
+
+    # x == v （1項の等式）と x - y == 0 （2項の等式）を探す
+    for blk in blocks:
+        if blk.sense != '==':
+            continue
+        if blk.idx.shape[1] == 1:
+            fix[blk.idx[:, 0]] = (blk.rhs - blk.offset) / blk.coef[:, 0]
+        elif blk.idx.shape[1] == 2:
+            same = (blk.coef[:, 0] == -blk.coef[:, 1]) & (blk.rhs == blk.offset)
+            _union_find(rep, blk.idx[same])
+
+    # 固定値は代表変数に集める（グループの誰かが休みならグループ全員が休み）
+    fixed = ~np.isnan(fix)
+    fix_rep = np.full(num_vars, np.nan)
+    fix_rep[rep[fixed]] = fix[fixed]
+    vars.rep, vars.fix = rep, fix_rep
+    return reduce_blocks(vars, blocks, swept)
+
+def reduce_blocks(vars: Variables, blocks: typing.List[RowBlock], swept: typing.Collection = ()) -> typing.List[RowBlock]:
+    """presolve で決めた代表変数（vars.rep, vars.fix）を制約に代入し、自明に満たされる行を除く
+
+    swept の条件の行は除かない（右辺を変えると満たされなくなることがあるので、SweepModel で使用）。
+    """
+    num_vars = len(vars.labels)
+    rep, fix_rep = vars.rep, vars.fix
+    reduced = []
+    for blk in blocks:
+        n, k = blk.idx.shape
+        idx = rep[blk.idx]
+        coef = blk.coef.copy()
+        val = fix_rep[idx]
+        rhs = blk.rhs - np.where(np.isnan(val), 0, val * coef).sum(axis=1)
+        coef[~np.isnan(val)] = 0
+
+        # 同じ代表変数の係数を行ごとにまとめる
+        order = np.argsort(idx, axis=1, kind='stable')
+        idx = np.take_along_axis(idx, order, axis=1)
+        coef = np.take_along_axis(coef, order, axis=1)
+        keys = (idx + np.arange(n)[:, None] * num_vars).reshape(-1)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        merged = np.zeros(n * k)
+        merged[starts] = np.add.reduceat(coef.reshape(-1), starts)
+        coef = merged.reshape(n, k)
+
+        # 0/1変数なので左辺の範囲は係数の符号で決まる
+        lo = blk.offset + np.minimum(coef, 0).sum(axis=1)
+        hi = blk.offset + np.maximum(coef, 0).sum(axis=1)
+        if blk.sense == '<=':
+            trivial, infeasible = hi <= rhs, lo > rhs
+        elif blk.sense == '>=':
+            trivial, infeasible = lo >= rhs, hi < rhs
+        else:
+            trivial, infeasible = (lo == rhs) & (hi == rhs), (lo > rhs) | (hi < rhs)
+        if infeasible.any():
+            raise InfeasibleError([blk.cond])
+        # swept の行も変数が残らないとき（右辺によらず自明か矛盾）は除く
+        keep = ~trivial | ((blk.cond in swept) & (coef != 0).any(axis=1))
+        if keep.any():
+            reduced.append(RowBlock(blk.cond, idx[keep], coef[keep], blk.offset, blk.sense, rhs[keep]))
+    return reduced
+
+def tighten(blocks: typing.List[RowBlock]) -> typing.Tuple[typing.List[RowBlock], typing.Dict[int, int]]:
+    """重複した制約とほかの制約から導ける制約を除く（presolve の後に使う）
+
+    左辺が同じ（係数の比が同じ）行は１本にまとめ、上限と下限があれば同じ左辺の '>=' と '<=' の２行にする
+    （MIPCQMSolver では１行の範囲の制約になる）。係数が整数なら右辺を整数に丸める。
+    係数がすべて1の行（1. 4. 6. 7. 8. 9. など）は、ほかの行から導けるなら除く。
+    上限：共通部分が重ならない行 T_i について sum(S) <= sum(hi(T_i)) + (どの T_i にも入らない変数の数) が hi(S) 以下。
+    （例：6.の週の上限が、その週の中の 1.の連続勤務の上限も満たす）
+    下限：S に含まれて互いに重ならない行 T_i について sum(lo(T_i)) が lo(S) 以上。
+    （例：9.の週の下限の合計が 8.の月の下限以上）
+    除く行を導いた行は除かないので、除いた行はすべて残った行から導ける。
+
+    Returns:
+        制約のまとまりと、条件ごとの除いた行の数。
+    Raises:
+        InfeasibleError: まとめた上限と下限が矛盾するとき。
+    """
+    # 左辺ごとの [下限, 上限, 下限の条件, 上限の条件, 条件の集合, 変数, 係数]
+    rows: typing.Dict[tuple, list] = dict()
+    before = collections.Counter()
+    for blk in blocks:
+        before[blk.cond] += len(blk.idx)
+        # 係数0の項を後ろにして変数の順に並べ、最初の係数で割って向きと大きさをそろえる
+        zero = blk.coef == 0
+        order = np.lexsort((blk.idx, zero), axis=1)
+        idx = np.take_along_axis(blk.idx, order, axis=1)
+        coef = np.take_along_axis(blk.coef, order, axis=1)
+        num = (~zero).sum(axis=1)
+        scale = np.where(num > 0, coef[:, 0], 1)
+        coef = coef / scale[:, None]
+        bound = (blk.rhs - blk.offset) / scale
+        lo = np.where((blk.sense == '==') | ((blk.sense == '>=') == (scale > 0)), bound, -np.inf)
+        hi = np.where((blk.sense == '==') | ((blk.sense == '<=') == (scale > 0)), bound, np.inf)
+        integral = (coef == np.round(coef)).all(axis=1)
+        lo = np.where(integral, np.ceil(lo - 1e-9), lo)
+        hi = np.where(integral, np.floor(hi + 1e-9), hi)
+        for r, (k, l, h) in enumerate(zip(num.tolist(), lo.tolist(), hi.tolist())):
+            if not k:
+                continue
+            key = (idx[r, :k].tobytes(), coef[r, :k].tobytes())
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = [-np.inf, np.inf, blk.cond, blk.cond, set(), idx[r, :k], coef[r, :k]]
+            if l > row[0]:
+                row[0], row[2] = l, blk.cond
+            if h < row[1]:
+                row[1], row[3] = h, blk.cond
+            row[4].add(blk.cond)
+            if row[0] > row[1]:
+                raise InfeasibleError(row[4])
+
+    records = list(rows.values())
+    lo = [row[0] for row in records]
+    hi = [row[1] for row in records]
+    ones = [r for r, row in enumerate(records) if (row[6] == 1).all()]
+    members = {r: frozenset(records[r][5].tolist()) for r in ones}
+
+    def drop(order: typing.List[int], implied: typing.Callable) -> typing.Set[int]:
+        by_var = collections.defaultdict(list)
+        for r in order:
+            for i in members[r]:
+                by_var[i].append(r)
+        dropped, pinned = set(), set()
+        for s in order:
+            if s in pinned:
+                continue
+            overlap = collections.Counter(itertools.chain.from_iterable(by_var[i] for i in members[s]))
+            del overlap[s]
+            used = implied(s, {t: n for t, n in overlap.items() if t not in dropped})
+            if used is not None:
+                dropped.add(s)
+                pinned.update(used)
+        return dropped
+
+    def implied_hi(s: int, overlap: typing.Dict[int, int]) -> typing.Optional[list]:
+        # 重なりの分だけ上限が下がる行から、下がる分の大きい順に使う
+        bound, covered, used = len(members[s]), set(), []
+        for saving, t in sorted(((n - hi[t], t) for t, n in overlap.items() if n > hi[t]), reverse=True):
+            common = members[s] & members[t]
+            if covered.isdisjoint(common):
+                covered |= common
+                bound -= saving
+                used.append(t)
+                if bound <= hi[s]:
+                    return used
+        return None
+
+    def implied_lo(s: int, overlap: typing.Dict[int, int]) -> typing.Optional[list]:
+        # s に含まれる行から、下限の大きい順に使う
+        bound, covered, used = 0, set(), []
+        for t in sorted((t for t, n in overlap.items() if n == len(members[t]) and lo[t] > 0), key=lambda t: -lo[t]):
+            if covered.isdisjoint(members[t]):
+                covered |= members[t]
+                bound += lo[t]
+                used.append(t)
+                if bound >= lo[s]:
+                    return used
+        return None
+
+    # ゆるい行（変数１つあたりの上限が大きい、下限が小さい）から調べる
+    upper = sorted((r for r in ones if hi[r] < np.inf), key=lambda r: (-hi[r] / len(members[r]), -len(members[r])))
+    lower = sorted((r for r in ones if lo[r] > -np.inf), key=lambda r: (lo[r] / len(members[r]), -len(members[r])))
+    for r in drop(upper, implied_hi):
+        hi[r] = np.inf
+    for r in drop(lower, implied_lo):
+        lo[r] = -np.inf
+
+    # 条件・向き・項数ごとのまとまりにする
+    grouped = collections.defaultdict(list)
+    for r, row in enumerate(records):
+        k = len(row[5])
+        if lo[r] == hi[r]:
+            grouped[row[2], '==', k].append((row, lo[r]))
+            continue
+        if lo[r] > -np.inf:
+            grouped[row[2], '>=', k].append((row, lo[r]))
+        if hi[r] < np.inf:
+            grouped[row[3], '<=', k].append((row, hi[r]))
+    tightened = []
+    after = collections.Counter()
+    for (cond, sense, _), group in grouped.items():
+        after[cond] += len(group)
+        tightened.append(_block(cond, np.array([row[5] for row, _ in group]), np.array([row[6] for row, _ in group]),
+                                sense, [b for _, b in group]))
+    return tightened, {cond: before[cond] - after[cond] for cond in before}
+
+def count_blocks(blocks: typing.List[RowBlock]) -> typing.Dict[typing.Union[int, str], dict]:
+    """条件ごとの制約数と変数の数"""
+    counts = dict()
+    for cond in sorted_conditions(blk.cond for blk in blocks):
+        blks = [blk for blk in blocks if blk.cond == cond]
+        used = np.concatenate([blk.idx[blk.coef != 0] for blk in blks])
+        counts[cond] = dict(constraints=sum(len(blk.idx) for blk in blks), variables=len(np.unique(used)))
+    return counts
+
+def add_constraints_array(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables,
+                          profile: typing.Optional[Profile] = None, swept: typing.Collection = ()
+                          ) -> typing.Tuple[typing.List[RowBlock], typing.List[typing.List[str]]]:
+    """制約をまとめて作ってCQMに足す（戻り値は前処理後の制約のまとまりと、まとまりごとのCQMの制約のラベル）
+
+    swept の条件の行は presolve でも除かず、tighten に渡さずに最後に足す
+    （右辺を変えても行が変わらないように、SweepModel で使用）。
+    """
+    if profile is None:
+        profile = Profile()
+
+    with profile.phase('add_constraints'):
+        blocks = constraint_blocks(opts, vars)
+        if opts['use_symmetry_ordering']:
+            blocks += symmetry_blocks(opts, vars)
+    counts = count_blocks(blocks)
+
+    if opts['use_presolve']:
+        with profile.phase('presolve'):
+            blocks = presolve(vars, blocks, swept)
+        free = (vars.rep == np.arange(len(vars.labels))) & np.isnan(vars.fix)
+        cqm.add_variables('BINARY', [vars.labels[i] for i in np.flatnonzero(free)])
+    else:
+        cqm.add_variables('BINARY', vars.labels)
+
+    removed = dict()
+    if opts['use_tightening']:
+        with profile.phase('tighten'):
+            kept = [blk for blk in blocks if blk.cond in swept]
+            blocks, removed = tighten([blk for blk in blocks if blk.cond not in swept])
+            blocks += kept
+
+    reduced = count_blocks(blocks)
+    for cond, count in counts.items():
+        profile.conditions[cond] = dict(reduced.get(cond, dict(constraints=0, variables=0)),
+                                        constraints_before_presolve=count['constraints'],
+                                        variables_before_presolve=count['variables'])
+        if opts['use_tightening']:
+            profile.conditions[cond]['removed_by_tightening'] = removed.get(cond, 0)
+
+    with profile.phase('add_constraints'):
+        labels = _add_blocks(cqm, vars.labels, blocks)
+    return blocks, labels
+
+def _add_blocks(cqm: ConstrainedQuadraticModel, labels: typing.List[str],
+                blocks: typing.List[RowBlock]) -> typing.List[typing.List[str]]:
+    added = []
+    for blk in blocks:
+        added.append([])
+        for idx, coef, rhs in zip(blk.idx.tolist(), blk.coef.tolist(), blk.rhs.tolist()):
+            label = cqm.add_constraint_from_iterable(
+                [(labels[i], c) for i, c in zip(idx, coef) if c], blk.sense, rhs)
+            if blk.offset:
+                cqm.constraints[label].lhs.offset = blk.offset
+            added[-1].append(label)
+    return added
+
+def _reduce_linear(vars: Variables, linear: np.ndarray) -> tuple:
+    """wd の係数を前処理後の変数の係数と定数項にする"""
+    num_wd = vars.wd_idx.size
+    if vars.rep is None:
+        return vars.labels[:num_wd], linear, 0
+    # 統合した変数の係数は代表変数に足し、固定した変数は定数にする
+    val = vars.fix[vars.rep[:num_wd]]
+    offset = np.where(np.isnan(val), 0, val * linear).sum()
+    free = np.flatnonzero(np.isnan(val))
+    roots, inverse = np.unique(vars.rep[free], return_inverse=True)
+    linear = np.bincount(inverse, weights=linear[free], minlength=len(roots))
+    return [vars.labels[i] for i in roots], linear, offset
+
+def define_objective_array(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables):
+    obj_sign = opts['obj_sign']
+    labels, linear, offset = _reduce_linear(vars, np.full(vars.wd_idx.size, obj_sign, dtype=float))
+    cqm.set_objective(BinaryQuadraticModel.from_numpy_vectors(
+        linear, ([], [], []), offset, 'BINARY', variable_order=labels))
+
+def build_cqm(opts: dict, vars: Variables, profile: typing.Optional[Profile] = None) -> ConstrainedQuadraticModel:
+    if profile is None:
+        profile = Profile()
+
+    # 数えるだけで分かる矛盾はCQMを作る前に知らせる
+    _precheck(opts, profile)
+
     cqm = ConstrainedQuadraticModel()
-    add_constraints(cqm, opts, vars)
-    define_objective(cqm, opts, vars)
+    if opts['use_array_builder']:
+        add_constraints_array(cqm, opts, vars, profile)
+        with profile.phase('define_objective'):
+            define_objective_array(cqm, opts, vars)
+    else:
+        with profile.phase('add_constraints'):
+            add_constraints(cqm, opts, vars)
+        with profile.phase('define_objective'):
+            define_objective(cqm, opts, vars)
+    profile.model.update(variables=len(cqm.variables), constraints=len(cqm.constraints))
     return cqm
 
-def call_solver(cqm: ConstrainedQuadraticModel, opts: dict) -> SampleSet:
-    use_cqm_solver = opts['use_cqm_solver']
-    time_limit = opts['time_limit']
+def quick_conflicts(opts: dict) -> typing.Optional[typing.List[typing.Union[int, str]]]:
+    """解く前に数を数えるだけで分かる矛盾を探し、矛盾する条件の番号（休みにするセルは FIXED_CELLS）を返す（見つからないときは None）
 
-    if use_cqm_solver:
-        sampler = LeapHybridCQMSampler()
-        res = sampler.sample_cqm(cqm, time_limit=time_limit, label='Shift Scheduling')
-    else:
-        sampler = MIPCQMSolver()
-        res = sampler.sample_cqm(cqm, time_limit=time_limit)
+    日ごとの出勤できる人数と 7.、ワーカーごとの週・月の出勤日数の上限（1. 4. 6. と休みに固定した日）と下限（8. 9.）、
+    週・月の 7. の延べ人数と出勤日数の上限の合計、土日連休の回数（2.）と土日に休める人数（7.）を比べる。
+    """
+    num_workers = opts['num_workers']
+    num_days = opts['num_days']
+    carry, total = window_days(opts)
+    index = worker_index(opts)
+    blocks = constraint_blocks(opts, Variables(opts))
+
+    # 固定したセルの値（固定しないときは-1）と固定した条件（0. 3. 12. 13. と休みにするセル）
+    fixed = np.full((num_workers, total), -1)
+    fixed_by = np.zeros((num_workers, total), dtype=object)
+    for blk in blocks:
+        if blk.sense == '==' and blk.idx.shape[1] == 1:
+            w, d = np.divmod(blk.idx[:, 0], total)
+            fixed[w, d] = blk.rhs
+            fixed_by[w, d] = blk.cond
+    off, on = fixed == 0, fixed == 1
+
+    def bounds(days: np.ndarray, upper: typing.List[tuple], lower: typing.List[tuple]) -> tuple:
+        """days の出勤日数のワーカーごとの上限・下限と、それを決めた条件
+        upper, lower は (ワーカーごとの値, 条件の集合またはワーカーごとの集合を返す関数) のリスト"""
+        upper = upper + [(len(days) - off[:, days].sum(axis=1), lambda w: set(fixed_by[w, days][off[w, days]]))]
+        lower = lower + [(on[:, days].sum(axis=1), lambda w: {0})]
+        hi = np.min([u for u, _ in upper], axis=0)
+        lo = np.max([l for l, _ in lower], axis=0)
+        hi_by = [upper[i][1] for i in np.argmin([u for u, _ in upper], axis=0)]
+        lo_by = [lower[i][1] for i in np.argmax([l for l, _ in lower], axis=0)]
+        return hi, lo, hi_by, lo_by
+
+    def worker_conflict(hi, lo, hi_by, lo_by):
+        bad = np.flatnonzero(lo > hi)
+        if len(bad):
+            w = bad[0]
+            return sorted_conditions(hi_by[w](w) | lo_by[w](w))
+
+    def total_conflict(days, hi, hi_by):
+        # 出勤日数の上限の合計が 7. の延べ人数に足りない
+        cnt = _headcount(opts)[days]
+        if cnt.max(initial=-1) >= 0 and np.maximum(cnt, 0).sum() > hi.sum():
+            return sorted_conditions({7}.union(*(hi_by[w](w) for w in np.flatnonzero(hi < len(days)))))
+
+    # 1. 日ごとの出勤できる人数
+    cnt = _headcount(opts)
+    groups = []
+    if opts['cond11_chk']:
+        # グループの中で出勤するのは１人まで（重なるワーカーは最初のグループだけで数える）
+        counted = np.zeros(num_workers, dtype=bool)
+        for grp in _groups(index, opts, ['cond11_wrks_A', 'cond11_wrks_B', 'cond11_wrks_C']):
+            grp = [w for w in grp if not counted[w]]
+            counted[grp] = True
+            if len(grp) >= 2:
+                groups.append(grp)
+    for d in np.flatnonzero(cnt >= 0):
+        avail = ~off[:, d]
+        cap = avail.sum() - sum(max(avail[grp].sum() - 1, 0) for grp in groups)
+        if cap < cnt[d]:
+            conds = {7} | set(fixed_by[off[:, d], d])
+            return sorted_conditions(conds | ({11} if cap < avail.sum() else set()))
+
+    # 2. 週の出勤日数（6. 9.）
+    vals6 = _worker_values(opts, index, 'cond06', 'days')
+    vals9 = _worker_values(opts, index, 'cond09', 'days')
+    for week in week_days(opts):
+        hi, lo, hi_by, lo_by = bounds(week, [(np.where(vals6 >= 0, 7 - vals6, 7), lambda w: {6})],
+                                      [(np.maximum(vals9, 0), lambda w: {9})])
+        conflict = worker_conflict(hi, lo, hi_by, lo_by) or total_conflict(week, hi, hi_by)
+        if conflict:
+            return conflict
+
+    # 3. 月の出勤日数（1. 4. 8.）
+    month = np.arange(carry, carry + num_days)
+    vals1 = _worker_values(opts, index, 'cond01', 'days')
+    vals4 = _worker_values(opts, index, 'cond04', 'cnt')
+    vals8 = _worker_values(opts, index, 'cond08', 'days')
+    # days+1 日ごとに１日は休み
+    hi1 = np.where(vals1 >= 0, num_days - num_days // np.maximum(vals1 + 1, 1), num_days)
+    hi, lo, hi_by, lo_by = bounds(month, [(np.where(vals4 >= 0, num_days - vals4, num_days), lambda w: {4}),
+                                          (hi1, lambda w: {1})],
+                                  [(np.maximum(vals8, 0), lambda w: {8})])
+    conflict = worker_conflict(hi, lo, hi_by, lo_by) or total_conflict(month, hi, hi_by)
+    if conflict:
+        return conflict
+
+    # 4. 土日連休の回数（2.）と土日に休める人数（7.）
+    vals2 = _worker_values(opts, index, 'cond02', 'cnt')
+    sats = weekend_days(opts)
+    if (vals2 >= 0).any():
+        free = (~on[:, sats] & ~on[:, sats + 1]).sum(axis=1)
+        bad = np.flatnonzero(vals2 > free)
+        if len(bad):
+            return sorted({2} | ({0} if vals2[bad[0]] <= len(sats) else set()))
+        rest = num_workers - np.maximum(cnt[sats], cnt[sats + 1])
+        if np.minimum(rest, num_workers).sum() < np.maximum(vals2, 0).sum():
+            return [2, 7]
+    return None
+
+def explain_infeasibility(opts: dict, time_limit: float = 10) -> typing.Optional[typing.List[typing.Union[int, str]]]:
+    """Python-MIPで同時に満たせない条件の組を探し、その番号（休みにするセルは FIXED_CELLS）を返す
+
+    条件を１つずつ外して解き直し、外しても答えがなければ外したままにする（0. の引き継ぎは外さない）。
+    残った組はどの１つを外しても答えがあるか、時間内に答えがないと示せなかったもの。
+    すべての条件で答えがないことを時間内に示せないときは None。
+    """
+    from mip_solver import MIPCQMSolver
+    deadline = time.perf_counter() + time_limit
+    vars = Variables(opts)
+    blocks = constraint_blocks(opts, vars)
 
+    def infeasible(conds: typing.Set[typing.Union[int, str]], checks_left: int) -> bool:
+        try:
+            sub = presolve(vars, [blk for blk in blocks if blk.cond in conds])
+        except InfeasibleError:
+            return True
+        if not sub:
+            return False
+        cqm = ConstrainedQuadraticModel()
+        used = np.unique(np.concatenate([blk.idx[blk.coef != 0] for blk in sub]))
+        cqm.add_variables('BINARY', [vars.labels[i] for i in used])
+        _add_blocks(cqm, vars.labels, sub)
+        remaining = max((deadline - time.perf_counter()) / checks_left, 0.1)
+        status = MIPCQMSolver.sample_cqm(cqm, time_limit=remaining).info['status']
+        return status in ('INFEASIBLE', 'INT_INFEASIBLE')
+
+    conds = {blk.cond for blk in blocks}
+    candidates = sorted_conditions(conds - {0})
+    if not infeasible(conds, len(candidates) + 1):
+        return None
+    for i, c in enumerate(candidates):
+        if time.perf_counter() >= deadline:
+            break
+        if infeasible(conds - {c}, len(candidates) - i):
+            conds.discard(c)
+    return sorted_conditions(conds)
+
+def _no_solution(opts: dict, profile: Profile, status: typing.Optional[str]) -> RuntimeError:
+    """答えが得られなかったときのエラー
+
+    ソルバーが答えのないことを示したとき（status が INFEASIBLE）だけ矛盾する条件を探し、分かれば InfeasibleError。
+    時間切れなど、答えがないとは限らないときは探さない。
+    """
+    if (status in ('INFEASIBLE', 'INT_INFEASIBLE')
+            and opts['use_precheck'] and opts['explain_time_limit'] > 0):
+        with profile.phase('explain'):
+            conflicts = explain_infeasibility(opts, opts['explain_time_limit'])
+        if conflicts:
+            return InfeasibleError(conflicts)
+    return RuntimeError(
+        "答えが得られませんでした。制限時間を増やすか条件を調整してください。"
+    )
+
+def _precheck(opts: dict, profile: Profile):
+    if opts['use_precheck']:
+        with profile.phase('precheck'):
+            conflicts = quick_conflicts(opts)
+        if conflicts:
+            raise InfeasibleError(conflicts)
+
+# ソルバーの名前 → (cqm, opts, initial_state, profile, weights) を解いて SampleSet を返す関数
+# ソルバーのモジュールは関数の中で読み込むので、使わないソルバーは読み込まない
+solver_backends: typing.Dict[str, typing.Callable[..., SampleSet]] = dict()
+
+def solver_backend(name: str):
+    """solver_backends に登録するデコレータ"""
+    def register(fn):
+        solver_backends[name] = fn
+        return fn
+    return register
+
+def backend_name(opts: dict) -> str:
+    """opts で使うソルバーの名前（solver_backends のキー）"""
+    if opts['use_cqm_solver']:
+        return 'leap'
+    if opts['use_heuristic_solver']:
+        return 'heuristic'
+    if opts['use_decomposition']:
+        return 'decomposition'
+    if opts['portfolio_size'] > 1:
+        return 'portfolio'
+    return 'mip'
+
+@solver_backend('leap')
+def _solve_leap(cqm, opts, initial_state, profile, weights) -> SampleSet:
+    # 接続はプロセスで１つの LeapClient を使い回す
+    with profile.phase('leap'):
+        return _leap_result(get_leap_client().submit(cqm, opts['time_limit']))
+
+def _leap_result(future: concurrent.futures.Future) -> SampleSet:
+    try:
+        return future.result()
+    except TimeoutError as e:
+        raise RuntimeError(f"量子コンピュータの答えが返りませんでした（{e}）") from e
+
+@solver_backend('heuristic')
+def _solve_heuristic(cqm, opts, initial_state, profile, weights) -> SampleSet:
+    from heuristic_solver import HeuristicCQMSolver
+    return HeuristicCQMSolver().sample_cqm(cqm, time_limit=opts['time_limit'], initial_state=initial_state)
+
+@solver_backend('decomposition')
+def _solve_decomposition(cqm, opts, initial_state, profile, weights) -> SampleSet:
+    from decomposition_solver import DecompositionCQMSolver
+    return DecompositionCQMSolver().sample_cqm(cqm, time_limit=opts['time_limit'], initial_state=initial_state)
+
+def _warm_start(cqm: ConstrainedQuadraticModel, opts: dict, initial_state: typing.Optional[dict],
+                profile: Profile) -> typing.Optional[dict]:
+    """ヒューリスティックの解をPython-MIPの初期解にする"""
+    if opts['heuristic_warm_start'] > 0 and initial_state is None:
+        from heuristic_solver import HeuristicCQMSolver
+        with profile.phase('warm_start'):
+            warm = HeuristicCQMSolver().sample_cqm(cqm, time_limit=opts['heuristic_warm_start'])
+        initial_state = warm.first.sample
+    return initial_state
+
+@solver_backend('portfolio')
+def _solve_portfolio(cqm, opts, initial_state, profile, weights) -> SampleSet:
+    from portfolio_solver import MIPPortfolioCQMSolver
+    initial_state = _warm_start(cqm, opts, initial_state, profile)
+    sampler = MIPPortfolioCQMSolver(opts['portfolio_size'])
+    return sampler.sample_cqm(cqm, time_limit=opts['time_limit'], initial_state=initial_state)
+
+@solver_backend('mip')
+def _solve_mip(cqm, opts, initial_state, profile, weights) -> SampleSet:
+    from mip_solver import MIPCQMSolver
+    initial_state = _warm_start(cqm, opts, initial_state, profile)
+    if weights is not None:
+        return MIPCQMSolver.sample_cqm_pool(cqm, opts['num_alternatives'], opts['alternative_distance'],
+                                            time_limit=opts['time_limit'], initial_state=initial_state,
+                                            weights=weights)
+    return MIPCQMSolver().sample_cqm(cqm, time_limit=opts['time_limit'], initial_state=initial_state)
+
+def _sample(cqm: ConstrainedQuadraticModel, opts: dict, initial_state: typing.Optional[dict], profile: Profile,
+            weights: typing.Optional[dict] = None) -> SampleSet:
+    """opts のソルバーで解く（weights を渡すとPython-MIPでは互いに違う解を num_alternatives 個まで探す）"""
+    name = backend_name(opts)
+    res = solver_backends[name](cqm, opts, initial_state, profile, weights)
     res.resolve()
+    if name != 'leap':
+        profile.add_solver_info(res.info)
+    return res
+
+def call_solver(cqm: ConstrainedQuadraticModel, opts: dict, initial_state: typing.Optional[dict] = None,
+                profile: typing.Optional[Profile] = None) -> SampleSet:
+    if profile is None:
+        profile = Profile()
+
+    res = _sample(cqm, opts, initial_state, profile)
     feasible_sampleset = res.filter(lambda d: d.is_feasible)
 
     try:
         best_feasible = feasible_sampleset.first.sample
         return best_feasible
     except ValueError:
-        raise RuntimeError(
-            "答えが得られませんでした。制限時間を増やすか条件を調整してください。"
-        )
+        raise _no_solution(opts, profile, res.info.get('status'))
 
-def make_df(sample: SampleSet, opts: dict, vars: Variables) -> pd.DataFrame:
-    num_workers = opts['num_workers']
-    num_days = opts['num_days']
-    fst_dow = opts['fst_dow']
+def submit_solver(cqm: ConstrainedQuadraticModel, opts: dict, initial_state: typing.Optional[dict] = None,
+                  profile: typing.Optional[Profile] = None) -> concurrent.futures.Future:
+    """call_solver を待たずに始め、その結果（一番良い実行可能解）の Future を返す
+
+    量子コンピュータは LeapClient に投げるだけでスレッドを使わないので、答えを待つ間に
+    ほかのCQMを投げたりPython-MIPで解いたりできる。ほかのソルバーは _local_executor のスレッドで解く。
+    答えがないときの例外（RuntimeError, InfeasibleError）は Future の例外になる。
+    量子コンピュータの Future をキャンセルすると、Leap の問題もキャンセルする。
+    """
+    if profile is None:
+        profile = Profile()
+
+    if backend_name(opts) != 'leap':
+        return _local_executor().submit(call_solver, cqm, opts, initial_state, profile)
+
+    result = concurrent.futures.Future()
+    started = time.perf_counter()
+
+    def done(future: concurrent.futures.Future):
+        profile.add_phase('leap', time.perf_counter() - started)
+        if future.cancelled():
+            # result をキャンセルしたとき
+            return
+        try:
+            feasible_sampleset = _leap_result(future).filter(lambda d: d.is_feasible)
+            if len(feasible_sampleset) == 0:
+                # Leap は答えがないことを示さない（矛盾する条件は LeapClient のスレッドでは探さない）
+                raise _no_solution(opts, profile, None)
+            result.set_result(feasible_sampleset.first.sample)
+        except concurrent.futures.InvalidStateError:
+            # 答えが届くのと同時に result をキャンセルした
+            pass
+        except Exception as e:
+            if not result.cancelled():
+                result.set_exception(e)
+
+    remote = get_leap_client().submit(cqm, opts['time_limit'])
+    remote.add_done_callback(done)
+    result.add_done_callback(lambda f: f.cancelled() and remote.cancel())
+    return result
+
+_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _local_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """submit_solver でローカルのソルバーを動かすスレッド（CPUの数だけ、最初に使うときに作る）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix='local-solver')
+        return _executor
+
+def cell_weights(cqm: ConstrainedQuadraticModel, vars: Variables) -> typing.Dict[str, int]:
+    """CQMの変数ごとの勤務表のセルの数（前処理で統合した変数は統合したセルの数、wwe は0）"""
+    num_wd = vars.wd_idx.size
+    rep = np.arange(num_wd) if vars.rep is None else vars.rep[:num_wd]
+    free = np.ones(num_wd, dtype=bool) if vars.fix is None else np.isnan(vars.fix[rep])
+    counts = np.bincount(rep[free], minlength=num_wd)
+    return {vars.labels[i]: int(counts[i]) for i in np.flatnonzero(counts) if vars.labels[i] in cqm.variables}
+
+def call_solver_pool(cqm: ConstrainedQuadraticModel, opts: dict, vars: Variables,
+                     initial_state: typing.Optional[dict] = None,
+                     profile: typing.Optional[Profile] = None) -> typing.List[dict]:
+    """opts['num_alternatives'] 個までの、互いに opts['alternative_distance'] セル以上違う勤務表の解（良い順）
+
+    Python-MIPでは解くたびに前の解から離れる制約を足して解き直す（MIPCQMSolver.sample_cqm_pool）。
+    ほかのソルバー（量子コンピュータ、ヒューリスティック、分解、並列実行）では返ってきた解から選ぶ。
+    """
+    if profile is None:
+        profile = Profile()
+
+    weights = cell_weights(cqm, vars)
+    res = _sample(cqm, opts, initial_state, profile, weights)
+    labels = list(weights)
+    w = np.array([weights[v] for v in labels])
+    chosen, rows = [], []
+    for sample in res.filter(lambda d: d.is_feasible).data(['sample'], sorted_by='energy'):
+        row = np.array([sample.sample[v] for v in labels])
+        if all(w @ np.abs(row - r) >= opts['alternative_distance'] for r in rows):
+            chosen.append(dict(sample.sample))
+            rows.append(row)
+        if len(chosen) >= opts['num_alternatives']:
+            break
+    if not chosen:
+        raise _no_solution(opts, profile, res.info.get('status'))
+    return chosen
+
+def iter_solver(cqm: ConstrainedQuadraticModel, opts: dict,
+                stop: typing.Optional[threading.Event] = None,
+                profile: typing.Optional[Profile] = None) -> typing.Iterator[typing.Tuple[dict, dict]]:
+    """Python-MIPが改善解を見つけるたびに (解, 情報) を返す
+
+    情報は objective（目的関数値）、gap（最適値とのギャップ）、status、run_time など MIPCQMSolver.iter_sample_cqm の info。
+    並列実行ではどれかの設定が改善解を見つけるたびに返す。
+    ほかのソルバー（量子コンピュータ、ヒューリスティック、分解）では call_solver の結果を、ソルバーの info とともに１回だけ返す。
+    stop を渡すと、Python-MIPも別のプロセスで解き、stop をセットすると解いている途中でもすぐに止め、それまでの解だけを返す。
+    ほかのソルバーは制限時間まで解く。ソルバーの統計（最後の情報）は profile に入れる。
+    """
+    if profile is None:
+        profile = Profile()
+
+    name = backend_name(opts)
+    if name not in ('mip', 'portfolio'):
+        res = _sample(cqm, opts, None, profile)
+        feasible_sampleset = res.filter(lambda d: d.is_feasible)
+        if len(feasible_sampleset) == 0:
+            raise _no_solution(opts, profile, res.info.get('status'))
+        sample = feasible_sampleset.first.sample
+        info = {k: v for k, v in res.info.items() if k != 'constraint_labels'}
+        yield sample, dict(info, objective=cqm.objective.energy(sample))
+        return
+
+    initial_state = _warm_start(cqm, opts, None, profile)
+    if name == 'mip' and stop is None:
+        from mip_solver import MIPCQMSolver
+        results = MIPCQMSolver().iter_sample_cqm(cqm, time_limit=opts['time_limit'], initial_state=initial_state)
+    else:
+        # CBC は途中で止められないので、止めるときは別のプロセスで解いてプロセスごと止める
+        from portfolio_solver import MIPPortfolioCQMSolver
+        sampler = MIPPortfolioCQMSolver(opts['portfolio_size'] if name == 'portfolio' else 1)
+        results = sampler.iter_sample_cqm(cqm, time_limit=opts['time_limit'], initial_state=initial_state, stop=stop)
+
+    found = False
+    info = dict()
+    try:
+        for res in results:
+            info = {k: v for k, v in res.info.items() if k != 'constraint_labels'}
+            if len(res) and res.first.is_feasible:
+                found = True
+                yield res.first.sample, info
+    finally:
+        # 途中でやめたときも、別のプロセスを止めてそれまでの統計を入れる
+        results.close()
+        profile.add_solver_info(info)
+    if not found and (stop is None or not stop.is_set()):
+        raise _no_solution(opts, profile, info.get('status'))
+
+def expand_sample(sample: dict, vars: Variables) -> dict:
+    """前処理で消した変数の値を代表変数と固定値から戻す"""
+    if vars.rep is None:
+        return sample
+    return {label: int(vars.fix[r]) if not np.isnan(vars.fix[r]) else sample[vars.labels[r]]
+            for label, r in zip(vars.labels, vars.rep.tolist())}
+
+def sample_to_array(sample: dict, vars: Variables) -> np.ndarray:
+    """解から wd の値を (ワーカー, 日) の uint8 配列として取り出す（前処理で消した変数も戻す）"""
+    num_workers, num_days = vars.wd_idx.shape
+    size = num_workers * num_days
+    if vars.rep is None:
+        vals = np.fromiter((sample[v] for v in vars.labels[:size]), dtype=float, count=size)
+    else:
+        rep = vars.rep[:size]
+        vals = vars.fix[rep].copy()
+        free = np.isnan(vals)
+        # 代表変数ごとに１回だけ解を引く
+        reps, inv = np.unique(rep[free], return_inverse=True)
+        vals[free] = np.fromiter((sample[vars.labels[r]] for r in reps.tolist()), dtype=float, count=len(reps))[inv]
+    return np.rint(vals).astype(np.uint8).reshape(num_workers, num_days)
+
+# 1バイト中の1の数
+_popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class Schedule:
+    """勤務表（ワーカーごとに日を1ビットに詰めたもの）
+
+    bits[w] は np.packbits した (num_days + 7) // 8 バイト。
+    表示用の DataFrame は to_df で必要なときだけ作る。
+    start（最初の日の日付）があれば、列名を日付にする（長期計画で使用）。
+    """
+    __slots__ = ('bits', 'num_days', 'fst_dow', 'start')
+
+    def __init__(self, bits: np.ndarray, num_days: int, fst_dow: int = 0,
+                 start: typing.Optional[datetime.date] = None):
+        self.bits = bits
+        self.num_days = num_days
+        self.fst_dow = fst_dow
+        self.start = start
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray, fst_dow: int = 0, start: typing.Optional[datetime.date] = None) -> 'Schedule':
+        arr = np.asarray(arr)
+        return cls(np.packbits(arr.astype(bool), axis=1), arr.shape[1], fst_dow, start)
+
+    @classmethod
+    def from_sample(cls, sample: dict, opts: dict, vars: Variables) -> 'Schedule':
+        """引き継ぎ・先読みの日を含めた勤務表"""
+        return cls.from_array(sample_to_array(sample, vars), int(day_of_week(opts)[0]))
+
+    @property
+    def num_workers(self) -> int:
+        return len(self.bits)
+
+    def to_array(self) -> np.ndarray:
+        """(ワーカー, 日) の0/1配列（uint8）"""
+        return np.unpackbits(self.bits, axis=1, count=self.num_days)
+
+    def coverage(self) -> np.ndarray:
+        """日ごとの出勤人数"""
+        return self.to_array().sum(axis=0)
+
+    def workdays(self) -> np.ndarray:
+        """ワーカーごとの出勤日数"""
+        return _popcount[self.bits].sum(axis=1)
+
+    def diff(self, other: 'Schedule') -> np.ndarray:
+        """other と違うセル (ワーカー, 日) のbool配列"""
+        return np.unpackbits(self.bits ^ other.bits, axis=1, count=self.num_days).astype(bool)
+
+    def distance(self, other: 'Schedule') -> int:
+        """other と違うセルの数"""
+        return int(_popcount[self.bits ^ other.bits].sum())
+
+    def violations(self, opts: dict, blocks: typing.Optional[typing.List[RowBlock]] = None) -> typing.Dict[int, int]:
+        """満たしていない制約の数（条件番号ごと）
+
+        多くの勤務表を調べるときは constraint_blocks(opts, Variables(opts)) を blocks に渡す。
+        """
+        vars = Variables(opts)
+        if blocks is None:
+            blocks = constraint_blocks(opts, vars)
+
+        wd = self.to_array()
+        x = np.zeros(len(vars.labels))
+        x[vars.wd_idx] = wd
+        if hasattr(vars, 'wwe_idx'):
+            # 土日とも休みなら連休
+            sat = weekend_days(opts)
+            x[vars.wwe_idx] = (1 - wd[:, sat]) * (1 - wd[:, sat + 1])
+
+        counts = dict()
+        for blk in blocks:
+            lhs = (blk.coef * x[blk.idx]).sum(axis=1) + blk.offset
+            if blk.sense == '<=':
+                bad = lhs > blk.rhs + 1e-9
+            elif blk.sense == '>=':
+                bad = lhs < blk.rhs - 1e-9
+            else:
+                bad = np.abs(lhs - blk.rhs) > 1e-9
+            if bad.any():
+                counts[blk.cond] = counts.get(blk.cond, 0) + int(bad.sum())
+        return counts
+
+    def is_valid(self, opts: dict, blocks: typing.Optional[typing.List[RowBlock]] = None) -> bool:
+        return not self.violations(opts, blocks)
+
+    def to_df(self, workers: typing.Optional[typing.List[str]] = None) -> 'pd.DataFrame':
+        """表示用の '〇'/'－' の DataFrame（行名は workers、None のときは既定のID）"""
+        import pandas as pd
+        rows = workers if workers is not None else [worker_label(w) for w in range(self.num_workers)]
+        if self.start is None:
+            cols = [str(d + 1) + ' (' + dow_chr[(d + self.fst_dow) % 7] + ')' for d in range(self.num_days)]
+        else:
+            dates = [self.start + datetime.timedelta(days=d) for d in range(self.num_days)]
+            cols = [f'{x.month}/{x.day} ({dow_chr[x.weekday()]})' for x in dates]
+        return pd.DataFrame(data=np.array(wd_chr)[self.to_array()], index=rows, columns=cols)
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, Schedule) and self.num_days == other.num_days
+                and np.array_equal(self.bits, other.bits))
+
+    def __hash__(self) -> int:
+        return hash((self.num_days, self.bits.tobytes()))
+
+def make_schedule(sample: dict, opts: dict, vars: Variables) -> Schedule:
+    return Schedule.from_sample(sample, opts, vars)
+
+def make_df(sample: SampleSet, opts: dict, vars: Variables) -> 'pd.DataFrame':
+    return make_schedule(sample, opts, vars).to_df(worker_ids(opts))
+
+def df_to_array(df: 'pd.DataFrame') -> np.ndarray:
+    """make_df の勤務表を (ワーカー, 日) の0/1配列にする"""
+    return (df.to_numpy() == wd_chr[1]).astype(int)
+
+def repair_schedule(df: 'pd.DataFrame', opts: dict, off_cells: typing.List[tuple]) -> typing.Tuple['pd.DataFrame', int]:
+    """前の勤務表をできるだけ変えずに、off_cells のセルを休みにした勤務表を作る
+
+    Args:
+        df: make_df で作った前の勤務表。
+        opts: 前の勤務表を作ったときの設定。
+        off_cells: 新しく休みにするセル [(ワーカー文字, 日), ...]（日は1から）。
+    Returns:
+        修正した勤務表と、前の勤務表から変わったセルの数。
+    """
+    opts = dict(opts)
+    opts['fixed_off_cells'] = list(opts['fixed_off_cells']) + list(off_cells)
+    opts['time_limit'] = opts['repair_time_limit']
+    # 前の勤務表を初期解として使えるPython-MIPで解く
+    opts.update(use_cqm_solver=False, use_heuristic_solver=False, use_decomposition=False, portfolio_size=1)
+    # 前の勤務表のワーカーの並びを変えないようにする
+    opts['use_symmetry_ordering'] = False
+
+    vars = Variables(opts)
+    cqm = build_cqm(opts, vars)
+
+    # 前と違うセルごとに repair_penalty を足す
+    # 前が出勤なら (1 - wd)、前が休みなら wd
+    prev = df_to_array(df).reshape(-1)
+    penalty = opts['repair_penalty']
+    labels, linear, offset = _reduce_linear(vars, penalty * (1 - 2 * prev).astype(float))
+    cqm.objective.add_linear_from(zip(labels, linear))
+    cqm.objective.offset += offset + penalty * prev.sum()
+
+    # 前の勤務表を初期解として渡す
+    initial_state = {v: p for v, p in zip(vars.labels, prev.tolist()) if v in cqm.variables}
+
+    best_feasible = call_solver(cqm, opts, initial_state=initial_state)
+    new_df = make_df(best_feasible, opts, vars)
+    changed = int((df_to_array(new_df) != df_to_array(df)).sum())
+    return new_df, changed
+
+def build_cqm_cached(opts: dict, profile: typing.Optional[Profile] = None) -> typing.Tuple[Variables, ConstrainedQuadraticModel]:
+    """build_cqm の結果を model_cache から返す（返したCQMは変更しないこと）"""
+    if profile is None:
+        profile = Profile()
+
+    with profile.phase('variables'):
+        vars = Variables(opts)
+    cached = model_cache.get_model(opts)
+    if cached is not None:
+        cqm, arrays = cached
+        vars.rep, vars.fix = arrays.get('rep'), arrays.get('fix')
+        profile.model.update(variables=len(cqm.variables), constraints=len(cqm.constraints), cached=True)
+        return vars, cqm
 
-    wd_tbl = [[wd_chr[int(vars.wd[w,d].energy(sample))] for d in range(num_days)] for w in range(num_workers)]
-    rows = [chr(ord('A') + w) for w in range(num_workers)]
-    cols = [str(d + 1) + ' (' + dow_chr[(d + fst_dow) % 7] + ')' for d in range(num_days)]
+    cqm = build_cqm(opts, vars, profile)
+    arrays = dict(rep=vars.rep, fix=vars.fix) if vars.rep is not None else dict()
+    model_cache.put_model(opts, cqm, **arrays)
+    return vars, cqm
 
-    df = pd.DataFrame(data=wd_tbl, index=rows, columns=cols)
-    return df
+def call_solver_cached(cqm: ConstrainedQuadraticModel, opts: dict, profile: typing.Optional[Profile] = None) -> dict:
+    """同じ設定で解いたことがあればその解を返す"""
+    best_feasible = model_cache.get_sample(opts)
+    if best_feasible is None:
+        best_feasible = call_solver(cqm, opts, profile=profile)
+        model_cache.put_sample(opts, best_feasible)
+    return best_feasible
 
 if __name__ == '__main__':
 
-    vars = Variables(options)
-    cqm = build_cqm(options, vars)
-    best_feasible = call_solver(cqm, options)
-    df = make_df(best_feasible, options, vars)
+    profile = Profile()
+    vars, cqm = build_cqm_cached(options, profile)
+    best_feasible = call_solver_cached(cqm, options, profile)
+    with profile.phase('make_df'):
+        df = make_df(best_feasible, options, vars)
     print(df)
+    print(model_cache.stats())
+    print(profile.to_json())
+    profile.emit(options['profile_log'])
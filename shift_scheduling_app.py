@@ -1,20 +1,63 @@
 from io import StringIO
 import numpy as np
+import os
 import sys
 import streamlit as st
 from typing import Optional
 
-from shift_scheduling import (Variables, build_cqm, call_solver, make_df, dow_chr, wd_chr, options)
+from shift_scheduling import worker_label, dow_chr, wd_chr, options, model_cache
+from solve_service import get_service
+
+# 解くのはサーバーで共有するジョブサービス（同時に使う人どうしで待たせない）
+service = get_service()
+
+def show_df(placeholder, df):
+    placeholder.dataframe(data=(df.style.applymap(lambda v: 'background-color: #fdd8d8;' if v == wd_chr[0] else 'background-color: #d9d0f4;')
+                                        .set_table_styles([{'selector':'*', 'props':'text-align: center;'}])))
+
+def show_profile(profile: dict):
+    with st.expander("【 計測 】"):
+        st.json(profile)
+
+def show_job(job_id: str, follow: bool = True):
+    """ジョブの最良解を表示する（follow のときは終わるまで、改善解が見つかるたびに表を描き直す）"""
+    table = st.empty()
+    status = st.empty()
+    incumbents = -1
+    while True:
+        job = service.wait(job_id, incumbents, timeout=1) if follow else service.status(job_id)
+        if job['incumbents'] != incumbents and job['schedule'] is not None:
+            show_df(table, job['schedule'].to_df(job['workers']))
+        incumbents = job['incumbents']
+        info = job['info']
+        if job['state'] == 'queued':
+            status.text(f"順番待ち（前に{job['queued']}件）")
+        elif info.get('gap') is not None:
+            state = {'running': "探索中", 'cancelled': "中断"}.get(job['state'], "時間制限で終了")
+            if info['status'] == 'OPTIMAL':
+                state = "最適解"
+            status.text(f"目的関数: {info['objective']:g}　ギャップ: {info['gap']:.2%}　経過: {info['run_time']:.1f}秒"
+                        + f"　（{state}）")
+        elif job['state'] == 'running':
+            status.text("探索中")
+        if job['state'] not in ('queued', 'running') or not follow:
+            break
+
+    if len(job['alternatives']) > 1:
+        # 作った候補を解き直さずに切り替える
+        alternatives = job['alternatives']
+        i = st.radio("候補：", range(len(alternatives)), key=f"alternative_{job_id}",
+                     format_func=lambda i: f"{i + 1}　目的関数: {job['objectives'][i]:g}　１番目と違うセル: "
+                                           f"{alternatives[i].distance(alternatives[0])}")
+        show_df(table, alternatives[i].to_df(job['workers']))
+        status.text(f"候補 {len(alternatives)} 件")
+    if job['state'] == 'failed':
+        status.error(job['error'])
+    if job['cached']:
+        st.caption(f"キャッシュから表示しました {model_cache.stats()}")
+    if job['profile'] is not None:
+        show_profile(job['profile'])
 
-def solve_shift_scheduling(opts: dict):
-    vars = Variables(opts)
-    cqm = build_cqm(opts, vars)
-    best_feasible = call_solver(cqm, opts)
-    df = make_df(best_feasible, opts, vars)
-
-    st.dataframe(data=(df.style.applymap(lambda v: 'background-color: #fdd8d8;' if v == wd_chr[0] else 'background-color: #d9d0f4;')
-                               .set_table_styles([{'selector':'*', 'props':'text-align: center;'}])))
-    
 st.set_page_config(layout="wide")
 st.markdown(
     "<h1 style='text-align: center;'>シフトスケジュール　テスト</h1>",
@@ -47,18 +90,29 @@ with st.expander("【 条件の種類 】"):
 with st.sidebar.expander("【 量子コンピュータ設定 】"):
     solver_type = st.radio(label="量子コンピュータを：",
                                 options=["使う (LeapHybridCQMSampler)",
-                                            "使わない (Python-MIP)"],
+                                            "使わない (Python-MIP)",
+                                            "使わない (ヒューリスティック)",
+                                            "使わない (分解・列生成)"],
                                 index=1)
     if solver_type == "使う (LeapHybridCQMSampler)":
         use_cqm_solver = True
     else:
         use_cqm_solver = False
+    use_heuristic_solver = solver_type == "使わない (ヒューリスティック)"
+    use_decomposition = solver_type == "使わない (分解・列生成)"
 
     time_limit = st.number_input(label="時間制限（秒）：", value=20)
+    portfolio_size = st.number_input(label="並列実行数（Python-MIP）：", min_value=1, max_value=os.cpu_count() or 1, value=1)
+    use_symmetry_ordering = st.checkbox("設定が同じワーカーを勤務の辞書順で並べる（Python-MIP）", value=False)
+    num_alternatives = st.number_input(label="候補の数：", min_value=1, max_value=5, value=1)
+    alternative_distance = st.number_input(label="候補どうしで違うセルの数（以上）：", min_value=1, value=10)
 
 with st.sidebar.expander("【 基本設定 】"):
-    workers_range = st.slider("人数：", min_value=5, max_value=26, value=20)
-    workers_list = [chr(ord('A') + w) for w in range(workers_range)]
+    workers_range = st.number_input("人数：", min_value=5, max_value=500, value=20)
+    workers_ids = [x.strip() for x in st.text_input("ワーカーID（カンマ区切り、空欄: A, B, ・・・）：").split(',') if x.strip()]
+    if workers_ids:
+        workers_range = len(workers_ids)
+    workers_list = workers_ids or [worker_label(w) for w in range(workers_range)]
     days_range = st.slider("日数：", min_value=28, max_value=31, value=30)
     fst_dow_chr = st.selectbox("開始曜日：", dow_chr)
     obj_sign = st.radio(label="できるだけ多くする：",
@@ -150,23 +204,46 @@ with st.sidebar.expander("【 特定の曜日を休みにする 】"):
     cond13_wrks = st.multiselect("対象者選択：",  workers_list, key="cond13_wrks")
 
 run_button = st.sidebar.button("Run")
-
-if run_button:
-
-    options['use_cqm_solver'] = use_cqm_solver
-    options['time_limit'] = time_limit
-
-    options['num_workers'] = workers_range
-    options['num_days'] = days_range
-    options['fst_dow'] = dow_chr.index(fst_dow_chr)
+preview_button = st.sidebar.button("Preview（ヒューリスティックで１秒）")
+stop_button = st.sidebar.button("Stop（現在の最良解で終了）")
+
+if stop_button and 'job_id' in st.session_state:
+    service.cancel(st.session_state['job_id'])
+
+if run_button or preview_button:
+
+    # 共有の options は変えずに、このセッションの設定を作る
+    opts = dict(options)
+    opts['use_cqm_solver'] = use_cqm_solver
+    opts['use_heuristic_solver'] = use_heuristic_solver
+    opts['use_decomposition'] = use_decomposition
+    opts['time_limit'] = time_limit
+    opts['portfolio_size'] = portfolio_size
+    opts['use_symmetry_ordering'] = use_symmetry_ordering
+    opts['num_alternatives'] = num_alternatives
+    opts['alternative_distance'] = alternative_distance
+
+    opts['num_workers'] = workers_range
+    opts['worker_ids'] = workers_ids or None
+    opts['num_days'] = days_range
+    opts['fst_dow'] = dow_chr.index(fst_dow_chr)
     if obj_sign == '出勤を':
-        options['obj_sign'] = -1
+        opts['obj_sign'] = -1
     else:
-        options['obj_sign'] = +1
+        opts['obj_sign'] = +1
 
     g_dict = globals()
-    for k in options.keys():
+    for k in opts.keys():
         if 'cond' in k:
-            options[k] = g_dict[k]
-
-    solve_shift_scheduling(options)
+            opts[k] = g_dict[k]
+
+    if preview_button:
+        opts = dict(opts, use_cqm_solver=False, use_heuristic_solver=True, time_limit=1)
+    st.session_state['job_id'] = service.submit(opts)
+
+# 最後に出したジョブを表示する（画面を操作しても解くのは続き、終わるまで表を描き直す）
+if 'job_id' in st.session_state:
+    try:
+        show_job(st.session_state['job_id'], follow=not stop_button)
+    except KeyError:
+        del st.session_state['job_id']
@@ -0,0 +1,223 @@
+import collections
+import concurrent.futures
+import copy
+import itertools
+import threading
+import time
+import typing
+
+from instrumentation import Profile
+from shift_scheduling import (Schedule, Variables, backend_name, build_cqm_cached, call_solver_pool, iter_solver,
+                              make_schedule, model_cache, submit_solver, worker_ids)
+
+
+class SolveJob:
+    """One submitted solve. Read it through :meth:`SolveService.status`;
+    the fields are updated by the worker thread.
+    """
+    def __init__(self, job_id: str, opts: dict):
+        self.id = job_id
+        self.opts = opts
+        self.state = 'queued'       # queued, running, done, failed, cancelled
+        self.schedule: typing.Optional[Schedule] = None
+        self.alternatives: typing.List[Schedule] = []
+        self.objectives: typing.List[float] = []
+        self.info: dict = dict()
+        self.incumbents = 0
+        self.error: typing.Optional[str] = None
+        self.cached = False
+        self.profile = Profile()
+        self.submitted = time.time()
+        self.finished: typing.Optional[float] = None
+        self.cancel = threading.Event()
+        self.changed = threading.Condition()
+        self.remote: typing.Optional[concurrent.futures.Future] = None
+
+
+class SolveService:
+    """Solve shift schedules in background threads so that callers (the
+    Streamlit app) do not block while CBC runs.
+
+    Jobs are queued and run by a pool of ``num_workers`` threads; CBC runs
+    in a worker process of each job, so the jobs solve in parallel and can
+    be cancelled while CBC is searching. Every job works on
+    its own copy of the options. Improved schedules are published as the
+    solver finds them, and a cancelled job keeps the best one so far.
+    Leap jobs are submitted through the shared LeapClient and do not hold
+    a worker thread while Leap solves them, so local jobs keep running.
+
+    Args:
+        num_workers: Number of jobs solved at once.
+        max_finished: Number of finished jobs kept for :meth:`status`;
+            older ones are forgotten.
+    """
+    def __init__(self, num_workers: int = 2, max_finished: int = 100):
+        self._pool = concurrent.futures.ThreadPoolExecutor(num_workers, thread_name_prefix='solve')
+        self._jobs: typing.Dict[str, SolveJob] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.max_finished = max_finished
+
+    def submit(self, opts: dict) -> str:
+        """Queue a solve of a snapshot of ``opts`` and return its job ID."""
+        job = SolveJob(f'job-{next(self._ids)}', copy.deepcopy(opts))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget()
+        self._pool.submit(self._run, job)
+        return job.id
+
+    def status(self, job_id: str) -> dict:
+        """A snapshot of the job: ``state``, the best ``schedule`` so far,
+        the solver ``info`` of it, ``incumbents``, ``error``, ``cached``,
+        ``workers``, the ``alternatives`` and their ``objectives`` (when
+        ``num_alternatives`` > 1) and the ``profile`` once the job has
+        finished.
+        Raises:
+            KeyError: If the job is unknown or has been forgotten.
+        """
+        job = self._job(job_id)
+        queued = self._position(job)
+        with job.changed:
+            return dict(id=job.id, state=job.state, schedule=job.schedule, info=dict(job.info),
+                        incumbents=job.incumbents, error=job.error, cached=job.cached,
+                        alternatives=list(job.alternatives), objectives=list(job.objectives),
+                        workers=worker_ids(job.opts), queued=queued,
+                        profile=job.profile.to_dict() if job.finished else None)
+
+    def wait(self, job_id: str, incumbents: int, timeout: typing.Optional[float] = None) -> dict:
+        """Wait until the job has more than ``incumbents`` schedules or has
+        finished, then return its :meth:`status`."""
+        job = self._job(job_id)
+        with job.changed:
+            job.changed.wait_for(lambda: job.incumbents > incumbents or job.finished is not None, timeout)
+        return self.status(job_id)
+
+    def cancel(self, job_id: str):
+        """Stop the job, keeping its best schedule so far.
+        A Python-MIP or portfolio search runs in worker processes, which
+        are stopped at once, also while CBC is searching. The heuristic and
+        decomposition solvers run to their time limit first. A job
+        waiting for Leap is cancelled at once, and so is its problem in
+        Leap."""
+        job = self._job(job_id)
+        job.cancel.set()
+        if job.remote is not None:
+            self._cancel_remote(job)
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel.set()
+        self._pool.shutdown(wait=True)
+
+    def _job(self, job_id: str) -> SolveJob:
+        with self._lock:
+            return self._jobs[job_id]
+
+    def _position(self, job: SolveJob) -> int:
+        """Number of queued jobs ahead of ``job`` (0 once it runs)."""
+        if job.state != 'queued':
+            return 0
+        with self._lock:
+            ahead = itertools.takewhile(lambda j: j is not job, self._jobs.values())
+            return sum(j.state == 'queued' for j in ahead)
+
+    def _forget(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _update(self, job: SolveJob, **fields):
+        with job.changed:
+            for k, v in fields.items():
+                setattr(job, k, v)
+            job.changed.notify_all()
+
+    def _finish(self, job: SolveJob, **fields):
+        """Finish the job unless it has finished already (a cancelled Leap job)."""
+        with job.changed:
+            if job.finished is None:
+                self._update(job, finished=time.time(), **fields)
+
+    def _cancel_remote(self, job: SolveJob):
+        self._finish(job, state='cancelled')
+        job.remote.cancel()
+
+    def _finish_remote(self, job: SolveJob, vars: Variables, future: concurrent.futures.Future):
+        try:
+            best_feasible = future.result()
+            with job.profile.phase('make_df'):
+                schedule = make_schedule(best_feasible, job.opts, vars)
+        except Exception as e:
+            self._finish(job, state='failed', error=str(e))
+            return
+        job.profile.emit(job.opts['profile_log'])
+        model_cache.put_sample(job.opts, best_feasible)
+        self._finish(job, schedule=schedule, incumbents=1, state='done')
+
+    def _run(self, job: SolveJob):
+        if job.cancel.is_set():
+            self._update(job, state='cancelled', finished=time.time())
+            return
+        self._update(job, state='running')
+        opts, profile = job.opts, job.profile
+        try:
+            vars, cqm = build_cqm_cached(opts, profile)
+
+            if opts['num_alternatives'] > 1:
+                # several distinct schedules at once, kept for flipping between them
+                samples = call_solver_pool(cqm, opts, vars, profile=profile)
+                with profile.phase('make_df'):
+                    schedules = [make_schedule(sample, opts, vars) for sample in samples]
+                profile.emit(opts['profile_log'])
+                self._update(job, schedule=schedules[0], alternatives=schedules, incumbents=len(schedules),
+                             objectives=[float(cqm.objective.energy(sample)) for sample in samples],
+                             state='done', finished=time.time())
+                return
+
+            # solved before with the same options
+            best_feasible = model_cache.get_sample(opts)
+            if best_feasible is not None:
+                with profile.phase('make_df'):
+                    schedule = make_schedule(best_feasible, opts, vars)
+                self._update(job, schedule=schedule, incumbents=1, cached=True, state='done', finished=time.time())
+                return
+
+            if backend_name(opts) == 'leap':
+                future = submit_solver(cqm, opts, profile=profile)
+                self._update(job, remote=future)
+                future.add_done_callback(lambda f: self._finish_remote(job, vars, f))
+                if job.cancel.is_set():
+                    # cancelled while it was being submitted
+                    self._cancel_remote(job)
+                return
+
+            for best_feasible, info in iter_solver(cqm, opts, stop=job.cancel, profile=profile):
+                with profile.phase('make_df'):
+                    schedule = make_schedule(best_feasible, opts, vars)
+                self._update(job, schedule=schedule, info=info, incumbents=job.incumbents + 1)
+                if job.cancel.is_set():
+                    break
+            profile.emit(opts['profile_log'])
+            if job.cancel.is_set():
+                self._update(job, state='cancelled', finished=time.time())
+                return
+            model_cache.put_sample(opts, best_feasible)
+            self._update(job, state='done', finished=time.time())
+        except Exception as e:
+            self._update(job, state='failed', error=str(e), finished=time.time())
+
+
+_service: typing.Optional[SolveService] = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> SolveService:
+    """The service shared by every session of the app (created on first use)."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SolveService()
+        return _service
@@ -0,0 +1,42 @@
+import concurrent.futures
+import time
+
+import pytest
+
+from benchmark import make_options
+from leap_client import FakeLeapSampler, LeapClient
+from shift_scheduling import Variables, build_cqm
+
+
+def _cqm():
+    opts = make_options(num_workers=4, num_days=28, cond07_wrk_chk=True, cond07_wrk_cnt=2)
+    return build_cqm(opts, Variables(opts))
+
+
+def _until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_cancel_future_cancels_problem_in_leap():
+    sampler = FakeLeapSampler(latency=30)
+    client = LeapClient(lambda: sampler)
+    future = client.submit(_cqm(), 1)
+    assert _until(lambda: sampler.submitted == 1)
+    assert future.cancel()
+    # Leap の問題も取り消す
+    assert _until(lambda: sampler.cancelled == 1)
+    with pytest.raises(concurrent.futures.CancelledError):
+        future.result()
+    client.shutdown()
+
+
+def test_result_arrives():
+    sampler = FakeLeapSampler(latency=0)
+    client = LeapClient(lambda: sampler)
+    res = client.submit(_cqm(), 1).result(timeout=30)
+    assert res.filter(lambda d: d.is_feasible)
+    assert sampler.cancelled == 0
+    client.shutdown()
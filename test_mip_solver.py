@@ -0,0 +1,26 @@
+import logging
+
+import mip_solver
+from benchmark import make_options
+from mip_solver import MIPCQMSolver, _cbc_function
+from shift_scheduling import Variables, build_cqm
+
+
+def test_missing_cbc_function_is_logged_once(caplog):
+    with caplog.at_level(logging.WARNING, logger='mip_solver'):
+        for _ in range(2):
+            assert _cbc_function('Cbc_noSuchFunction', "int Cbc_noSuchFunction(Cbc_Model *model);") is None
+    assert [r.getMessage().split(' (')[0] for r in caplog.records] == ['CBC function Cbc_noSuchFunction is not available']
+
+
+def test_fallback_without_cbc_functions_gives_same_result(monkeypatch):
+    opts = make_options(num_workers=8, num_days=28, cond01_all_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=4)
+    cqm = build_cqm(opts, Variables(opts))
+    bulk = MIPCQMSolver.sample_cqm(cqm, time_limit=30)
+    # Python-MIP の API だけで行を足し、解を読む
+    for name in ['Cbc_loadProblem', 'Cbc_savedSolution', 'Cbc_getNodeCount']:
+        monkeypatch.setitem(mip_solver._cbc_functions, name, None)
+    fallback = MIPCQMSolver.sample_cqm(cqm, time_limit=30)
+    assert fallback.info['status'] == bulk.info['status'] == 'OPTIMAL'
+    assert fallback.first.energy == bulk.first.energy
+    assert 'nodes' not in fallback.info
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+from dimod import Binary, ConstrainedQuadraticModel
+
+from model_cache import ModelCache
+
+
+def _cqm() -> ConstrainedQuadraticModel:
+    x, y = Binary('x'), Binary('y')
+    cqm = ConstrainedQuadraticModel()
+    cqm.set_objective(-x - y)
+    cqm.add_constraint(x + y <= 1, label='c')
+    return cqm
+
+
+def _exts(directory) -> list:
+    return sorted(os.path.splitext(f)[1] for f in os.listdir(directory))
+
+
+def test_entries_survive_a_new_instance(tmp_path):
+    opts = dict(num_workers=3)
+    cache = ModelCache(str(tmp_path))
+    cache.put_model(opts, _cqm(), rep=np.arange(3))
+    cache.put_sample(opts, dict(x=1, y=0))
+    # 一時ファイルは残さない
+    assert _exts(tmp_path) == ['.cqm', '.json', '.npz']
+
+    other = ModelCache(str(tmp_path))
+    cqm, arrays = other.get_model(opts)
+    assert cqm.is_equal(_cqm())
+    assert arrays['rep'].tolist() == [0, 1, 2]
+    assert other.get_sample(opts) == dict(x=1, y=0)
+    assert other.stats()['disk_hits'] == 2
+
+
+@pytest.mark.parametrize('ext', ['.cqm', '.npz', '.json'])
+def test_unreadable_entry_is_a_miss_and_removed(tmp_path, ext):
+    opts = dict(num_workers=3)
+    ModelCache(str(tmp_path)).put_model(opts, _cqm(), rep=np.arange(3))
+    ModelCache(str(tmp_path)).put_sample(opts, dict(x=1, y=0))
+    name = next(f for f in os.listdir(tmp_path) if f.endswith(ext))
+    with open(tmp_path / name, 'r+b') as f:
+        f.truncate(5)
+
+    cache = ModelCache(str(tmp_path))
+    get = cache.get_sample if ext == '.json' else cache.get_model
+    assert get(opts) is None
+    assert cache.stats()['misses'] == 1 and cache.stats()['discarded'] == 1
+    # 壊れた項目のファイルはすべて消す
+    kept = ['.cqm', '.npz'] if ext == '.json' else ['.json']
+    assert _exts(tmp_path) == kept
+
+
+def test_failed_write_leaves_no_file(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(np, 'savez', fail)
+    cache = ModelCache(str(tmp_path))
+    with pytest.raises(OSError):
+        cache.put_model(dict(num_workers=3), _cqm(), rep=np.arange(3))
+    assert _exts(tmp_path) == ['.cqm']
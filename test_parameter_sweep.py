@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from benchmark import make_options
+from instrumentation import Profile
+from mip_solver import MIPCQMSolver
+from parameter_sweep import SweepModel, run_sweep
+from shift_scheduling import Variables, build_cqm, call_solver
+
+
+def _opts(**kwargs) -> dict:
+    base = dict(num_workers=8, num_days=28, time_limit=30, explain_time_limit=0, cond01_all_chk=True,
+                cond03_sel_chk=True, cond03_sel_wrks=['H'], cond04_all_chk=True, cond04_all_cnt=9,
+                cond07_wrk_chk=True, cond07_wrk_cnt=4, cond07_hol_chk=True, cond07_hol_cnt=3)
+    return make_options(**dict(base, **kwargs))
+
+
+def _arrays(cqm) -> dict:
+    return {k: v for k, v in MIPCQMSolver._csr_arrays(cqm).items() if isinstance(v, np.ndarray)}
+
+
+def test_sweep_replaces_rhs_of_changed_conditions():
+    values = dict(cond07_wrk_cnt=[3, 4, 5], cond04_all_cnt=[8, 9])
+    results = run_sweep(_opts(), values)
+    assert [r['rebuilt'] for r in results] == [True] + [False] * 5
+    # 作り直した場合と同じ最適値
+    for r in results:
+        opts = _opts(cond07_wrk_cnt=r['cond07_wrk_cnt'], cond04_all_cnt=r['cond04_all_cnt'])
+        cqm = build_cqm(opts, Variables(opts))
+        assert r['status'] == 'ok'
+        assert r['objective'] == cqm.objective.energy(call_solver(cqm, opts))
+
+
+def test_updated_model_matches_new_model():
+    keys = ['cond07_wrk_cnt', 'cond04_all_cnt']
+    model = SweepModel(_opts(), Profile(), keys)
+    assert model.update(_opts(cond07_wrk_cnt=6, cond04_all_cnt=10), Profile())
+    new = SweepModel(_opts(cond07_wrk_cnt=6, cond04_all_cnt=10), Profile(), keys)
+    updated, expected = _arrays(model.cqm), _arrays(new.cqm)
+    assert updated.keys() == expected.keys()
+    assert all(np.array_equal(updated[k], expected[k]) for k in expected)
+
+
+@pytest.mark.parametrize('opts, rebuilt', [
+    # 形が変わる（1. の日数）・presolve で代入する条件（3.）・条件でない設定は作り直す
+    (dict(cond01_all_days=3), True),
+    (dict(cond03_sel_wrks=['G']), True),
+    (dict(obj_sign=1), True),
+    # ソルバーの設定だけなら作り直さない
+    (dict(time_limit=5), False),
+])
+def test_update_rebuilds_when_rows_change(opts, rebuilt):
+    model = SweepModel(_opts(), Profile(), opts.keys())
+    assert model.update(_opts(**opts), Profile()) is not rebuilt
+
+
+def test_update_rebuilds_without_array_builder():
+    model = SweepModel(_opts(use_array_builder=False), Profile(), ['cond07_wrk_cnt'])
+    assert not model.update(_opts(use_array_builder=False, cond07_wrk_cnt=5), Profile())
+
+
+def test_failed_points_do_not_stop_the_sweep():
+    results = run_sweep(_opts(worker_ids=list('ABCDEFGH')), dict(num_workers=[8, 9], cond07_wrk_cnt=[4, 20]))
+    statuses = {(r['num_workers'], r['cond07_wrk_cnt']): r['status'] for r in results}
+    # 人数より多い 7. は事前チェックで矛盾、worker_ids の数が違うのはエラー
+    assert statuses == {(8, 4): 'ok', (8, 20): 'infeasible', (9, 20): 'error', (9, 4): 'error'}
+    assert next(r for r in results if r['status'] == 'infeasible')['conditions'] == [7]
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+from benchmark import make_options
+from portfolio_solver import MIPPortfolioCQMSolver
+from shift_scheduling import Variables, build_cqm
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _cqm():
+    opts = make_options(num_workers=10, num_days=30, cond01_all_chk=True, cond05_chk=True, cond07_wrk_chk=True,
+                        cond07_wrk_cnt=6, obj_sign=1)
+    return build_cqm(opts, Variables(opts))
+
+
+def test_improving_solutions_until_optimal():
+    cqm = _cqm()
+    found = list(MIPPortfolioCQMSolver(2).iter_sample_cqm(cqm, time_limit=60))
+    objectives = [s.info['objective'] for s in found]
+    assert objectives == sorted(objectives, reverse=True)
+    assert found[-1].info['status'] == 'OPTIMAL'
+    assert found[-1].first.energy == MIPPortfolioCQMSolver(1).sample_cqm(cqm, time_limit=60).first.energy
+
+
+def test_stop_ends_search():
+    stop = threading.Event()
+    stop.set()
+    t = time.perf_counter()
+    sampleset = MIPPortfolioCQMSolver(2).sample_cqm(_cqm(), time_limit=60, stop=stop)
+    assert time.perf_counter() - t < 5
+    assert sampleset.info['status'] == 'NO_SOLUTION_FOUND'
+
+
+def test_script_without_main_guard(tmp_path):
+    # the workers must not re-run the caller's script
+    script = tmp_path / 'script.py'
+    script.write_text(textwrap.dedent('''
+        from test_portfolio_solver import _cqm
+        from portfolio_solver import MIPPortfolioCQMSolver
+        print('status', MIPPortfolioCQMSolver(2).sample_cqm(_cqm(), time_limit=10).info['status'])
+    '''))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get('PYTHONPATH')])))
+    proc = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, env=env, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.count('status') == 1
@@ -0,0 +1,166 @@
+import collections
+
+import pytest
+
+from benchmark import builder_cases, make_options, same_model
+from mip_solver import MIPCQMSolver
+from shift_scheduling import (FIXED_CELLS, Variables, build_cqm, df_to_array, expand_sample, explain_infeasibility,
+                              make_df, make_schedule, quick_conflicts, worker_ids)
+
+
+def _cases() -> dict:
+    cases = builder_cases()
+    cases.update({
+        '3,10,12,13': make_options(num_workers=26, num_days=31, cond03_sel_chk=True, cond03_sel_wrks=list('ABCDE'),
+                                   cond07_wrk_chk=True, cond07_wrk_cnt=12, cond01_all_chk=True, cond05_chk=True,
+                                   cond10_chk=True, cond10_wrks_A=list('KLMN'), cond10_wrks_B=list('OPQ'),
+                                   cond12_chk=True, cond12_days=list(range(10, 20)), cond12_wrks=list('RSTU'),
+                                   cond13_chk=True, cond13_dows=['水'], cond13_wrks=list('VWXYZ')),
+        '2,4,8,11 pairwise': make_options(num_workers=12, num_days=30, fst_dow=5,
+                                          cond02_all_chk=True, cond02_all_cnt=1, cond04_all_chk=True,
+                                          cond08_all_chk=True, cond08_all_days=12, use_pairwise_exclusion=True,
+                                          cond11_chk=True, cond11_wrks_A=list('ABC'), cond11_wrks_B=list('DE')),
+        'symmetry ordering': make_options(num_workers=10, num_days=28, cond01_all_chk=True, cond07_wrk_chk=True,
+                                 cond07_wrk_cnt=6, use_symmetry_ordering=True),
+        'full lex ordering': make_options(num_workers=10, num_days=28, fst_dow=3, cond01_all_chk=True,
+                                          cond02_all_chk=True, cond07_wrk_chk=True, cond07_wrk_cnt=6,
+                                          use_symmetry_ordering=True, ordering_days=0),
+        'fixed off': make_options(num_workers=8, num_days=28, cond07_wrk_chk=True, cond07_wrk_cnt=4,
+                                  fixed_off_cells=[('A', 1), ('C', 7), ('H', 28)]),
+    })
+    return cases
+
+
+# 答えのあるケース（解いて比べるテストで使う）
+_feasible = ['1,5,6,7,9', 'all', '3,10,12,13', 'symmetry ordering', 'fixed off']
+
+
+def _build(opts: dict, array: bool):
+    # 前処理と冗長な制約の削除は配列で構築するときだけなので、比べるときは外す
+    opts = dict(opts, use_array_builder=array, use_presolve=False, use_tightening=False)
+    return build_cqm(opts, Variables(opts))
+
+
+def _mip_rows(cqm) -> collections.Counter:
+    """Python-MIPに渡す行（変数のラベル・係数・上下限）の集まり"""
+    arrays = MIPCQMSolver._csr_arrays(cqm)
+    labels = list(cqm.variables)
+    rows = collections.Counter()
+    for r in range(len(arrays['row_lb'])):
+        cols = slice(arrays['indptr'][r], arrays['indptr'][r + 1])
+        terms = tuple(sorted(zip((labels[j] for j in arrays['indices'][cols]), arrays['data'][cols].tolist())))
+        rows[terms, float(arrays['row_lb'][r]), float(arrays['row_ub'][r])] += 1
+    return rows
+
+
+def _optimum(opts: dict, **flags) -> tuple:
+    opts = dict(opts, **flags)
+    vars = Variables(opts)
+    sampleset = MIPCQMSolver.sample_cqm(build_cqm(opts, vars), time_limit=60)
+    assert sampleset.info['status'] == 'OPTIMAL'
+    return vars, sampleset.first
+
+
+@pytest.mark.parametrize('name', list(_cases()))
+def test_array_builder_matches_expressions(name):
+    opts = _cases()[name]
+    expression, array = _build(opts, False), _build(opts, True)
+    assert same_model(expression, array)
+    assert _mip_rows(expression) == _mip_rows(array)
+
+
+@pytest.mark.parametrize('cells', [[('A', 1), ('Z', 3)], [('A', 0)], [('B', 29)]])
+def test_fixed_off_cells_errors_match(cells):
+    opts = make_options(num_workers=8, num_days=28, fixed_off_cells=cells)
+    errors = []
+    for array in [False, True]:
+        with pytest.raises(ValueError) as e:
+            _build(opts, array)
+        errors.append(str(e.value))
+    assert errors[0] == errors[1]
+
+
+def test_fixed_off_cells_reported_as_own_tag():
+    # 12. を使っていなくても、休みにするセルは条件12ではなく FIXED_CELLS として知らせる
+    opts = make_options(num_workers=4, num_days=28, cond07_wrk_chk=True, cond07_wrk_cnt=4, fixed_off_cells=[('A', 2)])
+    assert quick_conflicts(opts) == [7, FIXED_CELLS]
+    assert explain_infeasibility(opts) == [7, FIXED_CELLS]
+
+
+@pytest.mark.parametrize('name', _feasible)
+def test_presolve_keeps_optimum(name):
+    opts = dict(_cases()[name], use_tightening=False)
+    assert _optimum(opts, use_presolve=True)[1].energy == _optimum(opts, use_presolve=False)[1].energy
+
+
+@pytest.mark.parametrize('name', _feasible)
+def test_tightening_keeps_optimum(name):
+    for presolve in [False, True]:
+        opts = dict(_cases()[name], use_presolve=presolve)
+        assert _optimum(opts, use_tightening=True)[1].energy == _optimum(opts, use_tightening=False)[1].energy
+
+
+@pytest.mark.parametrize('name', ['3,10,12,13', 'fixed off'])
+def test_schedule_expands_presolved_variables(name):
+    # 固定した変数と、統合した変数（10. のグループ）の値を代表変数から戻す
+    opts = _cases()[name]
+    vars, best = _optimum(opts, use_presolve=True)
+    sample = dict(best.sample)
+    assert len(sample) < len(vars.labels)
+    full = expand_sample(sample, vars)
+    assert set(full) == set(vars.labels)
+    assert all(full[label] == sample[label] for label in sample)
+    assert make_schedule(sample, opts, vars).is_valid(opts)
+    df = make_df(sample, opts, vars)
+    assert list(df.index) == worker_ids(opts)
+    expected = [[full[vars.labels[i]] for i in row] for row in vars.wd_idx.tolist()]
+    assert df_to_array(df).tolist() == expected
+
+
+@pytest.mark.parametrize('name', _feasible)
+def test_quick_conflicts_accepts_feasible(name):
+    # 答えがあることは test_presolve_keeps_optimum で確かめている
+    assert quick_conflicts(_cases()[name]) is None
+
+
+@pytest.mark.parametrize('case, conflict', [
+    (dict(cond03_all_chk=True, cond07_hol_chk=True, cond07_hol_cnt=5), [3, 7]),
+    (dict(cond06_all_chk=True, cond06_all_days=3, cond09_all_chk=True, cond09_all_days=5), [6, 9]),
+    (dict(cond04_all_chk=True, cond04_all_cnt=10, cond08_all_chk=True, cond08_all_days=24), [4, 8]),
+    (dict(cond11_chk=True, cond11_wrks_A=list('ABCDEFGH'), cond07_wrk_chk=True, cond07_wrk_cnt=14), [7, 11]),
+    (dict(cond02_all_chk=True, cond02_all_cnt=3, cond07_hol_chk=True, cond07_hol_cnt=10), [2, 7]),
+])
+def test_conflicting_conditions_named(case, conflict):
+    opts = make_options(num_workers=20, num_days=30, **case)
+    assert quick_conflicts(opts) == conflict
+    assert explain_infeasibility(opts) == conflict
+
+
+def test_explain_finds_conflict_precheck_misses():
+    # 数えるだけでは分からず、解いて初めて分かる矛盾
+    opts = make_options(num_workers=20, num_days=30, cond01_all_chk=True, cond01_all_days=3, cond02_all_chk=True,
+                        cond02_all_cnt=2, cond05_chk=True, cond06_all_chk=True, cond06_all_days=1,
+                        cond07_wrk_chk=True, cond07_wrk_cnt=17, cond07_hol_chk=True, cond07_hol_cnt=10)
+    assert quick_conflicts(opts) is None
+    assert explain_infeasibility(opts, time_limit=30) == [1, 7]
+
+
+@pytest.mark.parametrize('ids', [['A', 'B', 'A'], ['1', 1, 'C']])
+def test_duplicate_worker_ids_rejected(ids):
+    opts = make_options(num_workers=3, num_days=28, worker_ids=ids)
+    with pytest.raises(ValueError, match='同じID'):
+        worker_ids(opts)
+    for array in [False, True]:
+        with pytest.raises(ValueError, match='同じID'):
+            _build(opts, array)
+
+
+@pytest.mark.parametrize('ordering_days', [1, 2, 0])
+def test_symmetry_ordering_sorts_workers(ordering_days):
+    # 入れ替えただけの答えを除いても最適値は変わらず、同じ設定のワーカーは比べる日の勤務の辞書順に並ぶ
+    opts = make_options(num_workers=6, num_days=28, cond01_all_chk=True, cond03_sel_chk=True, cond03_sel_wrks=['F'],
+                        cond07_wrk_chk=True, cond07_wrk_cnt=3, obj_sign=1)
+    vars, best = _optimum(dict(opts, use_symmetry_ordering=True, ordering_days=ordering_days))
+    assert best.energy == _optimum(opts)[1].energy
+    rows = make_schedule(best.sample, opts, vars).to_array()[:5, :ordering_days or None].tolist()
+    assert rows == sorted(rows, reverse=True)
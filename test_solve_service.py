@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import shift_scheduling
+import solve_service
+from benchmark import make_options
+from leap_client import FakeLeapSampler, LeapClient, set_leap_client
+from model_cache import ModelCache
+from solve_service import SolveService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    # 前に解いた答えが返らないように、空のキャッシュを使う
+    cache = ModelCache(str(tmp_path))
+    monkeypatch.setattr(shift_scheduling, 'model_cache', cache)
+    monkeypatch.setattr(solve_service, 'model_cache', cache)
+    service = SolveService(num_workers=1)
+    yield service
+    service.shutdown()
+
+
+def _finished(service: SolveService, job_id: str, timeout: float = 60) -> dict:
+    deadline = time.monotonic() + timeout
+    status = service.status(job_id)
+    while status['state'] in ('queued', 'running') and time.monotonic() < deadline:
+        status = service.wait(job_id, status['incumbents'], timeout=1)
+    return status
+
+
+@pytest.mark.parametrize('backend', ['use_heuristic_solver', 'use_decomposition'])
+def test_local_backend_job_finishes(service, backend):
+    opts = make_options(num_workers=8, num_days=28, time_limit=2, cond01_all_chk=True, cond07_wrk_chk=True,
+                        cond07_wrk_cnt=4, **{backend: True})
+    status = _finished(service, service.submit(opts))
+    assert status['state'] == 'done', status['error']
+    assert not status['cached']
+    assert status['schedule'].is_valid(opts)
+    assert status['profile']['phases']['optimize']['wall'] > 0
+    assert shift_scheduling.model_cache.get_sample(opts) is not None
+
+
+def test_mip_job_reports_incumbents(service):
+    opts = make_options(num_workers=8, num_days=28, time_limit=30, cond01_all_chk=True, cond07_wrk_chk=True,
+                        cond07_wrk_cnt=4)
+    status = _finished(service, service.submit(opts))
+    assert status['state'] == 'done', status['error']
+    assert status['incumbents'] >= 1
+    assert status['info']['status'] == 'OPTIMAL'
+    assert status['schedule'].is_valid(opts)
+
+
+def test_cancel_stops_running_mip_search(service):
+    # 全員が同じ設定で、最適性の証明に時間がかかるケース
+    opts = make_options(num_workers=60, num_days=30, time_limit=120, cond01_all_chk=True, cond01_all_days=3,
+                        cond02_all_chk=True, cond02_all_cnt=2, cond05_chk=True, cond06_all_chk=True,
+                        cond06_all_days=1, cond07_wrk_chk=True, cond07_wrk_cnt=39, cond07_hol_chk=True,
+                        cond07_hol_cnt=24, obj_sign=1)
+    job_id = service.submit(opts)
+    while service.status(job_id)['state'] == 'queued':
+        time.sleep(0.1)
+    time.sleep(1)
+    t = time.monotonic()
+    service.cancel(job_id)
+    status = _finished(service, job_id)
+    assert status['state'] == 'cancelled'
+    assert time.monotonic() - t < 5
+
+
+def test_cancel_leap_job_cancels_problem(service):
+    sampler = FakeLeapSampler(latency=30)
+    set_leap_client(LeapClient(lambda: sampler))
+    try:
+        opts = make_options(num_workers=8, num_days=28, cond07_wrk_chk=True, cond07_wrk_cnt=4, use_cqm_solver=True)
+        job_id = service.submit(opts)
+        deadline = time.monotonic() + 10
+        while sampler.submitted == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        service.cancel(job_id)
+        assert service.status(job_id)['state'] == 'cancelled'
+        # Leap の問題も取り消す（結果を待たない）
+        while sampler.cancelled == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert sampler.cancelled == 1
+    finally:
+        set_leap_client(None)